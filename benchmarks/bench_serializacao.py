@@ -0,0 +1,56 @@
+"""
+Serialização do catálogo de alimentos (ww_data.json) em 1k, 10k e 100k itens: o formato antigo
+(json indentado), serializar_json (compacto; orjson se instalado) e o gzip opcional (WW_JSON_GZIP=1).
+
+    python benchmarks/bench_serializacao.py [--repeticoes 5] [--tamanhos 1000 10000 100000]
+"""
+import argparse
+import gzip
+import json
+import random
+
+from comum import cronometrar, importar_app, ms
+
+NUTRIENTES = ["Calorias", "Carbo", "Gordura", "Saturada", "Fibra", "Açúcar", "Proteina", "Sodio_mg"]
+
+
+def catalogo(n, semente=0):
+    """n alimentos com os mesmos campos do catálogo do app."""
+    rnd = random.Random(semente)
+    itens = []
+    for i in range(n):
+        item = {"Nome": f"Alimento {i} ({rnd.choice(['cozido', 'cru', 'grelhado', 'integral'])})",
+                "Porcao": rnd.choice([30.0, 50.0, 100.0, 200.0])}
+        item.update({nutriente: round(rnd.uniform(0, 60), 2) for nutriente in NUTRIENTES})
+        item["ZeroPontos"] = rnd.random() < 0.1
+        item["Pontos"] = rnd.randint(0, 20)
+        itens.append(item)
+    return {"alimentos": itens}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    app = importar_app()
+
+    formatos = [
+        ("json indent=4 (antigo)", lambda d: json.dumps(d, ensure_ascii=False, default=str, indent=4).encode("utf-8")),
+        ("serializar_json", app.serializar_json),
+        ("serializar_json + gzip", lambda d: gzip.compress(app.serializar_json(d), compresslevel=6)),
+    ]
+    print(f"orjson: {'sim' if app.orjson is not None else 'não (json da stdlib)'}; melhor de {args.repeticoes} execuções")
+    print(f"{'itens':>7}  {'formato':<24} {'gravar':>12} {'ler':>12} {'tamanho':>10}")
+    for n in args.tamanhos:
+        dados = catalogo(n)
+        for nome, serializar in formatos:
+            conteudo = serializar(dados)
+            assert app.desserializar_json(conteudo) == dados
+            gravar = min(cronometrar(lambda: serializar(dados), args.repeticoes))
+            ler = min(cronometrar(lambda: app.desserializar_json(conteudo), args.repeticoes))
+            print(f"{n:>7}  {nome:<24} {ms(gravar)} {ms(ler)} {len(conteudo) / 1024:>7.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
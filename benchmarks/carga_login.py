@@ -0,0 +1,63 @@
+"""
+Carga de login: N logins simultâneos por verificar_credenciais (o KDF roda no pool de SENHA_WORKERS
+threads), com senhas certas, erradas e emails inexistentes. Mostra p50/p99 da latência de cada login
+e a vazão; o p99 cresce com N/SENHA_WORKERS, já que os logins excedentes esperam na fila do pool.
+
+    python benchmarks/carga_login.py [--logins 64] [--usuarios 16]
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comum import importar_app, ms, percentil
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64, help="logins simultâneos")
+    parser.add_argument("--usuarios", type=int, default=16, help="usuários cadastrados")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args()
+    app = importar_app()
+
+    diretorio = app.get_diretorio_usuarios()
+    for i in range(args.usuarios):
+        diretorio.cadastrar(f"u{i}@x", {"password_hash": app.gerar_hash_senha(f"senha{i}")})
+    app.hash_senha_ficticio()
+
+    rnd = random.Random(args.semente)
+    tentativas = []
+    for _ in range(args.logins):
+        i = rnd.randrange(args.usuarios)
+        caso = rnd.choice(["certa", "errada", "inexistente"])
+        email = f"u{i}@x" if caso != "inexistente" else f"nao{i}@x"
+        tentativas.append((caso, email, f"senha{i}" if caso != "errada" else "errada"))
+
+    largada = threading.Barrier(args.logins)
+
+    def logar(tentativa):
+        caso, email, senha = tentativa
+        largada.wait()  # todos os logins chegam juntos, como num pico
+        inicio = time.perf_counter()
+        ok = app.verificar_credenciais(email, senha)
+        assert ok == (caso == "certa"), tentativa
+        return caso, time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.logins) as executor:
+        resultados = list(executor.map(logar, tentativas))
+    total = time.perf_counter() - inicio
+
+    print(f"{args.logins} logins simultâneos, pool de {app.SENHA_WORKERS} workers, scrypt n={app.SENHA_SCRYPT_N}")
+    print(f"{'caso':<12} {'logins':>6} {'p50':>12} {'p99':>12}")
+    for caso in ["certa", "errada", "inexistente", "todos"]:
+        tempos = [t for c, t in resultados if caso in (c, "todos")]
+        if tempos:
+            print(f"{caso:<12} {len(tempos):>6} {ms(percentil(tempos, 50))} {ms(percentil(tempos, 99))}")
+    print(f"vazão: {args.logins / total:.1f} logins/s ({ms(total).strip()} no total)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Utilitários compartilhados pelos scripts de benchmark (python benchmarks/<script>.py)."""
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importar_app():
+    """
+    Importa o app fora do `streamlit run` (modo bare), numa pasta temporária que vira o diretório atual:
+    os arquivos que o benchmark gravar (usuários, dados, locks) não tocam os dados reais.
+    """
+    from streamlit import config, logger
+
+    config.get_option("logger.level")  # lê a configuração antes, para ela não restaurar o nível do log
+    logger.set_log_level("error")  # sem os avisos do modo bare a cada chamada st.*
+    config.set_option("global.showWarningOnDirectExecution", False)
+    os.chdir(tempfile.mkdtemp(prefix="ww_bench_"))
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    return importlib.import_module("ww_dashboard_streamlit")
+
+
+def cronometrar(funcao, repeticoes):
+    """Tempos (s) de `repeticoes` chamadas de funcao()."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def percentil(tempos, p):
+    """Percentil p (1-99) dos tempos, com interpolação linear."""
+    if len(tempos) == 1:
+        return tempos[0]
+    return statistics.quantiles(tempos, n=100, method="inclusive")[p - 1]
+
+
+def ms(segundos):
+    return f"{segundos * 1000:9.2f} ms"
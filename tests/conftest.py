@@ -0,0 +1,36 @@
+import importlib
+import logging
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    O módulo do app importado fora do `streamlit run` (modo bare): as classes e funções ficam disponíveis
+    e a interface não faz nada sem sessão. O import roda numa pasta temporária, já que o app usa caminhos
+    relativos ao diretório atual.
+    """
+    import streamlit  # noqa: F401  (cria os loggers antes de silenciá-los)
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    anterior = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("import"))
+    try:
+        if RAIZ not in sys.path:
+            sys.path.insert(0, RAIZ)
+        return importlib.import_module("ww_dashboard_streamlit")
+    finally:
+        os.chdir(anterior)
+
+
+@pytest.fixture
+def pasta(tmp_path, monkeypatch):
+    """Diretório de trabalho temporário para os arquivos do app (data_*.json, journals, locks...)."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,112 @@
+import json
+import os
+import random
+
+import pytest
+
+PALAVRAS = ["Maçã", "maca", "Pão", "pao", "de", "Queijo", "Açaí", "acai", "Feijão", "Arroz", "integral", "Óleo",
+            "ÉCLAIR", "éclair", "São", "Tomé", "coração", "Coco", "côco", "a"]
+
+
+def alimento(nome, porcao=100.0, pontos=1):
+    return {"Nome": nome, "Porcao": porcao, "Pontos": pontos}
+
+
+def test_indice_separa_o_mesmo_nome_em_porcoes_diferentes(app):
+    catalogo = [alimento("Arroz", 100.0, 3), alimento("Arroz", 150.0, 5), alimento("Feijão", 80.0, 2)]
+    indice = app.IndiceCatalogo(catalogo)
+
+    chaves = indice.buscar("arr")
+    assert [indice.alimento(chave)["Pontos"] for chave in chaves] == [3, 5]
+    assert [indice.rotulos[chave] for chave in chaves] == ["Arroz (100.0 g)", "Arroz (150.0 g)"]
+    # Nome sem ambiguidade continua rotulado só pelo nome
+    assert [indice.rotulos[chave] for chave in indice.buscar("feij")] == ["Feijão"]
+    assert len(indice.chaves_ordenadas) == 3
+
+
+def test_registro_de_consumo_acha_a_porcao_registrada(app):
+    indice = app.IndiceCatalogo([alimento("Arroz", 100.0, 3), alimento("Arroz", 150.0, 5)])
+    assert indice.alimento_do_registro({"nome": "Arroz", "porcao": 150.0})["Pontos"] == 5
+    # Registros antigos (sem porção) caem no primeiro alimento com o nome
+    assert indice.alimento_do_registro({"nome": "Arroz"})["Pontos"] == 3
+    assert indice.alimento_do_registro({"nome": "Pão"}) is None
+
+
+def test_indice_usa_a_mesma_chave_do_upsert(app):
+    catalogo = [alimento("Maçã", 100.0, 1)]
+    resumo = app.upsert_alimentos(catalogo, [alimento("MACA ", 100.0, 2), alimento("maçã", 200.0, 4)])
+    assert resumo == {"inseridos": 1, "atualizados": 1, "inalterados": 0}
+    indice = app.IndiceCatalogo(catalogo)
+    assert sorted(indice.posicao_por_chave) == sorted(app.chave_alimento(a) for a in catalogo)
+    assert sorted(indice.alimento(chave)["Pontos"] for chave in indice.buscar("maca")) == [2, 4]
+
+
+
+# -----------------------------
+# Busca por prefixo x varredura linear
+# -----------------------------
+def catalogo_aleatorio(rnd, n):
+    return [alimento(" ".join(rnd.choice(PALAVRAS) for _ in range(rnd.randint(1, 4))), rnd.choice([100.0, 30.0]))
+            for _ in range(n)]
+
+
+def varredura(app, indice, texto):
+    """Resultado esperado por varredura: rótulos que começam com o texto e, depois, os que têm uma palavra que começa."""
+    prefixo = app.normalizar_nome(texto)
+    por_nome, por_palavra = set(), set()
+    for chave, rotulo in indice.rotulos.items():
+        normalizado = app.normalizar_nome(rotulo)
+        palavras = normalizado.split()
+        if normalizado.startswith(prefixo):
+            por_nome.add(chave)
+        elif any(" ".join(palavras[j:]).startswith(prefixo) for j in range(1, len(palavras))):
+            por_palavra.add(chave)
+    return por_nome, por_palavra
+
+
+@pytest.mark.parametrize("semente", range(10))
+def test_busca_por_prefixo_igual_a_varredura(app, semente):
+    rnd = random.Random(semente)
+    indice = app.IndiceCatalogo(catalogo_aleatorio(rnd, 300))
+    consultas = ["", " ", "MAÇ", "maca", "pão de", "Pao De Q", "acai", "AÇAÍ", "é", "e", "coracao", "coco", "xyz", "a"]
+    consultas += [rnd.choice(PALAVRAS)[:rnd.randint(1, 4)] for _ in range(20)]
+    for texto in consultas:
+        if not app.normalizar_nome(texto):
+            assert indice.buscar(texto, limite=10) == indice.chaves_ordenadas[:10]
+            continue
+        por_nome, por_palavra = varredura(app, indice, texto)
+        resultado = indice.buscar(texto, limite=len(indice.rotulos))
+        assert len(resultado) == len(set(resultado))
+        assert set(resultado[:len(por_nome)]) == por_nome, texto
+        assert set(resultado[len(por_nome):]) == por_palavra, texto
+        # Com limite, os primeiros da mesma ordem
+        assert indice.buscar(texto, limite=5) == resultado[:5]
+
+
+# -----------------------------
+# Catálogo compartilhado entre sessões
+# -----------------------------
+def test_catalogo_compartilhado_le_uma_vez_e_recarrega_quando_o_arquivo_muda(app, pasta):
+    with open("ww_data.json", "w", encoding="utf-8") as f:
+        json.dump([alimento("Arroz")], f)
+    catalogo = app.CatalogoCompartilhado("ww_data.json")
+    lista, indice = catalogo.atual(), catalogo.indice()
+    # Sem mudança no arquivo: mesma lista e mesmo índice para todas as sessões
+    assert catalogo.atual() is lista and catalogo.indice() is indice
+
+    with open("ww_data.json", "w", encoding="utf-8") as f:
+        json.dump([alimento("Arroz"), alimento("Feijão")], f)
+    os.utime("ww_data.json", ns=(0, 1))  # assinatura diferente mesmo no mesmo tique do relógio
+    assert [a["Nome"] for a in catalogo.atual()] == ["Arroz", "Feijão"]
+    assert catalogo.indice() is not indice and len(catalogo.indice().rotulos) == 2
+
+
+def test_update_publica_lista_nova_sem_alterar_a_anterior(app, pasta):
+    catalogo = app.CatalogoCompartilhado("ww_data.json")
+    anterior = catalogo.atual()
+    nova = catalogo.update(lambda alimentos: app.upsert_alimentos(alimentos, [alimento("Pão")]))
+    assert anterior == [] and [a["Nome"] for a in nova] == ["Pão"]
+    with open("ww_data.json", encoding="utf-8") as f:
+        assert [a["Nome"] for a in json.load(f)] == ["Pão"]
+    # A gravação do próprio processo não faz o arquivo ser relido
+    assert catalogo.atual() is nova
@@ -0,0 +1,63 @@
+import csv
+import datetime
+import json
+
+
+def registro(id_, dias_atras, pontos=3):
+    data = datetime.date.today() - datetime.timedelta(days=dias_atras)
+    return {"id": id_, "tipo": "consumo", "data": data.isoformat(), "nome": "Arroz",
+            "quantidade": 100.0, "pontos": pontos, "usou_extras": 0}
+
+
+def store_com_historico(app, pasta, n=2000):
+    """Journal com o snapshot já separado (anteriores em arquivo) e eventos pendentes no journal."""
+    historico = [registro(f"r{i}", i) for i in range(n)]
+    with open(pasta / "data_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"meta_diaria": 29, "historico_acumulado": historico}, f)
+    store = app.JournalUserStore("u@x")
+    store.load(desde=app.inicio_janela_login())
+    store.append("update", registro(f"r{n - 50}", n - 50, pontos=9))  # anteriores à janela
+    store.append("delete", registro(f"r{n - 40}", n - 40))
+    store.append("update", registro("r2", 2, pontos=7))         # dentro da janela
+    store.append("add", registro("novo", 0))
+    return store
+
+
+def test_iterar_registros_igual_ao_estado_completo(app, pasta):
+    store = store_com_historico(app, pasta)
+    exportados = list(store.iterar_registros())
+    _, completo, _ = app.JournalUserStore("u@x")._ler_estado()
+    assert len(exportados) == len(completo) == 2000  # -1 excluído, +1 novo
+    assert sorted((r["id"], r["pontos"]) for r in exportados) == sorted((r["id"], r["pontos"]) for r in completo)
+
+
+def test_iterar_registros_le_os_anteriores_sob_demanda(app, pasta, monkeypatch):
+    store = store_com_historico(app, pasta)
+    lidos = []
+    original = app.iterar_jsonl
+
+    def contar(arquivo):
+        for reg in original(arquivo):
+            if arquivo.name == store.anteriores_file:
+                lidos.append(reg["id"])
+            yield reg
+
+    monkeypatch.setattr(app, "iterar_jsonl", contar)
+    registros = store.iterar_registros()
+    next(registros)
+    assert len(lidos) == 1  # o primeiro registro sai antes de o arquivo de anteriores ser lido inteiro
+    assert 1 + sum(1 for _ in registros) == 2000
+    assert len(lidos) > 1900
+
+
+def test_exportar_csv(app, pasta):
+    store_com_historico(app, pasta, n=300)
+    with open(pasta / "activities_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({datetime.date.today().isoformat(): [{"nome": "Corrida", "quantidade": 30, "pontos": 4}]}, f)
+
+    total = app.exportar_historico("u@x", str(pasta / "h.csv"), formato="csv", tamanho_lote=64)
+    with open(pasta / "h.csv", encoding="utf-8", newline="") as f:
+        linhas = list(csv.DictReader(f))
+    assert total == len(linhas) == 300 + 1
+    assert {l["tipo"] for l in linhas} == {"consumo", "atividade"}
+    assert not (pasta / "h.csv.tmp").exists()
@@ -0,0 +1,108 @@
+import datetime
+import os
+import time
+
+import pytest
+
+INICIO, FIM = datetime.date(2026, 9, 1), datetime.date(2026, 9, 30)
+
+
+@pytest.fixture
+def exportador(app, pasta):
+    exportador = app.ExportadorPDF(app.renderizar_pdf_stub, pasta=str(pasta / "pdf"), max_workers=2)
+    yield exportador
+    exportador.executor.shutdown(wait=True)
+
+
+def aguardar(exportador, job_id, timeout=10):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        job = exportador.status(job_id)
+        if job["status"] in ("pronto", "erro"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} não terminou: {exportador.status(job_id)}")
+
+
+def test_job_fica_pronto_e_e_reaproveitado(exportador):
+    chave = ("u@x", INICIO, FIM, True, True, "v1")
+    job_id = exportador.solicitar(chave, lambda: b"<html>relatorio</html>")
+    job = aguardar(exportador, job_id)
+    assert job["status"] == "pronto"
+    with open(job["caminho"], "rb") as f:
+        assert f.read().startswith(b"%PDF-1.4")
+
+    assert exportador.solicitar(chave, lambda: b"outro") == job_id
+    assert exportador.job_da_chave(chave) == job_id
+
+
+def test_erro_na_renderizacao_vira_status_erro(app, pasta):
+    def falha(conteudo, destino):
+        raise RuntimeError("wkhtmltopdf saiu com código 1")
+
+    exportador = app.ExportadorPDF(falha, pasta=str(pasta / "pdf"))
+    job = aguardar(exportador, exportador.solicitar(("u@x", INICIO, FIM, True, True, "v1"), lambda: b""))
+    assert job["status"] == "erro" and "wkhtmltopdf" in job["erro"]
+    assert os.listdir(pasta / "pdf") == []
+
+
+def test_versao_nova_invalida_so_o_mesmo_relatorio(exportador):
+    antigo = ("u@x", INICIO, FIM, True, True, "v1")
+    outro_periodo = ("u@x", INICIO, INICIO, True, True, "v1")
+    outro_usuario = ("w@x", INICIO, FIM, True, True, "v1")
+    jobs = {chave: aguardar(exportador, exportador.solicitar(chave, lambda: b"<html/>"))
+            for chave in (antigo, outro_periodo, outro_usuario)}
+
+    novo = ("u@x", INICIO, FIM, True, True, "v2")
+    assert exportador.job_da_chave(novo) is None
+    job = aguardar(exportador, exportador.solicitar(novo, lambda: b"<html>v2</html>"))
+    assert job["status"] == "pronto"
+    assert exportador.job_da_chave(antigo) is None
+    assert not os.path.exists(jobs[antigo]["caminho"])
+    for chave in (outro_periodo, outro_usuario):
+        assert os.path.exists(exportador.status(exportador.job_da_chave(chave))["caminho"])
+
+
+def test_versao_dos_dados_muda_com_gravacao_e_vale_para_qualquer_store(app, pasta):
+    store = app.JournalUserStore("u@x")
+    store.load(desde=app.inicio_janela_login())
+    versao = app.versao_dados_usuario(store, "u@x")
+    # Outra sessão (outro store) com os mesmos dados em disco tem a mesma versão
+    assert app.versao_dados_usuario(app.JournalUserStore("u@x"), "u@x") == versao
+
+    store.append("add", {"id": "a", "tipo": "consumo", "data": datetime.date.today().isoformat(), "pontos": 3})
+    assert app.versao_dados_usuario(store, "u@x") != versao
+    assert app.versao_dados_usuario(app.JournalUserStore("u@x"), "u@x") == app.versao_dados_usuario(store, "u@x")
+
+
+def test_jobs_terminados_acima_do_limite_saem_com_o_arquivo(app, pasta):
+    exportador = app.ExportadorPDF(app.renderizar_pdf_stub, pasta=str(pasta / "pdf"), max_workers=1, max_jobs=3)
+    chaves = [("u@x", INICIO, INICIO + datetime.timedelta(days=i), True, True, "v1") for i in range(6)]
+    jobs = []
+    for chave in chaves:
+        jobs.append(aguardar(exportador, exportador.solicitar(chave, lambda: b"<html/>")))
+    exportador.executor.shutdown(wait=True)
+
+    # Ao pedir o 6º, havia 5 terminados: os 2 mais antigos saíram
+    assert [exportador.job_da_chave(chave) is not None for chave in chaves] == [False, False, True, True, True, True]
+    assert [os.path.exists(job["caminho"]) for job in jobs] == [False, False, True, True, True, True]
+    assert len(exportador.jobs) == len(exportador.por_chave) == 4
+
+
+def test_jobs_vencidos_saem_com_o_arquivo(app, pasta):
+    exportador = app.ExportadorPDF(app.renderizar_pdf_stub, pasta=str(pasta / "pdf"), ttl=0)
+    antigo = aguardar(exportador, exportador.solicitar(("u@x", INICIO, FIM, True, True, "v1"), lambda: b"<html/>"))
+    novo = exportador.solicitar(("w@x", INICIO, FIM, True, True, "v1"), lambda: b"<html/>")
+    exportador.executor.shutdown(wait=True)
+
+    assert exportador.job_da_chave(("u@x", INICIO, FIM, True, True, "v1")) is None
+    assert not os.path.exists(antigo["caminho"])
+    assert exportador.status(novo)["status"] == "pronto"
+
+
+def test_pasta_e_esvaziada_ao_criar_o_exportador(app, pasta):
+    os.makedirs(pasta / "pdf")
+    for nome in ("velho.pdf", "interrompido.pdf.tmp"):
+        (pasta / "pdf" / nome).write_bytes(b"%PDF-1.4")
+    app.ExportadorPDF(app.renderizar_pdf_stub, pasta=str(pasta / "pdf")).executor.shutdown()
+    assert os.listdir(pasta / "pdf") == []
@@ -0,0 +1,96 @@
+import datetime
+import random
+
+import pytest
+
+BASE = datetime.date(2026, 1, 1)
+TIPOS = ["consumo", "atividade", "peso"]
+
+
+def data_aleatoria(rnd):
+    if rnd.random() < 0.05:
+        return rnd.choice([None, "", "31/02/2026", "abc"])  # sem data válida: fica fora de todo filtro
+    return (BASE + datetime.timedelta(days=rnd.randint(0, 120))).isoformat()
+
+
+def varredura(registros, tipo=None, inicio=None, fim=None):
+    """O que o filtro deve devolver, por list comprehension sobre os registros ativos."""
+    def dia(r):
+        try:
+            return datetime.date.fromisoformat(r.get("data") or "")
+        except ValueError:
+            return None
+    return [r for r in registros
+            if dia(r) is not None and (tipo is None or r["tipo"] == tipo)
+            and (inicio is None or dia(r) >= inicio) and (fim is None or dia(r) <= fim)]
+
+
+def conferir(frame, esperado, linhas):
+    obtido = frame.registros_de(linhas)
+    # Mesmas linhas, em ordem de data (empates podem vir em qualquer ordem)
+    assert sorted(r["id"] for r in obtido) == sorted(r["id"] for r in esperado)
+    assert [r["data"] for r in obtido] == sorted(r["data"] for r in esperado)
+
+
+def consultas(rnd):
+    for _ in range(6):
+        inicio = BASE + datetime.timedelta(days=rnd.randint(-5, 125)) if rnd.random() < 0.7 else None
+        fim = BASE + datetime.timedelta(days=rnd.randint(-5, 125)) if rnd.random() < 0.7 else None
+        yield rnd.choice(TIPOS + [None, "inexistente"]), inicio, fim
+
+
+@pytest.mark.parametrize("semente", range(25))
+def test_filtros_iguais_a_varredura_com_inclusoes_edicoes_e_exclusoes(app, semente):
+    rnd = random.Random(semente)
+    ativos = {}
+    proximo = 0
+
+    def novo():
+        nonlocal proximo
+        proximo += 1
+        return {"id": f"r{proximo}", "tipo": rnd.choice(TIPOS), "data": data_aleatoria(rnd),
+                "nome": rnd.choice(["Arroz", "Corrida", None]), "quantidade": rnd.uniform(0, 300),
+                "pontos": rnd.choice([1, 2.5, "3", None])}
+
+    for _ in range(rnd.randint(0, 40)):
+        registro = novo()
+        ativos[registro["id"]] = registro
+    frame = app.HistoryFrame(list(ativos.values()))
+
+    for passo in range(120):
+        operacao = rnd.random()
+        if operacao < 0.45 or not ativos:
+            registro = novo()
+            ativos[registro["id"]] = registro
+            frame.add(registro)
+        elif operacao < 0.75:
+            antigo = ativos[rnd.choice(list(ativos))]
+            registro = {**antigo, "pontos": rnd.uniform(0, 10)}
+            if rnd.random() < 0.5:
+                registro["data"] = data_aleatoria(rnd)
+            if rnd.random() < 0.3:
+                registro["tipo"] = rnd.choice(TIPOS)
+            ativos[registro["id"]] = registro
+            frame.update(registro)
+        else:
+            frame.delete(ativos.pop(rnd.choice(list(ativos))))
+
+        if passo % 10 == 0:  # o índice por tipo é montado no primeiro filtro e mantido incrementalmente depois
+            assert len(frame) == len(ativos)
+            for tipo, inicio, fim in consultas(rnd):
+                conferir(frame, varredura(ativos.values(), tipo, inicio, fim), frame.filtrar(tipo, inicio, fim))
+
+
+def test_filtro_por_semana_iso(app):
+    registros = [{"id": str(i), "tipo": "consumo", "data": (BASE + datetime.timedelta(days=i)).isoformat()} for i in range(40)]
+    frame = app.HistoryFrame(registros)
+    for ano, semana in [(2026, 1), (2026, 3), (2025, 52), (2026, 6)]:
+        segunda = datetime.date.fromisocalendar(ano, semana, 1)
+        domingo = segunda + datetime.timedelta(days=6)
+        esperado = varredura(registros, "consumo", segunda, domingo)
+        conferir(frame, esperado, frame.filtrar("consumo", semana=(ano, semana)))
+        conferir(frame, esperado, frame.filtrar(semana=(ano, semana)))
+    # Semana combinada com intervalo: a interseção dos dois
+    inicio = BASE + datetime.timedelta(days=13)
+    conferir(frame, varredura(registros, "consumo", inicio, datetime.date(2026, 1, 18)),
+             frame.filtrar("consumo", inicio=inicio, semana=(2026, 3)))
@@ -0,0 +1,54 @@
+import io
+import random
+
+import pandas as pd
+import pytest
+
+COLUNAS = ["nome", "porcao", "calorias", "carboidratos", "gordura", "proteina", "sodio_mg", "Zero Ponto"]
+
+
+def planilha(rnd, n):
+    linhas = []
+    for i in range(n):
+        linhas.append([f"Alimento {rnd.randint(0, n // 2)}", rnd.choice(["100", "30g", "", "1.5 xícara"]),
+                       round(rnd.uniform(0, 600), 3), rnd.choice([rnd.uniform(0, 80), None, "abc"]),
+                       round(rnd.uniform(0, 40), 1), rnd.randint(0, 30), rnd.choice([0, 120, 1500]),
+                       rnd.choice(["sim", "Não", "", "SIM "])])
+    return pd.DataFrame(linhas, columns=COLUNAS)
+
+
+def em_blocos(app, conteudo, nome, tamanho):
+    blocos = list(app.ler_planilha_em_blocos(io.BytesIO(conteudo), nome, tamanho))
+    progresso = [p for _, p in blocos]
+    assert progresso == sorted(progresso) and progresso[-1] == pytest.approx(1.0)
+    return pd.concat([app.preparar_bloco_importacao(b) for b, _ in blocos], ignore_index=True)
+
+
+@pytest.mark.parametrize("tamanho", [1, 7, 64, 10_000])
+def test_csv_em_blocos_igual_a_leitura_de_uma_vez(app, tamanho):
+    df = planilha(random.Random(tamanho), 150)
+    conteudo = df.to_csv(index=False).encode("utf-8")
+    de_uma_vez = app.preparar_bloco_importacao(pd.read_csv(io.BytesIO(conteudo)))
+    pd.testing.assert_frame_equal(em_blocos(app, conteudo, "tabela.csv", tamanho), de_uma_vez)
+
+
+@pytest.mark.parametrize("tamanho", [1, 7, 10_000])
+def test_xlsx_em_blocos_igual_a_leitura_de_uma_vez(app, tamanho):
+    pytest.importorskip("openpyxl")
+    df = planilha(random.Random(tamanho), 60)
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    conteudo = buf.getvalue()
+    de_uma_vez = app.preparar_bloco_importacao(pd.read_excel(io.BytesIO(conteudo)))
+    pd.testing.assert_frame_equal(em_blocos(app, conteudo, "tabela.xlsx", tamanho), de_uma_vez, check_dtype=False)
+
+
+def test_upsert_em_blocos_igual_ao_de_uma_vez(app):
+    alimentos = app.preparar_bloco_importacao(planilha(random.Random(1), 200)).to_dict("records")
+    de_uma_vez, em_blocos = [], []
+    resumo = app.upsert_alimentos(de_uma_vez, alimentos)
+    total = {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+    for i in range(0, len(alimentos), 13):
+        for k, v in app.upsert_alimentos(em_blocos, alimentos[i:i + 13]).items():
+            total[k] += v
+    assert em_blocos == de_uma_vez and total == resumo
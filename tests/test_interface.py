@@ -0,0 +1,198 @@
+import datetime
+import json
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ww_dashboard_streamlit.py")
+
+
+@pytest.fixture
+def sessao(app, pasta):
+    """AppTest do app com um usuário logado (catálogo com um alimento e um peso no histórico)."""
+    from streamlit.testing.v1 import AppTest
+
+    app.st.cache_resource.clear()  # diretório de usuários, catálogo e cache de sessões de outros testes
+    with open("ww_data.json", "w", encoding="utf-8") as f:
+        json.dump([{"Nome": "Arroz", "Porcao": 100, "Calorias": 130, "Gordura": 0.3, "Saturada": 0, "Carbo": 28,
+                    "Fibra": 0.4, "Açúcar": 0, "Proteina": 2.7, "Sodio_mg": 1, "ZeroPontos": False, "Pontos": 6}], f)
+    with open("data_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"meta_diaria": 29, "historico_acumulado": [
+            {"id": "p", "tipo": "peso", "data": datetime.date.today().isoformat(), "nome": "Peso registrado",
+             "quantidade": 80.0, "pontos": 0, "usou_extras": 0},
+        ]}, f)
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.run()
+    at.text_input(key="login_email").set_value("u@x")
+    at.text_input(key="login_pass").set_value("senha")
+    app.get_diretorio_usuarios().cadastrar("u@x", {"password_hash": app.hash_senha("senha")})
+    [b for b in at.button if b.label == "Login"][0].click()
+    rodar(at)
+    rodar(at)
+    assert at.session_state.logged_in
+    yield at
+    app.st.cache_resource.clear()
+
+
+def rodar(at):
+    at.run()
+    assert not at.exception, [e.value for e in at.exception]
+    return at
+
+
+def ir_para(at, rotulo):
+    [b for b in at.sidebar.button if b.label == rotulo][0].click()
+    return rodar(at)
+
+
+def flushes(at):
+    return at.session_state.estatisticas_flush["flushes"] if "estatisticas_flush" in at.session_state else 0
+
+
+def test_um_registro_de_consumo_faz_um_flush(sessao):
+    ir_para(sessao, "🍴 Registrar Consumo")
+    antes = flushes(sessao)
+    sessao.number_input(key="reg_quant").set_value(150.0)
+    [b for b in sessao.button if "Registrar consumo" in str(b.label)][0].click()
+    rodar(sessao)
+    assert flushes(sessao) == antes + 1
+    assert sessao.session_state.estatisticas_flush["secoes"].get("historico", 0) >= 1
+
+
+def test_ver_o_historico_nao_grava_nada(sessao):
+    # O primeiro dashboard materializa os rollups (uma gravação); depois disso, só leituras
+    ir_para(sessao, "🏠 Dashboard")
+    ir_para(sessao, "📊 Históricos Acumulados")
+    antes = flushes(sessao)
+    rodar(sessao)
+    ir_para(sessao, "🏠 Dashboard")
+    ir_para(sessao, "📊 Históricos Acumulados")
+    assert flushes(sessao) == antes
+
+
+def test_relatorio_html_fica_em_arquivo_e_a_sessao_guarda_so_o_caminho(sessao):
+    ir_para(sessao, "📊 Históricos Acumulados")
+    assert not [b for b in sessao.get("download_button") if b.key == "baixar_relatorio"]
+    [b for b in sessao.button if b.key == "gerar_relatorio"][0].click()
+    rodar(sessao)
+
+    cache = sessao.session_state.relatorio_html
+    assert set(cache) == {"chave", "caminho"}
+    with open(cache["caminho"], encoding="utf-8") as f:
+        html = f.read()
+    assert html.startswith("<html") and html.endswith("</body></html>") and "80.00" in html
+    assert [b for b in sessao.get("download_button") if b.key == "baixar_relatorio"]
+
+    # Outro relatório (opções diferentes) substitui o arquivo; o logout apaga o que sobrou
+    [c for c in sessao.checkbox][0].uncheck()
+    rodar(sessao)
+    [b for b in sessao.button if b.key == "gerar_relatorio"][0].click()
+    rodar(sessao)
+    assert not os.path.exists(cache["caminho"])
+    caminho = sessao.session_state.relatorio_html["caminho"]
+    ir_para(sessao, "🚪 Sair")
+    assert not os.path.exists(caminho)
+
+
+def importar(at, conteudo, nome="tabela.csv"):
+    at.file_uploader(key="uploader_import").set_value((nome, conteudo, "text/csv"))
+    rodar(at)
+    botoes = [b for b in at.button if b.key == "btn_importar"]
+    if botoes:
+        botoes[0].click()
+        rodar(at)
+    return botoes
+
+
+def catalogo_em_disco():
+    with open("ww_data.json", encoding="utf-8") as f:
+        return {(a["Nome"], a["Porcao"]): a for a in json.load(f)}
+
+
+def test_reimportar_aplica_so_a_diferenca(sessao):
+    ir_para(sessao, "📂 Importar Alimentos")
+    original = "nome,porcao,calorias\nPão,50,130\nLeite,200,120\nOvo,50,70\n".encode("utf-8")
+    assert importar(sessao, original)
+    catalogo = catalogo_em_disco()
+    assert sorted(catalogo) == [("Arroz", 100), ("Leite", 200.0), ("Ovo", 50.0), ("Pão", 50.0)]
+    mtime = os.stat("ww_data.json").st_mtime_ns
+
+    # Mesmo conteúdo (novo upload): detectado pelo hash, nada é gravado
+    assert not importar(sessao, original)
+    assert any("já foi importado" in i.value for i in sessao.info)
+    assert os.stat("ww_data.json").st_mtime_ns == mtime
+
+    # Versão nova do arquivo: Leite alterado, Ovo removido, Queijo novo; Pão fica como está
+    with open("ww_data.json", encoding="utf-8") as f:
+        alimentos = json.load(f)
+    for a in alimentos:
+        if a["Nome"] == "Pão":
+            a["Calorias"] = 999.0  # editado no catálogo: a linha inalterada da planilha não é reaplicada por cima
+    with open("ww_data.json", "w", encoding="utf-8") as f:
+        json.dump(alimentos, f)
+    assert importar(sessao, "nome,porcao,calorias\nPão,50,130\nLeite,200,150\nQueijo,30,100\n".encode("utf-8"))
+    catalogo = catalogo_em_disco()
+    assert sorted(catalogo) == [("Arroz", 100), ("Leite", 200.0), ("Pão", 50.0), ("Queijo", 30.0)]
+    assert catalogo[("Leite", 200.0)]["Calorias"] == 150.0
+    assert catalogo[("Pão", 50.0)]["Calorias"] == 999.0
+
+
+def test_rollups_gravados_batem_com_o_historico(app, sessao):
+    ir_para(sessao, "🍴 Registrar Consumo")
+    for quantidade in (150.0, 50.0):
+        sessao.number_input(key="reg_quant").set_value(quantidade)
+        [b for b in sessao.button if "Registrar consumo" in str(b.label)][0].click()
+        rodar(sessao)
+    hoje = datetime.date.today()
+    consumos = [r for r in app.open_user_store("u@x").iterar_registros() if r["tipo"] == "consumo"]
+    assert len(consumos) == 2
+    assert app.RollupsUsuario("u@x").totais(hoje, hoje)["pontos"] == sum(r["pontos"] for r in consumos)
+
+
+@pytest.fixture
+def consultas(sessao):
+    """Conta as consultas ao store da sessão (cada uma é uma busca no histórico, em memória ou em disco)."""
+    store = sessao.session_state.user_store
+    chamadas = []
+    original = store.query
+
+    def query(*args, **kwargs):
+        chamadas.append(args[1:])
+        return original(*args, **kwargs)
+
+    store.query = query
+    return chamadas
+
+
+def test_dashboard_memoizado_nao_consulta_o_historico_sem_alteracao(sessao, consultas):
+    ir_para(sessao, "🏠 Dashboard")
+    agregados = sessao.session_state.agregados_dashboard
+    versao = sessao.session_state.historico_versao
+    del consultas[:]
+    rodar(sessao)
+    ir_para(sessao, "🏠 Dashboard")
+    assert consultas == []
+    assert sessao.session_state.historico_versao == versao
+    assert sessao.session_state.agregados_dashboard is agregados
+
+    # Uma gravação muda a versão e o dashboard seguinte recalcula
+    ir_para(sessao, "🍴 Registrar Consumo")
+    sessao.number_input(key="reg_quant").set_value(100.0)
+    [b for b in sessao.button if "Registrar consumo" in str(b.label)][0].click()
+    rodar(sessao)
+    ir_para(sessao, "🏠 Dashboard")
+    assert sessao.session_state.historico_versao > versao
+    assert sessao.session_state.agregados_dashboard is not agregados
+
+
+def test_historico_e_relatorio_compartilham_a_consulta_do_periodo(sessao, consultas):
+    # O primeiro dashboard materializa os rollups (nova versão do histórico); a partir daí nada muda
+    ir_para(sessao, "🏠 Dashboard")
+    ir_para(sessao, "📊 Históricos Acumulados")
+    consulta = sessao.session_state.consulta_periodo
+    del consultas[:]
+    rodar(sessao)
+    [b for b in sessao.button if b.key == "gerar_relatorio"][0].click()
+    rodar(sessao)
+    assert consultas == []
+    assert sessao.session_state.consulta_periodo is consulta
@@ -0,0 +1,131 @@
+import datetime
+import json
+
+import pytest
+
+
+def registro(id_, dias_atras=0):
+    data = datetime.date.today() - datetime.timedelta(days=dias_atras)
+    return {"id": id_, "tipo": "consumo", "data": data.isoformat(), "nome": "Arroz",
+            "quantidade": 100.0, "pontos": 3, "usou_extras": 0}
+
+
+def ids(historico):
+    return sorted(r["id"] for r in historico)
+
+
+def test_linha_truncada_nao_descarta_eventos_seguintes(app, pasta):
+    store = app.JournalUserStore("u@x")
+    store.load()
+    store.append("add", registro("a"))
+    with open(store.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "registro": {"id": "b", "ti')  # gravação interrompida no meio da linha
+    store.append("add", registro("c"))
+
+    data_store, _ = app.JournalUserStore("u@x").load()
+    assert ids(data_store["historico_acumulado"]) == ["a", "c"]
+
+    # O load compactou o journal; o estado sobrevive à compactação
+    data_store, _ = app.JournalUserStore("u@x").load()
+    assert ids(data_store["historico_acumulado"]) == ["a", "c"]
+
+
+def test_replay_aplica_update_e_delete(app, pasta):
+    store = app.JournalUserStore("u@x")
+    store.load()
+    store.append_many("add", [registro("a"), registro("b")])
+    store.append("update", {**registro("a"), "pontos": 7})
+    store.append("delete", registro("b"))
+
+    data_store, _ = app.JournalUserStore("u@x").load()
+    assert [(r["id"], r["pontos"]) for r in data_store["historico_acumulado"]] == [("a", 7)]
+
+
+def _historico_legado(app, pasta):
+    """data_u@x.json no formato antigo: histórico inteiro no snapshot, sem corte."""
+    historico = [registro("antigo", 400), registro("recente", 1),
+                 {**registro("peso_antigo", 400), "tipo": "peso", "quantidade": 80.0}]
+    with open(pasta / "data_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"meta_diaria": 29, "historico_acumulado": historico}, f)
+
+
+@pytest.fixture
+def leituras_jsonl(app, monkeypatch):
+    lidos = []
+    original = app.ler_jsonl
+    monkeypatch.setattr(app, "ler_jsonl", lambda caminho, *args: lidos.append(caminho) or original(caminho, *args))
+    return lidos
+
+
+def test_login_le_so_snapshot_e_journal(app, pasta, leituras_jsonl):
+    _historico_legado(app, pasta)
+    desde = app.inicio_janela_login()
+    # Primeiro login: o snapshot antigo é separado por data
+    data_store, _ = app.JournalUserStore("u@x").load(desde=desde)
+    assert ids(data_store["historico_acumulado"]) == ["peso_antigo", "recente"]
+    assert data_store["meta_diaria"] == 29 and "historico_corte" not in data_store
+
+    leituras_jsonl.clear()
+    store = app.JournalUserStore("u@x")
+    data_store, _ = store.load(desde=desde)
+    assert ids(data_store["historico_acumulado"]) == ["peso_antigo", "recente"]
+    assert leituras_jsonl == [store.journal_file]
+
+    # Histórico completo (migração para outro backend / exportação) inclui os anteriores
+    assert ids(app.JournalUserStore("u@x").load()[0]["historico_acumulado"]) == ["antigo", "peso_antigo", "recente"]
+
+
+def test_consulta_anterior_a_janela_usa_cache(app, pasta, leituras_jsonl):
+    _historico_legado(app, pasta)
+    store = app.JournalUserStore("u@x")
+    data_store, _ = store.load(desde=app.inicio_janela_login())
+    frame = app.HistoryFrame(data_store["historico_acumulado"])
+    hoje = datetime.date.today()
+
+    leituras_jsonl.clear()
+    for _ in range(3):
+        assert ids(store.query(frame, "consumo", hoje - datetime.timedelta(days=500), hoje)) == ["antigo", "recente"]
+    assert leituras_jsonl == [store.anteriores_file, store.journal_file]
+
+    # Um evento novo relê só o journal (e o snapshot); o arquivo de anteriores continua em cache
+    leituras_jsonl.clear()
+    store.append("delete", registro("antigo", 400))
+    assert ids(store.query(frame, "consumo", hoje - datetime.timedelta(days=500), hoje)) == ["recente"]
+    assert leituras_jsonl == [store.journal_file]
+
+
+def _historico_com_tipos(app, pasta):
+    historico = [registro("consumo_antigo", 400), registro("recente", 1),
+                 {**registro("atividade_antiga", 380), "tipo": "atividade"},
+                 {**registro("peso_antigo", 400), "tipo": "peso", "quantidade": 80.0}]
+    with open(pasta / "data_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"historico_acumulado": historico}, f)
+    app.JournalUserStore("u@x").load(desde=app.inicio_janela_login())  # separa os anteriores
+
+
+def test_consulta_de_pesos_nao_le_o_disco(app, pasta, leituras_jsonl):
+    _historico_com_tipos(app, pasta)
+    store = app.JournalUserStore("u@x")
+    data_store, _ = store.load(desde=app.inicio_janela_login())
+    frame = app.HistoryFrame(data_store["historico_acumulado"])
+
+    leituras_jsonl.clear()
+    assert ids(store.query(frame, "peso")) == ["peso_antigo"]
+    assert leituras_jsonl == [] and store.consulta_anteriores == {} and store.anteriores_lidos == {}
+
+
+def test_cache_dos_anteriores_guarda_so_o_tipo_consultado(app, pasta):
+    _historico_com_tipos(app, pasta)
+    store = app.JournalUserStore("u@x")
+    data_store, _ = store.load(desde=app.inicio_janela_login())
+    frame = app.HistoryFrame(data_store["historico_acumulado"])
+    hoje = datetime.date.today()
+
+    assert ids(store.query(frame, "consumo", hoje - datetime.timedelta(days=500), hoje)) == ["consumo_antigo", "recente"]
+    assert list(store.consulta_anteriores) == ["consumo"] and list(store.anteriores_lidos) == ["consumo"]
+    assert ids(store.consulta_anteriores["consumo"][2]) == ["consumo_antigo"]
+    assert ids(store.anteriores_lidos["consumo"][1]) == ["consumo_antigo"]
+
+    # Consulta sem início (histórico inteiro do tipo) não fica em sessão
+    assert ids(store.query(frame, "atividade")) == ["atividade_antiga"]
+    assert "atividade" not in store.consulta_anteriores and "atividade" not in store.anteriores_lidos
@@ -0,0 +1,57 @@
+import copy
+import datetime
+import random
+
+import pytest
+
+SEQUENCIAS = 200
+INICIO = datetime.date(2026, 12, 14)  # as sequências cruzam a virada do ano ISO (2026-W53 -> 2027-W01)
+
+
+def estado(ledger, historico):
+    """Tudo o que as páginas leem do ledger, mais os campos derivados gravados nos registros."""
+    return (
+        [(w["ano"], w["semana"], w["extras"], sorted(r["id"] for r in w["pontos"])) for w in ledger.lista()],
+        ledger.dias,
+        ledger.extras_ultima_semana(),
+        {r["id"]: (r.get("pontos"), r.get("usou_extras")) for r in historico},
+    )
+
+
+def data_aleatoria(rnd):
+    return (INICIO + datetime.timedelta(days=rnd.randint(0, 34))).isoformat()
+
+
+@pytest.mark.parametrize("semente", range(SEQUENCIAS))
+def test_ledger_incremental_igual_a_reconstrucao_completa(app, semente):
+    rnd = random.Random(semente)
+    meta = rnd.choice([18.0, 23.0, 29.0, 35.0])
+    historico = []
+    ledger = app.LedgerSemanal(meta)
+    ledger.reconstruir(historico)
+
+    for passo in range(rnd.randint(1, 60)):
+        acao = rnd.random()
+        if acao < 0.55 or not historico:
+            registro = {"id": f"r{passo}", "tipo": rnd.choice(["consumo", "consumo", "consumo", "peso"]),
+                        "data": data_aleatoria(rnd), "nome": "x", "quantidade": 1.0,
+                        "pontos": round(rnd.uniform(0, 16), 2), "usou_extras": 0}
+            historico.append(registro)
+            ledger.aplicar("add", registro, historico)
+        elif acao < 0.7:
+            registro = rnd.choice(historico)
+            registro["pontos"] = round(rnd.uniform(0, 16), 2)
+            ledger.aplicar("update", registro, historico)
+        elif acao < 0.85:
+            registro = rnd.choice(historico)  # pode mudar de dia e de semana
+            registro["data"] = data_aleatoria(rnd)
+            ledger.aplicar("update", registro, historico)
+        else:
+            registro = rnd.choice(historico)
+            historico.remove(registro)
+            ledger.aplicar("delete", registro, historico)
+
+        referencia = copy.deepcopy(historico)
+        completo = app.LedgerSemanal(meta)
+        completo.reconstruir(referencia)
+        assert estado(ledger, historico) == estado(completo, referencia), f"passo {passo}"
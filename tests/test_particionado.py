@@ -0,0 +1,112 @@
+import datetime
+import os
+
+import pytest
+
+HOJE = datetime.date(2027, 1, 12)
+
+
+def registro(id_, data, tipo="consumo"):
+    return {"id": id_, "tipo": tipo, "data": data.isoformat(), "nome": "Arroz",
+            "quantidade": 100.0, "pontos": 3, "usou_extras": 0}
+
+
+@pytest.fixture
+def janela_em_janeiro(app, monkeypatch):
+    """Janela do login como se hoje fosse 12/01/2027 (semanas do fim de 2026 ainda dentro dela)."""
+    original = app.inicio_janela_login
+    monkeypatch.setattr(app, "inicio_janela_login", lambda hoje=None: original(hoje or HOJE))
+    return original(HOJE)
+
+
+def test_semanas_do_ano_anterior_na_janela_continuam_no_login(app, pasta, janela_em_janeiro):
+    store = app.ParticionadoUserStore("u@x")
+    store.load(desde=janela_em_janeiro)
+    store.append_many("add", [
+        registro("dez", datetime.date(2026, 12, 20)),
+        registro("jan", datetime.date(2027, 1, 11)),
+        registro("antigo", datetime.date(2025, 6, 10)),
+    ])
+
+    data_store, _ = app.ParticionadoUserStore("u@x").load(desde=janela_em_janeiro)
+    assert sorted(r["id"] for r in data_store["historico_acumulado"]) == ["dez", "jan"]
+    assert os.path.exists(os.path.join("hist_u@x", "2025.json.gz"))
+    assert not os.path.exists(os.path.join("hist_u@x", "2026.json.gz"))
+
+
+def test_ano_arquivado_cedo_demais_volta_para_as_semanas(app, pasta, janela_em_janeiro):
+    store = app.ParticionadoUserStore("u@x")
+    store.load(desde=janela_em_janeiro)
+    store.append("add", registro("dez", datetime.date(2026, 12, 20)))
+    os.remove(os.path.join("hist_u@x", "2026-W51.json"))
+    store._gravar_ano(2026, [registro("dez", datetime.date(2026, 12, 20))])
+
+    data_store, _ = app.ParticionadoUserStore("u@x").load(desde=janela_em_janeiro)
+    assert [r["id"] for r in data_store["historico_acumulado"]] == ["dez"]
+    assert not os.path.exists(os.path.join("hist_u@x", "2026.json.gz"))
+
+
+def test_consulta_de_ano_arquivado_descompacta_uma_vez(app, pasta, janela_em_janeiro, monkeypatch):
+    store = app.ParticionadoUserStore("u@x")
+    store.load(desde=janela_em_janeiro)
+    store.append_many("add", [registro(f"r{i}", datetime.date(2025, 1, 6) + datetime.timedelta(days=i)) for i in range(300)])
+    store = app.ParticionadoUserStore("u@x")
+    data_store, _ = store.load(desde=janela_em_janeiro)
+    frame = app.HistoryFrame(data_store["historico_acumulado"])
+
+    leituras = []
+    ler_ano = store._ler_ano
+    monkeypatch.setattr(store, "_ler_ano", lambda ano: leituras.append(ano) or ler_ano(ano))
+    for _ in range(3):
+        resultado = store.query(frame, "consumo", datetime.date(2025, 3, 1), datetime.date(2025, 3, 31))
+        assert [r["data"] for r in resultado] == [(datetime.date(2025, 3, 1) + datetime.timedelta(days=i)).isoformat() for i in range(31)]
+    assert leituras == [2025]
+
+    # Alterar o registro devolvido não altera o cache; a gravação no arquivo do ano invalida o cache
+    resultado[0]["pontos"] = 9
+    assert store.query(frame, "consumo", datetime.date(2025, 3, 1), datetime.date(2025, 3, 1))[0]["pontos"] == 3
+    store.append("update", resultado[0])
+    assert store.query(frame, "consumo", datetime.date(2025, 3, 1), datetime.date(2025, 3, 1))[0]["pontos"] == 9
+    assert leituras == [2025, 2025, 2025]  # a gravação relê o arquivo (sem cache) e a consulta seguinte também
+
+
+def test_login_le_so_pesos_e_semanas_da_janela(app, pasta, janela_em_janeiro, monkeypatch):
+    store = app.ParticionadoUserStore("u@x")
+    store.load(desde=janela_em_janeiro)
+    store.append_many("add", [
+        registro("antigo", datetime.date(2025, 6, 10)),          # ano arquivado
+        registro("peso_arquivado", datetime.date(2025, 6, 11), "peso"),
+        registro("fora", datetime.date(2026, 9, 1)),             # semana de 2026 anterior à janela
+        registro("peso_fora", datetime.date(2026, 9, 2), "peso"),
+        registro("dez", datetime.date(2026, 12, 20)),
+        registro("jan", datetime.date(2027, 1, 11)),
+    ])
+    app.ParticionadoUserStore("u@x").load(desde=janela_em_janeiro)  # arquiva 2025
+
+    lidos = []
+    load_data = app.load_data
+    monkeypatch.setattr(app, "load_data", lambda caminho: lidos.append(os.path.basename(caminho)) or load_data(caminho))
+    monkeypatch.setattr(app.ParticionadoUserStore, "_ler_ano", lambda self, ano: lidos.append(ano) or [])
+    data_store, _ = app.ParticionadoUserStore("u@x").load(desde=janela_em_janeiro)
+
+    assert sorted(r["id"] for r in data_store["historico_acumulado"]) == ["dez", "jan", "peso_arquivado", "peso_fora"]
+    janela = app.iso_year_week(janela_em_janeiro)
+    semanas = [nome for nome in lidos if isinstance(nome, str) and "-W" in nome]
+    assert semanas and all(tuple(int(x) for x in nome[:-5].split("-W")) >= janela for nome in semanas)
+    assert not [nome for nome in lidos if isinstance(nome, int)]
+
+
+def test_pesos_de_diretorio_antigo_vao_para_a_particao_de_pesos(app, pasta, janela_em_janeiro):
+    store = app.ParticionadoUserStore("u@x")
+    store.load(desde=janela_em_janeiro)
+    # Formato anterior: pesos nas semanas e nos anos arquivados
+    os.remove(store.pesos_file)
+    app.save_data([registro("p_semana", datetime.date(2026, 9, 2), "peso"), registro("c", datetime.date(2026, 9, 2))],
+                  store._arquivo_semana(2026, 36))
+    store._gravar_ano(2025, [registro("p_ano", datetime.date(2025, 6, 11), "peso"), registro("a", datetime.date(2025, 6, 10))])
+
+    data_store, _ = app.ParticionadoUserStore("u@x").load(desde=janela_em_janeiro)
+    assert sorted(r["id"] for r in data_store["historico_acumulado"]) == ["p_ano", "p_semana"]
+    assert [r["id"] for r in app.load_data(store._arquivo_semana(2026, 36))] == ["c"]
+    assert [r["id"] for r in store._ler_ano(2025)] == ["a"]
+    assert sorted(r["id"] for r in app.ParticionadoUserStore("u@x").iterar_registros()) == ["a", "c", "p_ano", "p_semana"]
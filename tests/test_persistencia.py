@@ -0,0 +1,141 @@
+import datetime
+import json
+import multiprocessing
+import os
+
+import pytest
+
+PROCESSOS = 8
+GRAVACOES = 40
+
+
+def _escritor(app, caminho, n):
+    for i in range(GRAVACOES):
+        app.update_data(caminho, lambda dados: dados.__setitem__(f"p{n}_{i}", i))
+        app.update_data(caminho, lambda dados: dados.update(contador=dados.get("contador", 0) + 1))
+
+
+def test_update_data_com_varios_processos_nao_perde_gravacoes(app, pasta):
+    if app.fcntl is None or "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("requer fcntl e fork (POSIX)")
+    caminho = str(pasta / "ww_users.json")
+    contexto = multiprocessing.get_context("fork")
+    processos = [contexto.Process(target=_escritor, args=(app, caminho, n)) for n in range(PROCESSOS)]
+    for p in processos:
+        p.start()
+    for p in processos:
+        p.join(timeout=120)
+    assert all(p.exitcode == 0 for p in processos)
+
+    with open(caminho, "rb") as f:
+        dados = json.loads(f.read())
+    assert dados["contador"] == PROCESSOS * GRAVACOES
+    assert {k for k in dados if k != "contador"} == {f"p{n}_{i}" for n in range(PROCESSOS) for i in range(GRAVACOES)}
+    # Nenhum temporário esquecido pelas gravações atômicas
+    assert not [nome for nome in os.listdir(pasta) if nome.startswith(".tmp_")]
+
+
+def test_update_data_nao_sobrescreve_arquivo_ilegivel(app, pasta):
+    caminho = str(pasta / "ww_users.json")
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write('{"a@x": {"password_hash"')
+    with pytest.raises(ValueError):
+        app.update_data(caminho, lambda dados: dados.__setitem__("b@x", {}))
+    with open(caminho, encoding="utf-8") as f:
+        assert f.read() == '{"a@x": {"password_hash"'
+
+
+# -----------------------------
+# Stores do histórico: os mesmos cenários em cada backend
+# -----------------------------
+HOJE = datetime.date.today()
+BACKENDS = ["JournalUserStore", "SqliteUserStore", "ParticionadoUserStore"]
+
+
+def registro(id_, dias_atras=0, tipo="consumo", **extra):
+    return {"id": id_, "tipo": tipo, "data": (HOJE - datetime.timedelta(days=dias_atras)).isoformat(), "nome": "Arroz",
+            "quantidade": 100.0, "pontos": 3.0, "usou_extras": 0.0, **extra}
+
+
+def por_id(historico):
+    return {r["id"]: r for r in historico}
+
+
+@pytest.fixture(params=BACKENDS)
+def abrir(request, app, pasta):
+    return lambda: getattr(app, request.param)("u@x")
+
+
+def test_importa_o_json_legado(app, pasta, abrir):
+    historico = [registro("a", 3), registro("b", 400, tipo="atividade"), registro("p", 500, tipo="peso", quantidade=81.0),
+                 registro("x", 1, observacao="campo fora do esquema")]
+    with open("data_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"meta_diaria": 29, "sexo": "Feminino", "historico_acumulado": historico}, f)
+    with open("activities_u@x.json", "w", encoding="utf-8") as f:
+        json.dump({"2026-01-01": ["Corrida"]}, f)
+
+    data_store, activities = abrir().load()
+    assert data_store["meta_diaria"] == 29 and data_store["sexo"] == "Feminino"
+    assert por_id(data_store["historico_acumulado"]) == por_id(historico)
+    assert activities == {"2026-01-01": ["Corrida"]}
+    # Reabrir não importa de novo (nem duplica)
+    data_store, _ = abrir().load()
+    assert sorted(r["id"] for r in data_store["historico_acumulado"]) == ["a", "b", "p", "x"]
+
+
+def test_inclusao_edicao_e_exclusao_sobrevivem_a_reabertura(app, pasta, abrir):
+    store = abrir()
+    store.load()
+    store.append_many("add", [registro("a"), registro("b", 2), registro("c", 9)])
+    store.append("update", {**registro("a"), "pontos": 7.0})
+    store.append("update", registro("c", 1))  # mudou de data (e de semana, no particionado)
+    store.append("delete", registro("b", 2))
+
+    data_store, _ = abrir().load()
+    assert por_id(data_store["historico_acumulado"]) == {"a": {**registro("a"), "pontos": 7.0}, "c": registro("c", 1)}
+
+
+def test_consulta_por_intervalo_igual_a_varredura(app, pasta, abrir):
+    historico = [registro(f"r{i}", dias, tipo) for i, (dias, tipo) in enumerate(
+        (d, t) for d in range(0, 700, 13) for t in ("consumo", "atividade", "peso"))]
+    store = abrir()
+    store.load()
+    store.append_many("add", historico)
+    store = abrir()
+    data_store, _ = store.load(desde=app.inicio_janela_login())
+    frame = app.HistoryFrame(data_store["historico_acumulado"])
+
+    for tipo, inicio, fim in [("consumo", HOJE - datetime.timedelta(days=500), HOJE - datetime.timedelta(days=100)),
+                              ("atividade", None, HOJE - datetime.timedelta(days=300)),
+                              ("peso", HOJE - datetime.timedelta(days=60), None),
+                              ("consumo", None, None)]:
+        esperado = sorted(
+            (r for r in historico if r["tipo"] == tipo
+             and (inicio is None or r["data"] >= inicio.isoformat()) and (fim is None or r["data"] <= fim.isoformat())),
+            key=lambda r: r["data"],
+        )
+        assert [r["id"] for r in store.query(frame, tipo, inicio, fim)] == [r["id"] for r in esperado], (tipo, inicio, fim)
+
+
+def test_sqlite_consulta_usa_o_indice_tipo_data(app, pasta):
+    store = app.SqliteUserStore("u@x")
+    plano = store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM registros WHERE tipo = ? AND data >= ? AND data <= ? ORDER BY data",
+        ("consumo", "2026-01-01", "2026-02-01"),
+    ).fetchall()
+    assert "idx_registros_tipo_data" in " ".join(str(linha) for linha in plano)
+
+
+def test_sqlite_wal_visivel_para_outra_conexao_e_apos_reabrir(app, pasta):
+    escritor = app.SqliteUserStore("u@x")
+    escritor.load()
+    leitor = app.SqliteUserStore("u@x")
+    assert leitor.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    escritor.append("add", registro("a"))
+    assert os.path.exists("data_u@x.db-wal")
+    assert [r["id"] for r in leitor.load()[0]["historico_acumulado"]] == ["a"]  # lido do WAL, sem checkpoint
+
+    escritor.conn.close()
+    leitor.conn.close()
+    assert [r["id"] for r in app.SqliteUserStore("u@x").load()[0]["historico_acumulado"]] == ["a"]
@@ -0,0 +1,49 @@
+import math
+import random
+
+import pandas as pd
+import pytest
+
+NUTRIENTES = {"Calorias": 50.0, "Carbo": 10.0, "Gordura": 5.0, "Proteina": 5.0, "Sodio_mg": 100.0}
+ZERO_PONTOS = [True, False, "sim", "Sim ", "SIM", "não", "nao", "true", "True", "false", "1", "0", 1, 0, 1.0, None, math.nan, ""]
+
+
+def valor_aleatorio(rnd, divisor):
+    sorteio = rnd.random()
+    if sorteio < 0.1:
+        return math.nan
+    if sorteio < 0.35:
+        return divisor * (rnd.randint(-3, 40) + 0.5)  # contribui k + 0,5 pontos: fronteira do arredondamento
+    if sorteio < 0.45:
+        return str(round(rnd.uniform(0, 500), 2))  # números como texto (planilhas importadas)
+    if sorteio < 0.5:
+        return rnd.randint(0, 300)
+    return round(rnd.uniform(0, 800), rnd.choice([0, 1, 2, 3]))
+
+
+@pytest.mark.parametrize("semente", range(40))
+def test_batch_igual_ao_escalar(app, semente):
+    rnd = random.Random(semente)
+    colunas = [c for c in NUTRIENTES if rnd.random() < 0.85]  # às vezes falta uma coluna inteira
+    linhas = []
+    for _ in range(rnd.randint(1, 80)):
+        linha = {c: valor_aleatorio(rnd, NUTRIENTES[c]) for c in colunas}
+        if rnd.random() < 0.9:
+            linha["ZeroPontos"] = rnd.choice(ZERO_PONTOS)
+        linhas.append(linha)
+    df = pd.DataFrame(linhas)
+
+    # calcular_pontos recebe a linha como o DataFrame a guarda (NaN onde a chave faltava)
+    esperado = [app.calcular_pontos(registro) for registro in df.to_dict("records")]
+    assert app.calcular_pontos_batch(df).tolist() == esperado
+
+
+def test_fronteiras_de_arredondamento(app):
+    df = pd.DataFrame({"Calorias": [25.0, 75.0, -25.0, -75.0, 24.999, 0.0], "ZeroPontos": ["não"] * 6})
+    assert app.calcular_pontos_batch(df).tolist() == [app.calcular_pontos(r) for r in df.to_dict("records")] == [1, 2, 0, -1, 0, 0]
+
+
+def test_dataframe_vazio_e_sem_colunas(app):
+    assert app.calcular_pontos_batch(pd.DataFrame({"Calorias": []})).tolist() == []
+    df = pd.DataFrame({"Nome": ["a", "b"]})
+    assert app.calcular_pontos_batch(df).tolist() == [app.calcular_pontos(r) for r in df.to_dict("records")] == [0, 0]
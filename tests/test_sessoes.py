@@ -0,0 +1,87 @@
+import copy
+import datetime
+import threading
+
+
+def registro(id_):
+    return {"id": id_, "tipo": "consumo", "data": datetime.date.today().isoformat(), "nome": "Arroz",
+            "quantidade": 100.0, "pontos": 3, "usou_extras": 0}
+
+
+def test_versao_do_write_behind_nao_espera_a_fila(app, pasta, monkeypatch):
+    liberar = threading.Event()
+    atomic_write = app.atomic_write
+    monkeypatch.setattr(app, "atomic_write", lambda *a: liberar.wait(10) and atomic_write(*a))
+    gravador = app.GravadorSegundoPlano()
+    inicial = gravador.versao("a.json")
+
+    gravador.enfileirar("a.json", {"x": 1})
+    assert gravador.versao("a.json") == ("fila", 1)  # pendente: a versão já mudou, sem esperar a gravação
+    assert gravador.versao("a.json") != inicial
+    liberar.set()
+    assert gravador.flush(timeout=10)
+    assert gravador.versao("a.json") == ("fila", 1)  # gravado por nós: a mesma versão de antes da gravação
+
+    gravador.enfileirar("a.json", {"x": 2})
+    assert gravador.flush(timeout=10)
+    assert gravador.versao("a.json") == ("fila", 2)
+
+    app.save_data({"x": 3}, "a.json")  # outro processo gravou por cima
+    assert gravador.versao("a.json") == app.assinatura_arquivo("a.json")
+
+
+def test_cache_de_sessoes_copia_o_estado_so_quando_a_marca_muda(app):
+    cache = app.CacheSessoes(3600)
+    copias = []
+
+    def copiar():
+        copias.append(1)
+        return {"historico_acumulado": [len(copias)]}
+
+    cache.guardar("t", "u@x", ("aba1", 1, 0), "v1", copiar, "dashboard")
+    cache.guardar("t", "u@x", ("aba1", 1, 0), "v2", copiar, "peso")
+    assert len(copias) == 1
+    entrada = cache.obter("t")
+    assert (entrada["versao"], entrada["menu"], entrada["estado"]) == ("v2", "peso", {"historico_acumulado": [1]})
+
+    cache.guardar("t", "u@x", ("aba2", 1, 0), "v2", copiar)  # outra aba com o mesmo token
+    cache.guardar("t", "u@x", ("aba2", 2, 0), "v2", copiar)  # histórico alterado
+    assert len(copias) == 3
+    assert cache.obter("t")["estado"] == {"historico_acumulado": [3]}
+
+
+def test_copia_do_store_compartilha_so_os_caches_de_leitura(app, pasta):
+    store = app.JournalUserStore("u@x")
+    store.load()
+    store.append("add", registro("a"))
+    store._anteriores_em_arquivo("consumo")
+    copia = copy.deepcopy(store)
+    assert copia.anteriores_lidos is store.anteriores_lidos
+    assert copia.journal_file == store.journal_file
+
+    particionado = app.ParticionadoUserStore("u@x")
+    particionado.load()
+    copia = copy.deepcopy(particionado)
+    assert copia.anos_lidos is particionado.anos_lidos
+    assert copia.particao_por_id is not particionado.particao_por_id
+
+
+def test_copia_do_store_sqlite_abre_conexao_propria(app, pasta):
+    store = app.SqliteUserStore("u@x")
+    store.load()
+    copia = copy.deepcopy(store)
+    assert copia.conn is not store.conn
+    copia.append("add", registro("a"))
+    assert [r["id"] for r in store.load()[0]["historico_acumulado"]] == ["a"]
+
+
+def test_assinatura_particionada_ignora_locks_e_temporarios(app, pasta):
+    store = app.ParticionadoUserStore("u@x")
+    store.load()
+    store.append("add", registro("a"))
+    antes = store.assinatura()
+    with app.file_lock(store.perfil_file + "-outro"):
+        open(f"{store.dir}/.tmp_abc", "w").close()
+    assert store.assinatura() == antes
+    store.append("add", registro("b"))
+    assert store.assinatura() != antes
@@ -0,0 +1,80 @@
+import pytest
+
+
+def diretorio(app):
+    return app.DiretorioUsuarios("ww_users.json", "ww_users.journal.jsonl")
+
+
+def test_linha_truncada_nao_descarta_cadastros_seguintes(app, pasta):
+    diretorio(app).cadastrar("a@x", {"password_hash": "h"})
+    with open("ww_users.journal.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"email": "b@x", "dados": {"passw')  # gravação interrompida no meio da linha
+    diretorio(app).cadastrar("c@x", {"password_hash": "h"})
+
+    novo = diretorio(app)
+    assert novo.usuario("a@x") == {"password_hash": "h"}
+    assert novo.usuario("b@x") is None
+    assert novo.usuario("c@x") == {"password_hash": "h"}
+
+
+def test_compactacao_preserva_contas_apos_linha_truncada(app, pasta, monkeypatch):
+    monkeypatch.setattr(app, "USERS_JOURNAL_COMPACT_EVERY", 3)
+    diretorio(app).cadastrar("a@x", {"password_hash": "h"})
+    with open("ww_users.journal.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"email": "b@x", "da')
+    diretorio(app).cadastrar("c@x", {"password_hash": "h"})  # terceiro evento (contando a linha ilegível): compacta
+
+    with open("ww_users.journal.jsonl", encoding="utf-8") as f:
+        assert f.read() == ""
+    assert sorted(diretorio(app)._atualizado()) == ["a@x", "c@x"]
+
+
+def test_arquivo_de_usuarios_ilegivel_nao_e_sobrescrito(app, pasta, monkeypatch):
+    monkeypatch.setattr(app, "USERS_JOURNAL_COMPACT_EVERY", 1)
+    with open("ww_users.json", "w", encoding="utf-8") as f:
+        f.write('{"a@x": {"password_hash"')
+    with pytest.raises(ValueError):
+        diretorio(app).cadastrar("b@x", {"password_hash": "h"})
+    with open("ww_users.json", encoding="utf-8") as f:
+        assert f.read() == '{"a@x": {"password_hash"'
+
+
+@pytest.fixture
+def kdfs(app, monkeypatch):
+    """Conta as execuções do scrypt (o hash fictício é calculado antes, fora da contagem)."""
+    app.hash_senha_ficticio()
+    chamadas = []
+    scrypt = app.hashlib.scrypt
+    monkeypatch.setattr(app.hashlib, "scrypt", lambda *a, **k: chamadas.append(1) or scrypt(*a, **k))
+    return chamadas
+
+
+@pytest.mark.parametrize("caso", ["inexistente", "texto_puro", "sem_senha", "hash"])
+def test_login_recusado_sempre_custa_um_kdf(app, kdfs, caso):
+    usuario = {
+        "inexistente": None,
+        "texto_puro": {"password": "outra"},  # usuário antigo, senha ainda não migrada para hash
+        "sem_senha": {},
+        "hash": {"password_hash": app.hash_senha("certa")},
+    }[caso]
+    kdfs.clear()
+    assert app._verificar_usuario(usuario, "errada") == (False, None)
+    assert len(kdfs) == 1
+
+
+def test_senha_em_texto_puro_migra_para_hash(app, kdfs):
+    ok, novo_hash = app._verificar_usuario({"password": "certa"}, "certa")
+    assert ok and app.verificar_hash_senha("certa", novo_hash)
+
+
+def test_migracao_de_senha_em_texto_puro_apaga_a_senha_do_disco(app, pasta, monkeypatch):
+    with open("ww_users.json", "w", encoding="utf-8") as f:
+        f.write('{"a@x": {"password": "segredo-antigo"}, "b@x": {"password": "outro"}}')
+    monkeypatch.setattr(app, "get_diretorio_usuarios", lambda: diretorio(app))
+    assert app.verificar_credenciais("a@x", "segredo-antigo")
+
+    for arquivo in pasta.iterdir():
+        assert b"segredo-antigo" not in arquivo.read_bytes(), arquivo.name
+    novo = diretorio(app)
+    assert app.verificar_hash_senha("segredo-antigo", novo.usuario("a@x")["password_hash"])
+    assert novo.usuario("b@x") == {"password": "outro"}  # ainda não migrado: só no próximo login dele
@@ -2,13 +2,54 @@
 import streamlit as st
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 import datetime
 import json
 import re
+import io
+import copy
+import csv
 import os
 import sys
+import uuid
+import time
+import atexit
+import sqlite3
+import tempfile
+import contextlib
+import threading
+import bisect
+import unicodedata
+import hashlib
+import hmac
+import base64
+import gzip
+import lzma
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from math import floor, ceil
 
+try:
+    import fcntl  # locks consultivos entre processos (POSIX)
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson  # serialização JSON mais rápida; sem ele, json da stdlib
+except ImportError:
+    orjson = None
+
+try:
+    import pdfkit  # exportação do histórico em PDF (requer o binário wkhtmltopdf)
+except ImportError:
+    pdfkit = None
+
+try:
+    import pyarrow as pa  # exportação do histórico em Parquet; sem ele a exportação sai em CSV
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 # -----------------------------
 # Configuração inicial
 # -----------------------------
@@ -16,6 +57,37 @@ st.set_page_config(page_title="Vigilantes do Peso Brasil", layout="wide")
 
 DATA_FILE = "ww_data.json"
 USERS_FILE = "ww_users.json"
+USERS_JOURNAL_FILE = "ww_users.journal.jsonl"  # cadastros/alterações de usuários, uma linha por evento
+USERS_JOURNAL_COMPACT_EVERY = 1000  # eventos no journal de usuários antes de regravar o ww_users.json
+# Senhas: hash scrypt (parâmetros gravados junto do hash) verificado num pool limitado de threads
+SENHA_SCRYPT_N, SENHA_SCRYPT_R, SENHA_SCRYPT_P = 2 ** 14, 8, 1
+SENHA_WORKERS = 4  # verificações de senha simultâneas no processo; as demais aguardam na fila
+# Sessões persistentes: token assinado (HMAC) no parâmetro ?sessao= da URL e estado do usuário em cache no servidor
+SESSION_KEY_FILE = "ww_session.key"  # segredo do HMAC quando WW_SESSION_SECRET não está definido
+SESSION_TOKEN_DAYS = 7               # validade do token
+SESSION_IDLE_MINUTES = 30            # sessões em cache sem uso por mais tempo são descartadas
+IMPORTS_FILE = "ww_imports.json"  # arquivos de alimentos já importados (hash do conteúdo e das linhas)
+
+# Armazenamento do histórico do usuário: "journal" (log append-only + snapshot), "sqlite",
+# "particionado" (um arquivo por semana ISO, anos fechados compactados) ou "json" (reescrita completa)
+HISTORY_BACKEND = os.environ.get("WW_HISTORY_BACKEND", "journal")
+JOURNAL_COMPACT_EVERY = 500  # eventos no journal antes de gerar novo snapshot
+HISTORY_LOGIN_WEEKS = 8  # semanas ISO completas do histórico carregadas em sessão no login; o resto vem sob demanda
+HISTORY_ARCHIVE_FORMAT = os.environ.get("WW_HISTORY_ARCHIVE", "gzip")  # anos fechados no modo "particionado": "gzip" ou "lzma"
+
+# Exportação em PDF: "pdfkit" (wkhtmltopdf) ou "stub" (PDF mínimo, para testes sem wkhtmltopdf)
+PDF_RENDERER = os.environ.get("WW_PDF_RENDERER", "pdfkit")
+PDF_WORKERS = 2  # PDFs renderizados em paralelo; os demais pedidos aguardam na fila do pool
+PDF_DIR = "ww_pdf"  # esvaziada quando o processo cria o exportador: os PDFs de execuções anteriores não têm mais dono
+PDF_MAX_JOBS = 50  # jobs terminados mantidos pelo exportador; acima disso os mais antigos (e seus arquivos) saem
+PDF_TTL_SECONDS = 3600  # jobs terminados há mais tempo que isso são descartados junto com o PDF
+# Arquivos JSON gravados com gzip (WW_JSON_GZIP=1); a leitura detecta o formato pelos bytes iniciais
+JSON_GZIP = os.environ.get("WW_JSON_GZIP", "0") == "1"
+# Gravação em segundo plano (write-behind) dos arquivos do usuário: WW_WRITE_BEHIND=1 ativa
+WRITE_BEHIND = os.environ.get("WW_WRITE_BEHIND", "0") == "1"
+# Seções dos dados privados do usuário acompanhadas pela unidade de trabalho (gravadas uma vez por execução)
+SECOES_USUARIO = ("perfil", "pesos", "historico", "activities")
+EXPORT_CHUNK_ROWS = 5000  # linhas por lote (row group do Parquet / bloco do CSV) na exportação do histórico
 
 # -----------------------------
 # Utilitários
@@ -39,23 +111,257 @@ def round_points(p):
     except Exception:
         return 0
 
+@contextlib.contextmanager
+def file_lock(file_path):
+    """Lock exclusivo entre processos em <arquivo>.lock (sem efeito onde fcntl não existe)."""
+    with open(file_path + ".lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def atomic_write(file_path, text):
+    """Grava (str ou bytes) em arquivo temporário no mesmo diretório, faz fsync e renomeia sobre o destino."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), prefix=".tmp_")
+    try:
+        with (os.fdopen(fd, "wb") if isinstance(text, bytes) else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def anexar_jsonl(file_path, linhas):
+    """
+    Acrescenta linhas (já terminadas em "\\n") a um journal .jsonl e faz fsync; chamar com o lock do arquivo.
+    Se a última linha ficou incompleta (gravação interrompida), ela é encerrada antes com um "\\n":
+    no replay só o evento truncado se perde, não os gravados depois dele.
+    """
+    with open(file_path, "ab+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write("".join(linhas).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+def iterar_jsonl(arquivo):
+    """Objetos de um arquivo .jsonl aberto em modo binário, uma linha por vez; linhas ilegíveis viram None."""
+    for linha in arquivo:
+        if linha.strip():
+            try:
+                yield json.loads(linha)
+            except ValueError:
+                yield None
+
+def ler_jsonl(file_path, filtro=None):
+    """
+    (eventos, linhas_descartadas) de um journal .jsonl; linhas ilegíveis (gravação interrompida) são puladas.
+    Com `filtro`, só os eventos em que filtro(evento) é verdadeiro ficam na lista.
+    """
+    eventos, descartadas = [], 0
+    if os.path.exists(file_path):
+        with open(file_path, "rb") as f:
+            for evento in iterar_jsonl(f):
+                if evento is None:
+                    descartadas += 1
+                elif filtro is None or filtro(evento):
+                    eventos.append(evento)
+    return eventos, descartadas
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def serializar_json(dados, indent=None):
+    """
+    JSON em bytes UTF-8: compacto (sem espaços) por padrão, indentado se `indent` for informado.
+    Usa orjson quando instalado (que só indenta com 2 espaços); valores não serializáveis viram str.
+    """
+    if orjson is not None:
+        opcoes = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(dados, default=str, option=opcoes)
+    separadores = None if indent else (",", ":")
+    return json.dumps(dados, ensure_ascii=False, default=str, indent=indent, separators=separadores).encode("utf-8")
+
+def desserializar_json(conteudo):
+    """Bytes de um arquivo JSON, comprimido com gzip ou não (detectado pelo cabeçalho)."""
+    if conteudo[:2] == GZIP_MAGIC:
+        conteudo = gzip.decompress(conteudo)
+    return orjson.loads(conteudo) if orjson is not None else json.loads(conteudo)
+
+def conteudo_arquivo_json(dados, indent=None):
+    """Conteúdo gravado nos arquivos JSON do app (gzip se JSON_GZIP)."""
+    conteudo = serializar_json(dados, indent)
+    return gzip.compress(conteudo, compresslevel=6) if JSON_GZIP else conteudo
+
+def assinatura_arquivo(file_path):
+    """
+    (mtime_ns, tamanho, inode) do arquivo, ou None se não existe: muda a cada gravação, inclusive de outro
+    processo (atomic_write sempre troca o inode, mesmo que mtime e tamanho coincidam).
+    """
+    try:
+        stat = os.stat(file_path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except FileNotFoundError:
+        return None
+
+def ler_arquivo_json(file_path):
+    with open(file_path, "rb") as f:
+        return desserializar_json(f.read())
+
 def load_data(file_path):
     if os.path.exists(file_path):
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return ler_arquivo_json(file_path)
         except Exception:
             return {}
     return {}
 
-def save_data(data, file_path):
+def save_data(data, file_path, indent=None):
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, default=str, indent=2)
+        with file_lock(file_path):
+            atomic_write(file_path, conteudo_arquivo_json(data, indent))
     except Exception as e:
         st.error(f"Erro ao salvar dados: {e}")
 
+def update_data(file_path, alterar, default=dict, indent=None):
+    """
+    Lê-modifica-grava sob lock: alterar(dados) recebe o conteúdo atual do disco (ou default()),
+    pode alterá-lo no lugar ou devolver um novo valor, e o resultado é gravado atomicamente.
+    Diferente de load_data, um arquivo ilegível gera erro em vez de ser sobrescrito.
+    """
+    with file_lock(file_path):
+        if os.path.exists(file_path):
+            dados = ler_arquivo_json(file_path)
+        else:
+            dados = default()
+        resultado = alterar(dados)
+        if resultado is not None:
+            dados = resultado
+        atomic_write(file_path, conteudo_arquivo_json(dados, indent))
+    return dados
+
+class GravadorSegundoPlano:
+    """
+    Write-behind: save_data executado por uma thread de fundo. Cada arquivo tem no máximo uma gravação
+    pendente; enfileirar de novo o mesmo arquivo substitui o conteúdo pendente (coalescência), então
+    vários cliques seguidos viram uma gravação só. flush() espera a fila esvaziar e também roda no
+    encerramento do processo (atexit). estatisticas() expõe a profundidade da fila e a latência
+    (do primeiro enfileiramento até o arquivo gravado). versao() identifica o conteúdo de um arquivo sem
+    esperar a fila: cada enfileiramento ganha um número de sequência, que continua valendo depois da
+    gravação enquanto o arquivo em disco for o que a thread de fundo gravou.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pendentes = {}     # caminho -> (dados, indent, enfileirado_em, seq)
+        self.em_gravacao = {}   # caminho -> seq sendo gravado agora
+        self.seq = {}           # caminho -> último seq enfileirado
+        self.gravados = {}      # caminho -> (seq, assinatura_arquivo logo após a gravação)
+        self.stats = {"enfileirados": 0, "coalescidos": 0, "gravados": 0, "erros": 0, "ultimo_erro": None,
+                      "latencia_ultima_ms": 0.0, "latencia_max_ms": 0.0, "latencia_total_ms": 0.0}
+        self.thread = threading.Thread(target=self._executar, name="ww-write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def enfileirar(self, caminho, dados, indent=None):
+        """`dados` não deve ser alterado depois de enfileirado (a serialização acontece na thread de fundo)."""
+        with self.cond:
+            anterior = self.pendentes.get(caminho)
+            if anterior:
+                self.stats["coalescidos"] += 1
+            self.seq[caminho] = self.seq.get(caminho, 0) + 1
+            self.pendentes[caminho] = (dados, indent, anterior[2] if anterior else time.monotonic(), self.seq[caminho])
+            self.stats["enfileirados"] += 1
+            self.cond.notify_all()
+
+    def _executar(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pendentes)
+                lote, self.pendentes = self.pendentes, {}
+                self.em_gravacao = {caminho: item[3] for caminho, item in lote.items()}
+            for caminho, (dados, indent, enfileirado_em, seq) in lote.items():
+                try:
+                    with file_lock(caminho):
+                        atomic_write(caminho, conteudo_arquivo_json(dados, indent))
+                        gravado = (seq, assinatura_arquivo(caminho))
+                    erro = None
+                except Exception as e:
+                    erro = f"{caminho}: {e}"
+                latencia = (time.monotonic() - enfileirado_em) * 1000
+                with self.cond:
+                    del self.em_gravacao[caminho]
+                    if erro:
+                        self.stats["erros"] += 1
+                        self.stats["ultimo_erro"] = erro
+                    else:
+                        self.gravados[caminho] = gravado
+                        self.stats["gravados"] += 1
+                        self.stats["latencia_ultima_ms"] = latencia
+                        self.stats["latencia_max_ms"] = max(self.stats["latencia_max_ms"], latencia)
+                        self.stats["latencia_total_ms"] += latencia
+                    self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Espera todas as gravações pendentes terminarem; devolve False se o timeout esgotar antes."""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pendentes and not self.em_gravacao, timeout)
+
+    def versao(self, caminho):
+        """
+        ("fila", seq) enquanto o arquivo tem gravação pendente e depois dela, se ninguém mais o alterou;
+        senão assinatura_arquivo(caminho). Não espera a fila.
+        """
+        with self.cond:
+            if caminho in self.pendentes or caminho in self.em_gravacao:
+                return ("fila", self.seq[caminho])
+            gravado = self.gravados.get(caminho)
+        disco = assinatura_arquivo(caminho)
+        if gravado and gravado[1] == disco:
+            return ("fila", gravado[0])
+        return disco
+
+    def estatisticas(self):
+        with self.cond:
+            gravados = self.stats["gravados"]
+            return {
+                **self.stats,
+                "fila": len(self.pendentes) + len(self.em_gravacao),
+                "latencia_media_ms": self.stats["latencia_total_ms"] / gravados if gravados else 0.0,
+            }
+
+@st.cache_resource
+def get_gravador():
+    return GravadorSegundoPlano()
+
+def salvar_arquivo_usuario(data, file_path, indent=None):
+    """save_data dos arquivos privados do usuário; no modo WRITE_BEHIND a gravação vai para a thread de fundo."""
+    if WRITE_BEHIND:
+        get_gravador().enfileirar(file_path, data, indent)
+    else:
+        save_data(data, file_path, indent)
+
+def versao_arquivo(file_path):
+    """Versão de um arquivo do usuário que considera a fila do write-behind (ver GravadorSegundoPlano.versao)."""
+    if WRITE_BEHIND:
+        return get_gravador().versao(file_path)
+    return assinatura_arquivo(file_path)
+
+def aguardar_gravacoes():
+    """Garante em disco o que ainda está na fila do write-behind (logout, login e leitura de outro processo)."""
+    if WRITE_BEHIND:
+        get_gravador().flush()
+
 def rerun_streamlit():
+    finalizar_execucao()  # o rerun interrompe o script antes do flush do fim da execução
     try:
         if hasattr(st, "experimental_rerun") and callable(st.experimental_rerun):
             st.experimental_rerun()
@@ -67,10 +373,1750 @@ def rerun_streamlit():
 def iso_week_number(date_obj):
     return date_obj.isocalendar()[1]
 
+def iso_year_week(date_obj):
+    """(ano ISO, semana ISO): a semana 5 de 2025 e a de 2026 são chaves diferentes."""
+    ano, semana, _ = date_obj.isocalendar()
+    return ano, semana
+
+def inicio_janela_login(hoje=None):
+    """Segunda-feira da semana mais antiga da janela de login (sempre semanas inteiras, por causa dos extras)."""
+    hoje = hoje or datetime.date.today()
+    return hoje - datetime.timedelta(days=hoje.weekday(), weeks=HISTORY_LOGIN_WEEKS - 1)
+
 def weekday_name_br(dt: datetime.date):
     days = ["segunda", "terça", "quarta", "quinta", "sexta", "sábado", "domingo"]
     return days[dt.weekday()]
 
+def parse_date(d):
+    """Converte string ISO, numpy.datetime64 ou objeto para datetime.date; retorna None se inválido."""
+    if isinstance(d, datetime.date):
+        return d
+    if isinstance(d, np.datetime64):
+        return None if np.isnat(d) else d.astype("datetime64[D]").item()
+    try:
+        return datetime.date.fromisoformat(str(d))
+    except Exception:
+        return None
+
+
+# -----------------------------
+# HISTÓRICO EM COLUNAS (filtros vetorizados)
+# -----------------------------
+class HistoryFrame:
+    """
+    Índice em colunas do histórico em sessão: datas em numpy datetime64[D] (convertidas uma única vez,
+    na inclusão), tipo e nome como códigos categóricos e quantidade/pontos/extras em arrays float.
+    Cada linha aponta para o registro (dict no formato JSON) correspondente; exclusões só desmarcam
+    a linha. Para cada tipo há um índice ordenado por data (dias e linhas), mantido com bisect, então
+    um filtro por tipo e intervalo são duas buscas binárias e uma fatia.
+    """
+
+    COLUNAS_FLOAT = ("quantidade", "pontos", "usou_extras")
+    EPOCA = datetime.date(1970, 1, 1)
+
+    def __init__(self, registros=()):
+        capacidade = max(16, len(registros))
+        self.registros = []        # linha -> registro
+        self.linha_por_id = {}
+        self.codigos_tipo = {}     # categoria -> código
+        self.codigos_nome = {}
+        self.datas = np.full(capacidade, np.datetime64("NaT"), dtype="datetime64[D]")
+        self.tipos = np.full(capacidade, -1, dtype=np.int16)
+        self.nomes = np.full(capacidade, -1, dtype=np.int32)
+        self.quantidade = np.zeros(capacidade)
+        self.pontos = np.zeros(capacidade)
+        self.usou_extras = np.zeros(capacidade)
+        self.ativo = np.zeros(capacidade, dtype=bool)
+        self._indices = None       # código do tipo -> (dias ordenados, linhas), montado no primeiro filtro
+        for registro in registros:
+            self.add(registro)
+
+    def __len__(self):
+        return int(self.ativo[:len(self.registros)].sum())
+
+    def _crescer(self):
+        for coluna in ("datas", "tipos", "nomes", "quantidade", "pontos", "usou_extras", "ativo"):
+            atual = getattr(self, coluna)
+            novo = np.empty(len(atual) * 2, dtype=atual.dtype)
+            novo[:len(atual)] = atual
+            novo[len(atual):] = np.datetime64("NaT") if coluna == "datas" else (-1 if coluna in ("tipos", "nomes") else 0)
+            setattr(self, coluna, novo)
+
+    @staticmethod
+    def _float(valor):
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return 0.0
+
+    @classmethod
+    def _dia(cls, data):
+        return (data - cls.EPOCA).days
+
+    def _indice(self, codigo):
+        """(dias, linhas) das linhas ativas do tipo, em ordem de data (estável)."""
+        if self._indices is None:
+            n = len(self.registros)
+            datas = self.datas[:n]
+            validas = self.ativo[:n] & ~np.isnat(datas)
+            self._indices = {}
+            for cod in self.codigos_tipo.values():
+                linhas = np.flatnonzero(validas & (self.tipos[:n] == cod))
+                linhas = linhas[np.argsort(datas[linhas], kind="stable")]
+                self._indices[cod] = (datas[linhas].astype("int64").tolist(), linhas.tolist())
+        return self._indices.setdefault(codigo, ([], []))
+
+    def _indexar(self, linha):
+        if self._indices is None or np.isnat(self.datas[linha]):
+            return
+        dias, linhas = self._indice(int(self.tipos[linha]))
+        dia = int(self.datas[linha].astype("int64"))
+        pos = bisect.bisect_right(dias, dia)
+        dias.insert(pos, dia)
+        linhas.insert(pos, linha)
+
+    def _desindexar(self, linha):
+        if self._indices is None or np.isnat(self.datas[linha]):
+            return
+        dias, linhas = self._indice(int(self.tipos[linha]))
+        dia = int(self.datas[linha].astype("int64"))
+        inicio, fim = bisect.bisect_left(dias, dia), bisect.bisect_right(dias, dia)
+        if linha in linhas[inicio:fim]:
+            pos = linhas.index(linha, inicio, fim)
+            del dias[pos], linhas[pos]
+
+    def _gravar_linha(self, linha, registro):
+        d = parse_date(registro.get("data"))
+        self.datas[linha] = np.datetime64(d, "D") if d else np.datetime64("NaT")
+        self.tipos[linha] = self.codigos_tipo.setdefault(registro.get("tipo"), len(self.codigos_tipo))
+        self.nomes[linha] = self.codigos_nome.setdefault(registro.get("nome"), len(self.codigos_nome))
+        for coluna in self.COLUNAS_FLOAT:
+            getattr(self, coluna)[linha] = self._float(registro.get(coluna, 0.0))
+        self.ativo[linha] = True
+
+    def add(self, registro):
+        linha = len(self.registros)
+        if linha == len(self.ativo):
+            self._crescer()
+        self.registros.append(registro)
+        if registro.get("id") is not None:
+            self.linha_por_id[registro["id"]] = linha
+        self._gravar_linha(linha, registro)
+        self._indexar(linha)
+
+    def update(self, registro):
+        linha = self.linha_por_id.get(registro.get("id"))
+        if linha is None:
+            return
+        antes = (self.tipos[linha], self.datas[linha])
+        self.registros[linha] = registro
+        mesma_posicao = antes == (
+            self.codigos_tipo.get(registro.get("tipo")), np.datetime64(parse_date(registro.get("data")) or "NaT", "D")
+        )
+        if not mesma_posicao:
+            self._desindexar(linha)
+        self._gravar_linha(linha, registro)
+        if not mesma_posicao:
+            self._indexar(linha)
+
+    def delete(self, registro):
+        linha = self.linha_por_id.pop(registro.get("id"), None)
+        if linha is not None:
+            self._desindexar(linha)
+            self.ativo[linha] = False
+
+    def filtrar(self, tipo=None, inicio=None, fim=None, semana=None):
+        """Linhas ativas (em ordem de data, estável) do tipo e intervalo pedidos; semana = (ano ISO, semana)."""
+        if semana is not None:
+            segunda = datetime.date.fromisocalendar(semana[0], semana[1], 1)
+            inicio = max(inicio, segunda) if inicio else segunda
+            fim = min(fim, segunda + datetime.timedelta(days=6)) if fim else segunda + datetime.timedelta(days=6)
+        if tipo is not None:
+            if tipo not in self.codigos_tipo:
+                return np.empty(0, dtype=np.int64)
+            dias, linhas = self._indice(self.codigos_tipo[tipo])
+            i = bisect.bisect_left(dias, self._dia(inicio)) if inicio else 0
+            j = bisect.bisect_right(dias, self._dia(fim)) if fim else len(dias)
+            return np.array(linhas[i:j], dtype=np.int64)
+
+        # Todos os tipos: máscara sobre as colunas
+        n = len(self.registros)
+        datas = self.datas[:n]
+        mascara = self.ativo[:n] & ~np.isnat(datas)
+        if inicio is not None:
+            mascara &= datas >= np.datetime64(inicio, "D")
+        if fim is not None:
+            mascara &= datas <= np.datetime64(fim, "D")
+        linhas = np.flatnonzero(mascara)
+        return linhas[np.argsort(datas[linhas], kind="stable")]
+
+    def registros_de(self, linhas):
+        return [self.registros[i] for i in linhas]
+
+
+# -----------------------------
+# ARMAZENAMENTO DO HISTÓRICO (JSON / JOURNAL)
+# -----------------------------
+def na_janela(registro, desde):
+    """
+    Registro fica em sessão após o login: data a partir de `desde` (None = tudo). Registros de peso,
+    esparsos e usados no gráfico de tendência e no peso atual, são sempre carregados.
+    """
+    if desde is None or registro.get("tipo") == "peso":
+        return True
+    d = parse_date(registro.get("data"))
+    return d is None or d >= desde
+
+def registro_serializavel(entry):
+    """Cópia do registro com a data em string ISO, pronta para JSON."""
+    return {
+        **entry,
+        "data": (
+            entry["data"].isoformat()
+            if isinstance(entry.get("data"), datetime.date)
+            else str(entry.get("data"))
+        )
+    }
+
+class JsonUserStore:
+    """Formato original: data_{email}.json e activities_{email}.json reescritos a cada persistência."""
+
+    desde = None  # início da janela carregada no login (None = histórico completo em sessão)
+    # Caches de leitura do disco, validados pela versão dos arquivos: compartilhados pelas cópias do store
+    COMPARTILHADOS = ("anteriores_lidos", "consulta_anteriores", "anos_lidos")
+
+    def __init__(self, email):
+        self.data_file = f"data_{email}.json"
+        self.activity_file = f"activities_{email}.json"
+
+    def __deepcopy__(self, memo):
+        """Cópia para outra aba (ver CacheSessoes): estado próprio, caches de leitura compartilhados."""
+        copia = object.__new__(type(self))
+        memo[id(self)] = copia
+        for nome, valor in vars(self).items():
+            setattr(copia, nome, valor if nome in self.COMPARTILHADOS else copy.deepcopy(valor, memo))
+        return copia
+
+    def load(self, desde=None):
+        # persist() regrava o histórico em sessão por inteiro, então aqui tudo precisa ficar carregado
+        data_store = load_data(self.data_file) or {}
+        for reg in data_store.get("historico_acumulado", []):
+            # Registros antigos sem id: o id é gravado junto na próxima regravação do arquivo
+            reg.setdefault("id", uuid.uuid4().hex)
+        return data_store, load_data(self.activity_file) or {}
+
+    def append(self, op, registro):
+        # Nada a fazer: o histórico completo é gravado em persist()
+        pass
+
+    def append_many(self, op, registros):
+        for registro in registros:
+            self.append(op, registro)
+
+    def _anteriores(self, tipo, inicio, fim):
+        """Registros do tipo que ficaram fora da janela do login e podem cair em [inicio, fim], lidos do disco."""
+        return []
+
+    def assinatura(self):
+        """Versão dos dados do usuário em disco, incluindo o que está na fila do write-behind (ver versao_arquivo)."""
+        return tuple(versao_arquivo(c) for c in (self.data_file, self.activity_file))
+
+    def iterar_registros(self):
+        """
+        Histórico completo lido do disco, sem passar pela sessão (exportação). Neste formato o histórico é
+        um único documento JSON, então o arquivo do usuário é carregado inteiro antes do primeiro registro.
+        """
+        yield from (load_data(self.data_file) or {}).get("historico_acumulado", [])
+
+    def ler_activities(self):
+        return load_data(self.activity_file) or {}
+
+    def query(self, frame, tipo, inicio=None, fim=None):
+        """
+        Registros de um tipo entre inicio e fim (inclusive), em ordem de data. Filtro vetorizado no
+        HistoryFrame da sessão, completado com o disco quando o intervalo começa antes da janela do login
+        (pesos nunca: na_janela os mantém todos em sessão).
+        """
+        resultado = frame.registros_de(frame.filtrar(tipo, inicio, fim))
+        if tipo == "peso":
+            return resultado
+        anteriores = [r for r in self._anteriores(tipo, inicio, fim) if r.get("id") not in frame.linha_por_id]
+        if anteriores:
+            combinado = HistoryFrame(anteriores + resultado)
+            resultado = combinado.registros_de(combinado.filtrar(tipo, inicio, fim))
+        return resultado
+
+    def persist(self, perfil, historico, activities, secoes=SECOES_USUARIO):
+        """Grava as seções alteradas (`secoes`, ver SECOES_USUARIO)."""
+        if {"perfil", "pesos", "historico"} & set(secoes):
+            ds = {**perfil, "historico_acumulado": [registro_serializavel(r) for r in historico]}
+            salvar_arquivo_usuario(ds, self.data_file)
+        if "activities" in secoes:
+            salvar_arquivo_usuario(copy.deepcopy(activities), self.activity_file)
+
+
+class JournalUserStore(JsonUserStore):
+    """
+    Histórico em modo journal: cada alteração vira uma linha JSON em data_{email}.journal.jsonl.
+    O data_{email}.json funciona como snapshot; a cada JOURNAL_COMPACT_EVERY eventos o estado completo
+    é regravado como novo snapshot e o journal é truncado. A compactação separa o histórico por data:
+    o snapshot guarda o perfil, os pesos e os registros a partir do corte (início da janela do login
+    no momento da compactação) e data_{email}.anteriores.jsonl o restante, um registro por linha.
+    O login lê só o snapshot e o journal; os registros anteriores ao corte são lidos sob demanda, só os
+    do tipo consultado (e ficam em cache por tipo, por versão dos arquivos, enquanto o store estiver em
+    sessão; consultas sem início não usam nem alimentam o cache).
+    """
+
+    def __init__(self, email):
+        super().__init__(email)
+        self.journal_file = f"data_{email}.journal.jsonl"
+        self.anteriores_file = f"data_{email}.anteriores.jsonl"
+        self.eventos = 0
+        self.corte = None           # registros com data anterior ao corte estão em anteriores_file
+        self.anteriores_lidos = {}  # tipo -> (assinatura do anteriores_file, registros do tipo)
+        self.consulta_anteriores = {}  # tipo -> (assinatura do store, dias ordenados, registros fora da janela)
+        self.ultimo_perfil = None
+        self.ultimas_activities = None
+
+    def _anteriores_em_arquivo(self, tipo):
+        """Registros do tipo em anteriores_file, lidos uma vez por versão do arquivo (não devem ser alterados)."""
+        assinatura = assinatura_arquivo(self.anteriores_file)
+        lido = self.anteriores_lidos.get(tipo)
+        if lido is None or lido[0] != assinatura:
+            lido = (assinatura, ler_jsonl(self.anteriores_file, lambda r: r.get("tipo") == tipo)[0])
+            self.anteriores_lidos[tipo] = lido
+        return lido[1]
+
+    def _ler_estado(self, desde=None, anteriores=None):
+        """
+        Snapshot + replay do journal, a partir do disco. Os registros anteriores ao corte só são lidos
+        se `desde` for None ou anterior ao corte; `anteriores` substitui a leitura do arquivo deles.
+        Devolve (perfil, historico, precisa_compactar).
+        """
+        # Leitura estrita: um snapshot ilegível gera erro em vez de ser compactado como se estivesse vazio
+        snapshot = ler_arquivo_json(self.data_file) if os.path.exists(self.data_file) else {}
+        perfil = {k: v for k, v in snapshot.items() if k not in ("historico_acumulado", "historico_corte")}
+        self.corte = parse_date(snapshot.get("historico_corte"))
+        # Snapshot no formato antigo (histórico inteiro, sem corte): separado na primeira compactação
+        precisa_compactar = bool(snapshot.get("historico_acumulado")) and self.corte is None
+
+        por_id = {}
+        if self.corte and (desde is None or desde < self.corte):
+            if anteriores is None:
+                anteriores = ler_jsonl(self.anteriores_file)[0]
+            por_id.update((reg["id"], reg) for reg in anteriores)
+
+        # Snapshot: registros antigos sem id recebem um id e são regravados logo em seguida
+        for reg in snapshot.get("historico_acumulado", []):
+            if not reg.get("id"):
+                reg["id"] = uuid.uuid4().hex
+                precisa_compactar = True
+            por_id[reg["id"]] = reg
+
+        # Replay do journal (idempotente: reaplicar eventos já presentes no snapshot não altera o estado).
+        # Linhas incompletas de gravações interrompidas são puladas; a compactação regrava o journal limpo.
+        eventos, descartadas = ler_jsonl(self.journal_file)
+        precisa_compactar = precisa_compactar or descartadas > 0
+        self.eventos = len(eventos)
+        for evento in eventos:
+            op = evento.get("op")
+            if op in ("add", "update"):
+                reg = evento["registro"]
+                por_id[reg["id"]] = reg
+            elif op == "delete":
+                por_id.pop(evento.get("id"), None)
+            elif op == "perfil":
+                perfil.update(evento.get("perfil", {}))
+        return perfil, list(por_id.values()), precisa_compactar
+
+    def _compactar(self, perfil, historico):
+        """Regrava snapshot e anteriores_file a partir do estado completo e zera o journal (com o lock do snapshot)."""
+        corte = inicio_janela_login()
+        recentes, anteriores = [], []
+        for r in historico:
+            (recentes if na_janela(r, corte) else anteriores).append(registro_serializavel(r))
+        # Anteriores primeiro: se o processo cair antes do snapshot, o snapshot antigo (corte mais antigo)
+        # repete registros que também estão no arquivo novo, e o replay por id resolve a duplicata
+        atomic_write(self.anteriores_file, "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in anteriores))
+        ds = {**perfil, "historico_corte": corte.isoformat(), "historico_acumulado": recentes}
+        atomic_write(self.data_file, conteudo_arquivo_json(ds))
+        # Se o processo cair aqui, o replay do journal antigo sobre o novo snapshot é inofensivo
+        open(self.journal_file, "w", encoding="utf-8").close()
+        self.corte = corte
+        self.eventos = 0
+
+    def load(self, desde=None):
+        with file_lock(self.data_file):
+            perfil, historico, precisa_compactar = self._ler_estado(desde)
+            # Corte muito atrás da janela: o snapshot acumula registros que o login lê e descarta
+            corte_atrasado = bool(desde and self.corte and self.corte < desde - datetime.timedelta(weeks=HISTORY_LOGIN_WEEKS))
+            if precisa_compactar or corte_atrasado or self.eventos >= JOURNAL_COMPACT_EVERY:
+                if desde is not None and self.corte and desde >= self.corte:
+                    perfil, historico, _ = self._ler_estado()  # a compactação precisa também dos anteriores
+                self._compactar(perfil, historico)
+        activities = load_data(self.activity_file) or {}
+        self.ultimo_perfil = json.dumps(perfil, sort_keys=True, default=str)
+        self.ultimas_activities = json.dumps(activities, sort_keys=True, default=str)
+        self.desde = desde
+        return {**perfil, "historico_acumulado": [r for r in historico if na_janela(r, desde)]}, activities
+
+    def _fora_da_janela(self, tipo, anteriores):
+        """(dias ordenados, registros do tipo fora da janela do login na mesma ordem), do disco."""
+        with file_lock(self.data_file):
+            _, historico, _ = self._ler_estado(anteriores=anteriores)
+        fora = sorted(
+            ((parse_date(r.get("data")), r) for r in historico
+             if r.get("tipo") == tipo and not na_janela(r, self.desde)),
+            key=lambda par: par[0],
+        )
+        return [d.toordinal() for d, _ in fora], [r for _, r in fora]
+
+    def _anteriores(self, tipo, inicio, fim):
+        """
+        Registros do tipo fora da janela do login em [inicio, fim]. Com início, ficam em cache (por tipo) até
+        algum arquivo do usuário mudar; aí só snapshot e journal são relidos (anteriores_file só quando a
+        compactação o regrava). Sem início (histórico inteiro do tipo) a leitura não fica em sessão. Devolve cópias.
+        """
+        if self.desde is None or (inicio and inicio >= self.desde):
+            return []
+        if inicio is None:
+            dias, registros = self._fora_da_janela(tipo, ler_jsonl(self.anteriores_file, lambda r: r.get("tipo") == tipo)[0])
+        else:
+            assinatura = self.assinatura()
+            consulta = self.consulta_anteriores.get(tipo)
+            if consulta is None or consulta[0] != assinatura:
+                consulta = (assinatura, *self._fora_da_janela(tipo, self._anteriores_em_arquivo(tipo)))
+                self.consulta_anteriores[tipo] = consulta
+            _, dias, registros = consulta
+        i = bisect.bisect_left(dias, inicio.toordinal()) if inicio else 0
+        j = bisect.bisect_right(dias, fim.toordinal()) if fim else len(dias)
+        return [dict(r) for r in registros[i:j]]
+
+    def assinatura(self):
+        return tuple(versao_arquivo(c) for c in (self.data_file, self.journal_file, self.anteriores_file, self.activity_file))
+
+    def iterar_registros(self):
+        """
+        Histórico completo sem montá-lo em memória: o journal (limitado pela compactação) vira um mapa de
+        alterações por id, aplicado enquanto anteriores_file é lido linha a linha; depois vêm o snapshot
+        (do tamanho da janela) e os registros novos do journal. Snapshot e journal são lidos e anteriores_file
+        é aberto sob lock: o arquivo aberto continua o mesmo se uma compactação o substituir no meio.
+        """
+        with file_lock(self.data_file):
+            snapshot = ler_arquivo_json(self.data_file) if os.path.exists(self.data_file) else {}
+            corte = parse_date(snapshot.get("historico_corte"))
+            alteracoes = {}  # id -> registro mais recente no journal (None = excluído)
+            for evento in ler_jsonl(self.journal_file)[0]:
+                if evento.get("op") in ("add", "update"):
+                    alteracoes[evento["registro"]["id"]] = evento["registro"]
+                elif evento.get("op") == "delete":
+                    alteracoes[evento.get("id")] = None
+            anteriores = open(self.anteriores_file, "rb") if corte and os.path.exists(self.anteriores_file) else None
+
+        def com_alteracoes(reg):
+            if reg.get("id") in alteracoes:
+                return alteracoes.pop(reg["id"])
+            return reg
+
+        if anteriores:
+            with anteriores:
+                for reg in iterar_jsonl(anteriores):
+                    # Data a partir do corte: cópia que também está no snapshot (compactação interrompida)
+                    if reg is None or (parse_date(reg.get("data")) or corte) >= corte:
+                        continue
+                    reg = com_alteracoes(reg)
+                    if reg is not None:
+                        yield reg
+        for reg in snapshot.get("historico_acumulado", []):
+            reg = com_alteracoes(reg)
+            if reg is not None:
+                yield reg
+        yield from (reg for reg in alteracoes.values() if reg is not None)
+
+    def append(self, op, registro):
+        self.append_many(op, [registro])
+
+    def append_many(self, op, registros):
+        if registros:
+            self._escrever_evento(*[
+                {"op": "delete", "id": r["id"]} if op == "delete" else {"op": op, "registro": registro_serializavel(r)}
+                for r in registros
+            ])
+
+    def _escrever_evento(self, *eventos):
+        with file_lock(self.data_file):
+            anexar_jsonl(self.journal_file, [json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in eventos])
+        self.eventos += len(eventos)
+
+    def persist(self, perfil, historico, activities, secoes=SECOES_USUARIO):
+        # O histórico já foi gravado evento a evento; aqui só perfil e activities, se marcados
+        perfil_json = json.dumps(perfil, sort_keys=True, default=str) if {"perfil", "pesos"} & set(secoes) else self.ultimo_perfil
+        if perfil_json != self.ultimo_perfil:
+            self._escrever_evento({"op": "perfil", "perfil": perfil})
+            self.ultimo_perfil = perfil_json
+        activities_json = json.dumps(activities, sort_keys=True, default=str) if "activities" in secoes else self.ultimas_activities
+        if activities_json != self.ultimas_activities:
+            salvar_arquivo_usuario(copy.deepcopy(activities), self.activity_file)
+            self.ultimas_activities = activities_json
+        if self.eventos >= JOURNAL_COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        """
+        Regrava o snapshot completo e zera o journal. O estado é relido do disco sob lock,
+        então eventos gravados por outras sessões do mesmo usuário entram no snapshot.
+        """
+        with file_lock(self.data_file):
+            perfil, historico, _ = self._ler_estado()
+            self._compactar(perfil, historico)
+
+
+class SqliteUserStore(JsonUserStore):
+    """
+    Histórico em data_{email}.db (sqlite3, modo WAL): uma linha por registro, com índice em (tipo, data)
+    para consultas por intervalo; inclusões, edições e exclusões alteram apenas a linha afetada.
+    Na primeira abertura importa o data_{email}.json (e o journal, se houver).
+    """
+
+    CAMPOS = ("id", "tipo", "data", "nome", "quantidade", "pontos", "usou_extras")
+    COMPARTILHADOS = JsonUserStore.COMPARTILHADOS + ("conn",)  # a cópia troca a conexão por uma própria
+
+    def __init__(self, email):
+        super().__init__(email)
+        self.email = email
+        self.db_file = f"data_{email}.db"
+        self.ultimo_perfil = {}
+        self.conn = self._conectar()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS registros (
+                id TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                data TEXT NOT NULL,
+                nome TEXT,
+                quantidade REAL,
+                pontos REAL,
+                usou_extras REAL,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_registros_tipo_data ON registros (tipo, data);
+            CREATE TABLE IF NOT EXISTS perfil (chave TEXT PRIMARY KEY, valor TEXT);
+        """)
+        self.conn.commit()
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def __deepcopy__(self, memo):
+        copia = super().__deepcopy__(memo)
+        copia.conn = copia._conectar()
+        return copia
+
+    def _linha(self, registro):
+        r = registro_serializavel(registro)
+        extra = {k: v for k, v in r.items() if k not in self.CAMPOS}
+        return (
+            r["id"], r.get("tipo"), r["data"], r.get("nome"),
+            r.get("quantidade"), r.get("pontos"), r.get("usou_extras"),
+            json.dumps(extra, ensure_ascii=False, default=str) if extra else None,
+        )
+
+    def _registro(self, linha):
+        registro = dict(zip(self.CAMPOS, linha[:-1]))
+        if linha[-1]:
+            registro.update(json.loads(linha[-1]))
+        return registro
+
+    def _importar_legado(self):
+        data_store, activities = JournalUserStore(self.email).load()
+        self.append_many("add", data_store.pop("historico_acumulado", []))
+        self._gravar_perfil({**data_store, "activities": activities, "_migrado": True})
+
+    def _gravar_perfil(self, valores):
+        self.conn.executemany(
+            "INSERT INTO perfil (chave, valor) VALUES (?, ?) ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+            [(k, json.dumps(v, ensure_ascii=False, default=str)) for k, v in valores.items()],
+        )
+        self.conn.commit()
+        self.ultimo_perfil.update(valores)
+
+    def load(self, desde=None):
+        perfil = {k: json.loads(v) for k, v in self.conn.execute("SELECT chave, valor FROM perfil")}
+        if not perfil.get("_migrado"):
+            self._importar_legado()
+            perfil = {k: json.loads(v) for k, v in self.conn.execute("SELECT chave, valor FROM perfil")}
+        self.ultimo_perfil = dict(perfil)
+        activities = perfil.pop("activities", {}) or {}
+        perfil.pop("_migrado", None)
+        self.desde = desde
+        historico = [
+            self._registro(linha)
+            for linha in self.conn.execute(
+                f"SELECT {', '.join(self.CAMPOS)}, extra FROM registros WHERE tipo = 'peso' OR data >= ? ORDER BY rowid",
+                (desde.isoformat() if desde else "",),
+            )
+        ]
+        return {**perfil, "historico_acumulado": historico}, activities
+
+    def assinatura(self):
+        return tuple(versao_arquivo(c) for c in (self.db_file, self.db_file + "-wal"))
+
+    def _migrado(self):
+        return self.conn.execute("SELECT 1 FROM perfil WHERE chave = '_migrado'").fetchone() is not None
+
+    def iterar_registros(self):
+        if not self._migrado():
+            self._importar_legado()
+        # O cursor entrega as linhas sob demanda
+        for linha in self.conn.execute(f"SELECT {', '.join(self.CAMPOS)}, extra FROM registros ORDER BY data, rowid"):
+            yield self._registro(linha)
+
+    def ler_activities(self):
+        linha = self.conn.execute("SELECT valor FROM perfil WHERE chave = 'activities'").fetchone()
+        return (json.loads(linha[0]) or {}) if linha else super().ler_activities()
+
+    def append(self, op, registro):
+        self.append_many(op, [registro])
+
+    def append_many(self, op, registros):
+        if op == "delete":
+            self.conn.executemany("DELETE FROM registros WHERE id = ?", [(r["id"],) for r in registros])
+        else:
+            self.conn.executemany(
+                f"INSERT INTO registros ({', '.join(self.CAMPOS)}, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET tipo = excluded.tipo, data = excluded.data, nome = excluded.nome, "
+                "quantidade = excluded.quantidade, pontos = excluded.pontos, "
+                "usou_extras = excluded.usou_extras, extra = excluded.extra",
+                [self._linha(r) for r in registros],
+            )
+        self.conn.commit()
+
+    def persist(self, perfil, historico, activities, secoes=SECOES_USUARIO):
+        candidatos = {**(perfil if {"perfil", "pesos"} & set(secoes) else {}),
+                      **({"activities": activities} if "activities" in secoes else {})}
+        alterados = {
+            k: v for k, v in candidatos.items()
+            if json.dumps(v, sort_keys=True, default=str) != json.dumps(self.ultimo_perfil.get(k), sort_keys=True, default=str)
+        }
+        if alterados:
+            self._gravar_perfil(alterados)
+
+    def query(self, frame, tipo, inicio=None, fim=None):
+        """Consulta indexada em (tipo, data)."""
+        sql = f"SELECT {', '.join(self.CAMPOS)}, extra FROM registros WHERE tipo = ?"
+        params = [tipo]
+        if inicio:
+            sql += " AND data >= ?"
+            params.append(inicio.isoformat())
+        if fim:
+            sql += " AND data <= ?"
+            params.append(fim.isoformat())
+        sql += " ORDER BY data, rowid"
+        return [self._registro(linha) for linha in self.conn.execute(sql, params)]
+
+
+class ParticionadoUserStore(JsonUserStore):
+    """
+    Histórico particionado por (ano ISO, semana ISO) em hist_{email}/AAAA-Wss.json, regravando só a
+    partição do registro alterado. Os pesos, poucos e sempre carregados em sessão (ver na_janela), ficam
+    numa partição própria, hist_{email}/pesos.json. No login são lidas só ela e as semanas da janela;
+    um ano cuja última semana já saiu da janela do login é consolidado num arquivo compactado
+    (AAAA.json.gz ou .json.xz) que só é aberto quando uma consulta pede um intervalo daquele ano (e fica
+    em cache, por versão do arquivo, enquanto o store estiver em sessão). Na primeira abertura importa
+    o data_{email}.json (e o journal, se houver).
+    """
+
+    COMPACTADORES = {"gzip": (".json.gz", gzip), "lzma": (".json.xz", lzma)}
+    PESOS = "pesos"  # chave da partição dos pesos em particao_por_id
+
+    def __init__(self, email):
+        super().__init__(email)
+        self.email = email
+        self.dir = f"hist_{email}"
+        self.perfil_file = os.path.join(self.dir, "perfil.json")
+        self.pesos_file = os.path.join(self.dir, "pesos.json")
+        self.particao_por_id = {}   # id -> (ano, semana) da partição onde o registro está gravado, ou PESOS
+        self.anos_lidos = {}        # ano arquivado -> (assinatura do arquivo, dias ordenados, registros na mesma ordem)
+        self.ultimo_perfil = None
+        self.ultimas_activities = None
+
+    def _arquivo_semana(self, ano, semana):
+        return os.path.join(self.dir, f"{ano}-W{semana:02d}.json")
+
+    def _arquivo_ano(self, ano):
+        """Arquivo compactado existente do ano (qualquer formato) ou o nome no formato configurado."""
+        for extensao, _ in self.COMPACTADORES.values():
+            caminho = os.path.join(self.dir, f"{ano}{extensao}")
+            if os.path.exists(caminho):
+                return caminho
+        extensao, _ = self.COMPACTADORES.get(HISTORY_ARCHIVE_FORMAT, self.COMPACTADORES["gzip"])
+        return os.path.join(self.dir, f"{ano}{extensao}")
+
+    def _anos_arquivados(self):
+        return sorted({
+            int(nome.split(".")[0]) for nome in os.listdir(self.dir)
+            if nome.endswith(tuple(ext for ext, _ in self.COMPACTADORES.values()))
+        })
+
+    def _semanas_em_disco(self):
+        return sorted(
+            tuple(int(x) for x in nome[:-len(".json")].split("-W"))
+            for nome in os.listdir(self.dir)
+            if re.fullmatch(r"\d{4}-W\d{2}\.json", nome)
+        )
+
+    def _ler_ano(self, ano):
+        caminho = self._arquivo_ano(ano)
+        if not os.path.exists(caminho):
+            return []
+        modulo = gzip if caminho.endswith(".gz") else lzma
+        with open(caminho, "rb") as f:
+            return desserializar_json(modulo.decompress(f.read()))
+
+    def _gravar_ano(self, ano, registros):
+        caminho = self._arquivo_ano(ano)
+        modulo = gzip if caminho.endswith(".gz") else lzma
+        atomic_write(caminho, modulo.compress(serializar_json(registros)))
+
+    @staticmethod
+    def _ano_fechado(ano):
+        """Ano ISO cuja última semana termina antes da janela do login (nenhuma semana dele é carregada em sessão)."""
+        return datetime.date.fromisocalendar(ano + 1, 1, 1) <= inicio_janela_login()
+
+    def _reabrir_anos(self):
+        """Anos arquivados antes de saírem da janela do login voltam para as partições semanais."""
+        for ano in self._anos_arquivados():
+            if self._ano_fechado(ano):
+                continue
+            por_semana = {}
+            for reg in self._ler_ano(ano):
+                por_semana.setdefault(iso_year_week(parse_date(reg["data"])), {})[reg["id"]] = reg
+            for chave, registros in por_semana.items():
+                update_data(self._arquivo_semana(*chave), lambda atuais: list({**registros, **{r["id"]: r for r in atuais}}.values()), default=list)
+            os.remove(self._arquivo_ano(ano))
+
+    def _arquivar_anos_fechados(self):
+        """Move as partições semanais de anos ISO fechados (ver _ano_fechado) para o arquivo compactado do ano."""
+        self._reabrir_anos()
+        por_ano = {}
+        for ano, semana in self._semanas_em_disco():
+            if self._ano_fechado(ano):
+                por_ano.setdefault(ano, []).append(semana)
+        for ano, semanas in por_ano.items():
+            registros = {r["id"]: r for r in self._ler_ano(ano)}
+            for semana in semanas:
+                registros.update((r["id"], r) for r in load_data(self._arquivo_semana(ano, semana)) or [])
+            with file_lock(self._arquivo_ano(ano)):
+                self._gravar_ano(ano, list(registros.values()))
+            # Se o processo cair antes de apagar as semanas, a próxima consolidação é idempotente
+            for semana in semanas:
+                os.remove(self._arquivo_semana(ano, semana))
+
+    def _separar_pesos(self):
+        """
+        Diretórios gravados antes da partição de pesos: move os pesos das semanas e dos anos arquivados para
+        pesos_file. Ele é gravado primeiro; se o processo cair antes de limpar as partições, os pesos que
+        sobram nelas são ignorados (load, iterar_registros e _anteriores só leem pesos de pesos_file).
+        """
+        pesos = {}
+        semanas = [chave for chave in self._semanas_em_disco()
+                   if any(r.get("tipo") == "peso" for r in load_data(self._arquivo_semana(*chave)) or [])]
+        for chave in semanas:
+            pesos.update((r["id"], r) for r in load_data(self._arquivo_semana(*chave)) or [] if r.get("tipo") == "peso")
+        anos = {ano: self._ler_ano(ano) for ano in self._anos_arquivados()}
+        for registros in anos.values():
+            pesos.update((r["id"], r) for r in registros if r.get("tipo") == "peso")
+        update_data(self.pesos_file, lambda atuais: list({**pesos, **{r["id"]: r for r in atuais}}.values()), default=list)
+        for chave in semanas:
+            update_data(self._arquivo_semana(*chave), lambda atuais: [r for r in atuais if r.get("tipo") != "peso"], default=list)
+        for ano, registros in anos.items():
+            if any(r.get("tipo") == "peso" for r in registros):
+                with file_lock(self._arquivo_ano(ano)):
+                    self._gravar_ano(ano, [r for r in registros if r.get("tipo") != "peso"])
+
+    def _importar_legado(self):
+        data_store, activities = JournalUserStore(self.email).load()
+        self.append_many("add", data_store.pop("historico_acumulado", []))
+        atomic_write(self.perfil_file, conteudo_arquivo_json(data_store))
+        if activities and not os.path.exists(self.activity_file):
+            save_data(activities, self.activity_file)
+
+    def load(self, desde=None):
+        os.makedirs(self.dir, exist_ok=True)
+        with file_lock(self.perfil_file):
+            if not os.path.exists(self.perfil_file):
+                self._importar_legado()
+            if not os.path.exists(self.pesos_file):
+                self._separar_pesos()
+            self._arquivar_anos_fechados()
+            historico = load_data(self.pesos_file) or []
+            self.particao_por_id.update((reg["id"], self.PESOS) for reg in historico)
+            # Só as semanas da janela; sem janela (histórico completo), também as anteriores e os anos arquivados
+            janela = iso_year_week(desde) if desde else (0, 0)
+            particoes = [] if desde else [((ano, None), self._ler_ano(ano)) for ano in self._anos_arquivados()]
+            particoes += [(chave, load_data(self._arquivo_semana(*chave)) or [])
+                          for chave in self._semanas_em_disco() if chave >= janela]
+            for chave, registros in particoes:
+                for reg in registros:
+                    if reg.get("tipo") != "peso" and na_janela(reg, desde):
+                        self.particao_por_id[reg["id"]] = iso_year_week(parse_date(reg["data"])) if chave[1] is None else chave
+                        historico.append(reg)
+            perfil = load_data(self.perfil_file) or {}
+        activities = load_data(self.activity_file) or {}
+        self.ultimo_perfil = json.dumps(perfil, sort_keys=True, default=str)
+        self.ultimas_activities = json.dumps(activities, sort_keys=True, default=str)
+        self.desde = desde
+        return {**perfil, "historico_acumulado": historico}, activities
+
+    def _alterar_particao(self, chave, alterar):
+        """Aplica alterar(registros) à partição (pesos, arquivo do ano, se o ano já foi arquivado, ou a semana)."""
+        if chave == self.PESOS:
+            update_data(self.pesos_file, alterar, default=list)
+            return
+        ano, semana = chave
+        if os.path.exists(self._arquivo_ano(ano)):
+            with file_lock(self._arquivo_ano(ano)):
+                registros = self._ler_ano(ano)
+                alterar(registros)
+                self._gravar_ano(ano, registros)
+        else:
+            update_data(self._arquivo_semana(ano, semana), alterar, default=list)
+
+    def append(self, op, registro):
+        self.append_many(op, [registro])
+
+    def append_many(self, op, registros):
+        os.makedirs(self.dir, exist_ok=True)
+        # Agrupa por partição: uma regravação por semana afetada
+        por_particao = {}
+        for r in registros:
+            anterior = self.particao_por_id.get(r["id"])
+            data = parse_date(r.get("data"))
+            chave = self.PESOS if r.get("tipo") == "peso" else (iso_year_week(data) if data else anterior)
+            if chave is None:
+                continue
+            if anterior and anterior != chave:
+                por_particao.setdefault(anterior, {})[r["id"]] = None  # mudou de semana: sai da antiga
+            por_particao.setdefault(chave, {})[r["id"]] = None if op == "delete" else registro_serializavel(r)
+            if op == "delete":
+                self.particao_por_id.pop(r["id"], None)
+            else:
+                self.particao_por_id[r["id"]] = chave
+
+        for chave, alteracoes in por_particao.items():
+            def alterar(atuais):
+                existentes = {reg["id"]: i for i, reg in enumerate(atuais)}
+                for id_, novo in alteracoes.items():
+                    if id_ in existentes and novo is not None:
+                        atuais[existentes[id_]] = novo
+                    elif novo is not None:
+                        atuais.append(novo)
+                atuais[:] = [reg for reg in atuais if reg["id"] not in alteracoes or alteracoes[reg["id"]] is not None]
+
+            self._alterar_particao(chave, alterar)
+
+    def persist(self, perfil, historico, activities, secoes=SECOES_USUARIO):
+        perfil_json = json.dumps(perfil, sort_keys=True, default=str) if {"perfil", "pesos"} & set(secoes) else self.ultimo_perfil
+        if perfil_json != self.ultimo_perfil:
+            os.makedirs(self.dir, exist_ok=True)
+            salvar_arquivo_usuario(perfil, self.perfil_file)
+            self.ultimo_perfil = perfil_json
+        activities_json = json.dumps(activities, sort_keys=True, default=str) if "activities" in secoes else self.ultimas_activities
+        if activities_json != self.ultimas_activities:
+            salvar_arquivo_usuario(copy.deepcopy(activities), self.activity_file)
+            self.ultimas_activities = activities_json
+
+    def _ano_em_cache(self, ano):
+        """(dias ordenados, registros na mesma ordem) do ano arquivado, descompactado uma vez por versão do arquivo."""
+        assinatura = assinatura_arquivo(self._arquivo_ano(ano))
+        lido = self.anos_lidos.get(ano)
+        if lido is None or lido[0] != assinatura:
+            registros = sorted(self._ler_ano(ano), key=lambda r: r["data"])
+            lido = (assinatura, [parse_date(r["data"]).toordinal() for r in registros], registros)
+            self.anos_lidos[ano] = lido
+        return lido[1], lido[2]
+
+    def _anteriores(self, tipo, inicio, fim):
+        """
+        Registros do tipo em [inicio, fim] nos anos arquivados (em cache, com busca binária pelas datas) e nas
+        semanas anteriores à janela do login. Devolve cópias: quem altera o resultado não altera o cache.
+        """
+        if not os.path.isdir(self.dir):
+            return []
+        primeira = iso_year_week(inicio) if inicio else (0, 0)
+        ultima = iso_year_week(fim) if fim else (9999, 99)
+        registros = []
+        for ano in self._anos_arquivados():
+            if primeira[0] <= ano <= ultima[0]:
+                dias, do_ano = self._ano_em_cache(ano)
+                i = bisect.bisect_left(dias, inicio.toordinal()) if inicio else 0
+                j = bisect.bisect_right(dias, fim.toordinal()) if fim else len(dias)
+                registros.extend(dict(r) for r in do_ano[i:j] if r.get("tipo") == tipo)
+        if self.desde:
+            janela = iso_year_week(self.desde)
+            for chave in self._semanas_em_disco():
+                if primeira <= chave <= ultima and chave < janela:
+                    registros.extend(r for r in load_data(self._arquivo_semana(*chave)) or []
+                                     if r.get("tipo") == tipo and not na_janela(r, self.desde))
+        for reg in registros:
+            self.particao_por_id.setdefault(reg["id"], iso_year_week(parse_date(reg["data"])))
+        return registros
+
+    def assinatura(self):
+        # Partições e anos pela listagem do diretório (sem locks e temporários, que mudam o mtime dele a cada
+        # gravação); perfil e activities passam pelo write-behind
+        particoes = []
+        with contextlib.suppress(FileNotFoundError), os.scandir(self.dir) as entradas:
+            for entrada in entradas:
+                if entrada.name.endswith(".lock") or entrada.name.startswith(".tmp_") or entrada.path == self.perfil_file:
+                    continue
+                particoes.append((entrada.name, assinatura_arquivo(entrada.path)))
+        return tuple(sorted(particoes)), versao_arquivo(self.perfil_file), versao_arquivo(self.activity_file)
+
+    def iterar_registros(self):
+        """Um arquivo (ano compactado ou semana) por vez."""
+        if not os.path.exists(self.perfil_file):
+            yield from JournalUserStore(self.email).iterar_registros()
+            return
+        yield from load_data(self.pesos_file) or []
+        for ano in self._anos_arquivados():
+            yield from (r for r in self._ler_ano(ano) if r.get("tipo") != "peso")
+        for chave in self._semanas_em_disco():
+            yield from (r for r in load_data(self._arquivo_semana(*chave)) or [] if r.get("tipo") != "peso")
+
+
+def open_user_store(email):
+    if HISTORY_BACKEND == "json":
+        return JsonUserStore(email)
+    if HISTORY_BACKEND == "sqlite":
+        return SqliteUserStore(email)
+    if HISTORY_BACKEND == "particionado":
+        return ParticionadoUserStore(email)
+    return JournalUserStore(email)
+
+def get_user_store():
+    """Store do usuário logado (criado sob demanda, ex.: logo após o cadastro)."""
+    if "user_store" not in st.session_state:
+        st.session_state.user_store = open_user_store(st.session_state.current_user)
+    return st.session_state.user_store
+
+
+# -----------------------------
+# LEDGER SEMANAL (EXTRAS E PONTOS DO DIA)
+# -----------------------------
+class LedgerSemanal:
+    """
+    Resultados derivados do consumo (extras restantes por semana e total de pontos por dia).
+    Fica em sessão e é atualizado de forma incremental: cada alteração no histórico recalcula
+    apenas a semana do registro, e as leituras do dashboard são consultas diretas a dicionários.
+    """
+
+    def __init__(self, meta, fator_ponderacao=1.0):
+        self.meta = meta
+        self.fator_ponderacao = fator_ponderacao
+        self.semanas = {}  # (ano, semana) -> {"ano", "semana", "pontos": [registros], "extras"}
+        self.dias = {}     # (ano, semana) -> {data: total de pontos}
+
+    def valido(self, meta, fator_ponderacao):
+        return (self.meta, self.fator_ponderacao) == (meta, fator_ponderacao)
+
+    @staticmethod
+    def _data(registro):
+        return parse_date(registro.get("data"))
+
+    def _semana(self, data):
+        ano, semana = chave = iso_year_week(data)
+        return self.semanas.setdefault(chave, {"ano": ano, "semana": semana, "pontos": [], "extras": 36.0})
+
+    def reconstruir(self, historico):
+        """Recalcula todas as semanas a partir do histórico; devolve os registros alterados."""
+        self.semanas = {}
+        self.dias = {}
+        for reg in historico:
+            data = self._data(reg) if reg.get("tipo") == "consumo" else None
+            if data is not None:
+                self._semana(data)["pontos"].append(reg)
+        alterados = []
+        for w in list(self.semanas):
+            alterados.extend(self._recalcular(w))
+        return alterados
+
+    def aplicar(self, op, registro, historico):
+        """Incorpora a alteração de um registro de consumo recalculando só a semana dele."""
+        data = self._data(registro)
+        if registro.get("tipo") != "consumo" or data is None:
+            return []
+        semana = self._semana(data)
+        registros = semana["pontos"]
+        if op == "add":
+            registros.append(registro)
+        elif op == "delete":
+            registros[:] = [r for r in registros if r is not registro]
+        elif not any(r is registro for r in registros):
+            # Registro mudou de semana: a posição relativa no histórico só é garantida reconstruindo
+            return self.reconstruir(historico)
+        return self._recalcular((semana["ano"], semana["semana"]))
+
+    def _recalcular(self, w):
+        week = self.semanas[w]
+        if not week["pontos"]:
+            del self.semanas[w]
+            self.dias.pop(w, None)
+            return []
+
+        alterados = {}  # registros cujos campos derivados mudaram e precisam voltar ao store
+        extras_remaining = 36.0
+        regs_by_date = {}
+        for reg in week["pontos"]:
+            # aplicar fator de ponderação
+            pontos = round_points(float(reg.get("pontos", 0.0)) * self.fator_ponderacao)
+            if reg.get("id") and pontos != reg.get("pontos"):
+                alterados[reg["id"]] = reg
+            reg["pontos"] = pontos
+            regs_by_date.setdefault(self._data(reg), []).append(reg)
+
+        for d in sorted(regs_by_date):
+            cumulative_day = 0.0
+            for reg in regs_by_date[d]:
+                p = float(reg.get("pontos", 0.0))
+                before = cumulative_day
+                after = cumulative_day + p
+                if after <= self.meta:
+                    used = 0.0
+                else:
+                    part_before_meta = max(0.0, self.meta - before)
+                    extra_from_reg = p - part_before_meta
+                    used = min(extra_from_reg, extras_remaining)
+                    extras_remaining -= used
+                    if extras_remaining < 0:
+                        extras_remaining = 0.0
+                usou_extras = round_points(used)
+                if reg.get("id") and usou_extras != reg.get("usou_extras"):
+                    alterados[reg["id"]] = reg
+                reg["usou_extras"] = usou_extras
+                cumulative_day = after
+
+        week["extras"] = round_points(extras_remaining)
+        self.dias[w] = {
+            d: sum(float(r.get("pontos", 0.0)) for r in regs) for d, regs in regs_by_date.items()
+        }
+        return list(alterados.values())
+
+    def semana(self, ano_semana):
+        return self.semanas.get(ano_semana)
+
+    def pontos_do_dia(self, data):
+        return self.dias.get(iso_year_week(data), {}).get(data, 0.0)
+
+    def extras_ultima_semana(self):
+        return self.semanas[max(self.semanas)]["extras"] if self.semanas else 36.0
+
+    def lista(self):
+        """Semanas em ordem, no formato de st.session_state.pontos_semana."""
+        return [self.semanas[w] for w in sorted(self.semanas)]
+
+
+class RollupsUsuario:
+    """
+    Totais materializados do usuário em rollups_{email}.json: por dia (pontos consumidos, extras usados,
+    pontos de atividade) e por semana ISO (os mesmos totais mais os extras restantes). São atualizados
+    semana a semana a cada gravação; somas prefixadas sobre os dias ordenados respondem o total de
+    qualquer intervalo com duas buscas binárias.
+    """
+
+    CAMPOS = ("pontos", "extras_usados", "atividade")
+
+    def __init__(self, email):
+        self.arquivo = self.caminho(email)
+        dados = load_data(self.arquivo) or {}
+        self.existe = bool(dados)
+        self.dias = dados.get("dias", {})        # "AAAA-MM-DD" -> totais do dia
+        self.semanas = dados.get("semanas", {})  # "AAAA-Wss" -> totais da semana + extras_restantes
+        self._prefixos = None
+
+    @staticmethod
+    def caminho(email):
+        return f"rollups_{email}.json"
+
+    @staticmethod
+    def chave_semana(ano, semana):
+        return f"{ano}-W{semana:02d}"
+
+    def atualizar_semana(self, ano, semana, consumos, atividades, extras_restantes):
+        """Substitui os totais da semana (e dos seus dias) pelos calculados a partir dos registros dela."""
+        segunda = datetime.date.fromisocalendar(ano, semana, 1)
+        dias_semana = [(segunda + datetime.timedelta(days=i)).isoformat() for i in range(7)]
+        for dia in dias_semana:
+            self.dias.pop(dia, None)
+        for campo, registros, coluna in (("pontos", consumos, "pontos"), ("extras_usados", consumos, "usou_extras"),
+                                         ("atividade", atividades, "pontos")):
+            for r in registros:
+                dia = self.dias.setdefault(parse_date(r["data"]).isoformat(), dict.fromkeys(self.CAMPOS, 0.0))
+                dia[campo] += float(r.get(coluna, 0.0) or 0.0)
+
+        chave = self.chave_semana(ano, semana)
+        if consumos or atividades:
+            self.semanas[chave] = {
+                "ano": ano, "semana": semana,
+                **{c: sum(self.dias[d][c] for d in dias_semana if d in self.dias) for c in self.CAMPOS},
+                "extras_restantes": extras_restantes,
+            }
+        else:
+            self.semanas.pop(chave, None)
+        self._prefixos = None
+
+    def limpar(self):
+        self.dias, self.semanas, self._prefixos = {}, {}, None
+
+    def salvar(self):
+        # Cópia rasa por dia/semana: a thread de fundo pode gravar enquanto a sessão altera os totais
+        salvar_arquivo_usuario({
+            "dias": {k: dict(v) for k, v in self.dias.items()},
+            "semanas": {k: dict(v) for k, v in self.semanas.items()},
+        }, self.arquivo)
+        self.existe = True
+
+    def dia(self, data):
+        return self.dias.get(data.isoformat(), dict.fromkeys(self.CAMPOS, 0.0))
+
+    def semana(self, ano, semana):
+        return self.semanas.get(self.chave_semana(ano, semana))
+
+    def semanas_entre(self, inicio, fim):
+        """Totais das semanas ISO que cruzam [inicio, fim], em ordem."""
+        primeira, ultima = self.chave_semana(*iso_year_week(inicio)), self.chave_semana(*iso_year_week(fim))
+        return [self.semanas[k] for k in sorted(self.semanas) if primeira <= k <= ultima]
+
+    def totais(self, inicio, fim):
+        """Totais de [inicio, fim] pelas somas prefixadas: duas buscas binárias, sem varrer os dias."""
+        if self._prefixos is None:
+            dias = sorted(self.dias)
+            self._prefixos = (
+                np.array(dias, dtype="datetime64[D]"),
+                {c: np.concatenate(([0.0], np.cumsum([self.dias[d][c] for d in dias]))) for c in self.CAMPOS},
+            )
+        datas, acumulados = self._prefixos
+        i = np.searchsorted(datas, np.datetime64(inicio, "D"), side="left")
+        j = np.searchsorted(datas, np.datetime64(fim, "D"), side="right")
+        return {c: float(acumulados[c][j] - acumulados[c][i]) for c in self.CAMPOS}
+
+
+# -----------------------------
+# CATÁLOGO GLOBAL DE ALIMENTOS (compartilhado entre sessões)
+# -----------------------------
+def alimentos_do_arquivo(dados):
+    """ww_data.json pode ser uma lista de alimentos ou um dict com a chave 'alimentos'."""
+    if isinstance(dados, list):
+        return dados
+    if isinstance(dados, dict) and "alimentos" in dados:
+        return dados["alimentos"]
+    return []
+
+def normalizar_nome(texto):
+    """Minúsculas e sem acentos ('Maçã' -> 'maca'), para busca e comparação de nomes."""
+    texto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold().strip()
+
+class IndiceCatalogo:
+    """
+    Índices de uma versão do catálogo, construídos uma vez: chave canônica (nome + porção, ver
+    chave_alimento) -> posição (O(1)), chaves em ordem alfabética de rótulo e arrays ordenados de
+    nomes normalizados para busca por prefixo com bisect (início do nome e início de cada palavra).
+    O rótulo é o nome; quando o mesmo nome aparece com mais de uma porção, leva a porção junto.
+    """
+
+    def __init__(self, alimentos):
+        self.alimentos = alimentos
+        self.posicao_por_chave = {}
+        self.posicao_por_nome = {}
+        for i, a in enumerate(alimentos):
+            self.posicao_por_chave.setdefault(chave_alimento(a), i)
+            self.posicao_por_nome.setdefault(str(a.get("Nome", "")), i)
+
+        porcoes = {}
+        for pos in self.posicao_por_chave.values():
+            nome = str(alimentos[pos].get("Nome", ""))
+            porcoes[nome] = porcoes.get(nome, 0) + 1
+        self.rotulos = {}
+        for chave, pos in self.posicao_por_chave.items():
+            a = alimentos[pos]
+            nome = str(a.get("Nome", ""))
+            self.rotulos[chave] = nome if porcoes[nome] == 1 else f"{nome} ({a.get('Porcao', 100.0)} g)"
+        self.chaves_ordenadas = sorted(self.posicao_por_chave, key=lambda chave: (self.rotulos[chave], chave))
+
+        self.chaves_nome = []
+        self.chaves_palavra = []
+        for chave in self.posicao_por_chave:
+            normalizado = normalizar_nome(self.rotulos[chave])
+            self.chaves_nome.append((normalizado, chave))
+            palavras = normalizado.split()
+            for j in range(1, len(palavras)):
+                self.chaves_palavra.append((" ".join(palavras[j:]), chave))
+        self.chaves_nome.sort()
+        self.chaves_palavra.sort()
+
+    def alimento(self, chave):
+        pos = self.posicao_por_chave.get(chave)
+        return None if pos is None else self.alimentos[pos]
+
+    def alimento_do_registro(self, registro):
+        """Alimento de um registro de consumo: pela porção gravada no registro ou, em registros antigos, pelo nome."""
+        if "porcao" in registro:
+            return self.alimento(chave_alimento({"Nome": registro.get("nome"), "Porcao": registro["porcao"]}))
+        pos = self.posicao_por_nome.get(registro.get("nome"))
+        return None if pos is None else self.alimentos[pos]
+
+    def buscar(self, texto, limite=50):
+        """Até `limite` chaves cujo rótulo (ou uma palavra dele) começa com `texto`, ignorando acentos e maiúsculas."""
+        prefixo = normalizar_nome(texto)
+        if not prefixo:
+            return self.chaves_ordenadas[:limite]
+        resultado = []
+        vistos = set()
+        for chaves in (self.chaves_nome, self.chaves_palavra):
+            i = bisect.bisect_left(chaves, (prefixo,))
+            while i < len(chaves) and chaves[i][0].startswith(prefixo) and len(resultado) < limite:
+                chave = chaves[i][1]
+                if chave not in vistos:
+                    vistos.add(chave)
+                    resultado.append(chave)
+                i += 1
+        return resultado
+
+
+def chave_alimento(alimento):
+    """Chave canônica de um alimento no catálogo: nome normalizado (sem acentos/maiúsculas) + porção."""
+    try:
+        porcao = float(alimento.get("Porcao", 100.0))
+    except (TypeError, ValueError):
+        porcao = str(alimento.get("Porcao"))
+    return f"{normalizar_nome(alimento.get('Nome', ''))}|{porcao}"
+
+def upsert_alimentos(alimentos, novos, novos_prevalecem=True):
+    """
+    Insere ou atualiza `novos` em `alimentos` (no lugar) pela chave canônica, com um índice
+    chave -> posição montado uma vez (lookup O(1) por linha). Se novos_prevalecem=False, um
+    alimento já existente é mantido como está. Devolve o resumo inseridos/atualizados/inalterados.
+    """
+    posicoes = {}
+    for i, a in enumerate(alimentos):
+        posicoes.setdefault(chave_alimento(a), i)
+
+    resumo = {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+    for novo in novos:
+        chave = chave_alimento(novo)
+        pos = posicoes.get(chave)
+        if pos is None:
+            posicoes[chave] = len(alimentos)
+            alimentos.append(novo)
+            resumo["inseridos"] += 1
+            continue
+        atualizado = {**alimentos[pos], **novo}
+        if not novos_prevalecem or atualizado == alimentos[pos]:
+            resumo["inalterados"] += 1
+        else:
+            alimentos[pos] = atualizado
+            resumo["atualizados"] += 1
+    return resumo
+
+
+class CatalogoCompartilhado:
+    """
+    Uma única lista de alimentos por processo, lida de ww_data.json e recarregada quando o
+    arquivo muda (ver assinatura_arquivo). As sessões guardam apenas a referência; alterações passam
+    por update(), que grava sob lock e troca a lista inteira (quem ainda lê a anterior não a vê mudar).
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.alimentos = []
+        self.assinatura = None
+        self.versao = 0
+        self._indice = None
+
+    def atual(self):
+        if assinatura_arquivo(self.file_path) != self.assinatura:
+            with self.lock:
+                assinatura = assinatura_arquivo(self.file_path)
+                if assinatura != self.assinatura:
+                    self.alimentos = alimentos_do_arquivo(load_data(self.file_path)) if assinatura else []
+                    self.assinatura = assinatura
+                    self.versao += 1
+        return self.alimentos
+
+    def indice(self):
+        """IndiceCatalogo da versão atual (reconstruído só quando a lista de alimentos muda)."""
+        alimentos = self.atual()
+        if self._indice is None or self._indice.alimentos is not alimentos:
+            with self.lock:
+                if self._indice is None or self._indice.alimentos is not alimentos:
+                    self._indice = IndiceCatalogo(alimentos)
+        return self._indice
+
+    def update(self, alterar):
+        """Lê-modifica-grava o catálogo (ver update_data) e publica a nova lista."""
+        def alterar_lista(dados):
+            alimentos = alimentos_do_arquivo(dados)
+            alterar(alimentos)
+            return alimentos
+
+        with self.lock:
+            self.alimentos = update_data(self.file_path, alterar_lista, default=list)
+            self.assinatura = assinatura_arquivo(self.file_path)
+            self.versao += 1
+        return self.alimentos
+
+@st.cache_resource
+def get_catalogo():
+    return CatalogoCompartilhado(DATA_FILE)
+
+class DiretorioUsuarios:
+    """
+    Usuários do processo em memória (dict email -> dados), lidos do ww_users.json (snapshot) mais o
+    journal ww_users.journal.jsonl e recarregados só quando um dos dois arquivos muda (ver assinatura_arquivo).
+    Cadastros e alterações acrescentam uma linha ao journal sob lock, sem regravar o arquivo inteiro;
+    a cada USERS_JOURNAL_COMPACT_EVERY eventos o snapshot é regravado e o journal zerado.
+    """
+
+    def __init__(self, file_path, journal_path):
+        self.file_path = file_path
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+        self.usuarios = {}
+        self.eventos = 0
+        self.assinatura = None
+
+    def _assinatura_arquivos(self):
+        return assinatura_arquivo(self.file_path), assinatura_arquivo(self.journal_path)
+
+    def _recarregar(self):
+        """
+        Snapshot + replay do journal (chamado com self.lock). Um ww_users.json ilegível gera erro em vez de
+        virar um diretório vazio (que a compactação gravaria por cima das contas); linhas ilegíveis do
+        journal são puladas.
+        """
+        usuarios = ler_arquivo_json(self.file_path) if os.path.exists(self.file_path) else {}
+        if not isinstance(usuarios, dict):
+            raise ValueError(f"{self.file_path}: conteúdo inesperado ({type(usuarios).__name__})")
+        eventos, descartadas = ler_jsonl(self.journal_path)
+        for evento in eventos:
+            usuario = usuarios.setdefault(evento["email"], {})
+            usuario.update(evento["dados"])
+            for campo in [k for k, v in evento["dados"].items() if v is None]:
+                del usuario[campo]
+        self.eventos = len(eventos) + descartadas
+        self.usuarios = usuarios
+        self.assinatura = self._assinatura_arquivos()
+
+    def _atualizado(self):
+        if self._assinatura_arquivos() != self.assinatura:
+            with self.lock:
+                if self._assinatura_arquivos() != self.assinatura:
+                    self._recarregar()
+        return self.usuarios
+
+    def usuario(self, email):
+        """Dados do usuário (ou None)."""
+        return self._atualizado().get(email)
+
+    def _gravar_evento(self, email, dados):
+        """
+        Acrescenta o evento ao journal (com self.lock e o lock de arquivo já obtidos). Um evento que remove a
+        senha em texto puro (migração para hash) regrava o snapshot na hora: ela não pode continuar no disco.
+        """
+        anexar_jsonl(self.journal_path, [json.dumps({"email": email, "dados": dados}, ensure_ascii=False, default=str) + "\n"])
+        self.usuarios[email] = {
+            k: v for k, v in {**self.usuarios.get(email, {}), **dados}.items() if v is not None
+        }
+        self.eventos += 1
+        if self.eventos >= USERS_JOURNAL_COMPACT_EVERY or ("password" in dados and dados["password"] is None):
+            atomic_write(self.file_path, conteudo_arquivo_json(self.usuarios))
+            open(self.journal_path, "w", encoding="utf-8").close()
+            self.eventos = 0
+        self.assinatura = self._assinatura_arquivos()
+
+    def cadastrar(self, email, dados):
+        """Inclui o usuário; devolve False se o email já existe (inclusive cadastrado por outro processo)."""
+        with self.lock, file_lock(self.file_path):
+            if self._assinatura_arquivos() != self.assinatura:
+                self._recarregar()
+            if email in self.usuarios:
+                return False
+            self._gravar_evento(email, dados)
+            return True
+
+    def atualizar(self, email, **dados):
+        """Altera campos de um usuário existente (valor None remove o campo)."""
+        with self.lock, file_lock(self.file_path):
+            if self._assinatura_arquivos() != self.assinatura:
+                self._recarregar()
+            if email not in self.usuarios:
+                return False
+            self._gravar_evento(email, dados)
+            return True
+
+@st.cache_resource
+def get_diretorio_usuarios():
+    return DiretorioUsuarios(USERS_FILE, USERS_JOURNAL_FILE)
+
+class CacheSessoes:
+    """
+    Estado em sessão dos usuários logados, por token, compartilhado pelo processo: uma aba recarregada
+    reaproveita o histórico, o store, o ledger... já carregados em vez de reler os arquivos. O cache guarda
+    uma cópia do estado, refeita só quando a marca da aba muda, e quem retoma recebe outra cópia: duas abas
+    com o mesmo token nunca alteram os mesmos objetos. Cada entrada guarda a versão dos dados em disco do
+    momento em que foi salva; entradas sem uso há mais de `ocioso_segundos` são descartadas.
+    """
+
+    def __init__(self, ocioso_segundos):
+        self.ocioso_segundos = ocioso_segundos
+        self.lock = threading.Lock()
+        self.sessoes = {}  # token -> {"email", "estado", "marca", "versao", "menu", "ultimo_uso"}
+
+    def _expirar(self, agora):
+        for token in [t for t, e in self.sessoes.items() if agora - e["ultimo_uso"] > self.ocioso_segundos]:
+            del self.sessoes[token]
+
+    def guardar(self, token, email, marca, versao, copiar_estado, menu=None):
+        """
+        copiar_estado() (cópia profunda, feita fora do lock) só é chamado quando a marca difere da guardada:
+        o estado mudou ou foi outra aba que guardou por último. Senão só a versão e o menu são atualizados.
+        """
+        with self.lock:
+            entrada = self.sessoes.get(token)
+            copiar = not (entrada and entrada["marca"] == marca)
+        estado = copiar_estado() if copiar else None
+        with self.lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            entrada = self.sessoes.get(token)
+            if estado is None and not (entrada and entrada["marca"] == marca):
+                estado = copiar_estado()  # outra aba guardou (ou a entrada expirou) entre os dois locks
+            if estado is not None:
+                entrada = self.sessoes[token] = {"email": email, "estado": estado, "marca": marca}
+            entrada.update(versao=versao, menu=menu, ultimo_uso=agora)
+
+    def obter(self, token):
+        """Entrada do token (cópia rasa; o estado guardado não deve ser alterado, e sim copiado)."""
+        with self.lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            entrada = self.sessoes.get(token)
+            if entrada:
+                entrada["ultimo_uso"] = agora
+                return dict(entrada)
+            return None
+
+    def remover(self, token):
+        with self.lock:
+            self.sessoes.pop(token, None)
+
+@st.cache_resource
+def get_cache_sessoes():
+    return CacheSessoes(SESSION_IDLE_MINUTES * 60)
+
+# -----------------------------
+# SENHAS (hash scrypt, verificação em pool limitado)
+# -----------------------------
+def hash_senha(senha, salt=None, n=SENHA_SCRYPT_N, r=SENHA_SCRYPT_R, p=SENHA_SCRYPT_P):
+    """Hash no formato "scrypt$n$r$p$salt$hash" (base64), com os parâmetros para verificações futuras."""
+    salt = salt or os.urandom(16)
+    chave = hashlib.scrypt(senha.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * 1024 * 1024, dklen=32)
+    return "$".join(["scrypt", str(n), str(r), str(p), base64.b64encode(salt).decode(), base64.b64encode(chave).decode()])
+
+def verificar_hash_senha(senha, armazenado):
+    try:
+        algoritmo, n, r, p, salt, esperado = armazenado.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if algoritmo != "scrypt":
+        return False
+    calculado = hash_senha(senha, base64.b64decode(salt), int(n), int(r), int(p)).rsplit("$", 1)[1]
+    return hmac.compare_digest(calculado, esperado)
+
+@st.cache_resource
+def hash_senha_ficticio():
+    """
+    Hash de referência para emails inexistentes e senhas antigas em texto puro que não conferem: toda
+    tentativa de login recusada custa um KDF, como a de um usuário com hash (calculado uma vez por processo).
+    """
+    return hash_senha("", salt=b"\0" * 16)
+
+def _verificar_usuario(usuario, senha):
+    """
+    Verifica a senha (roda no pool). Usuários antigos com senha em texto puro são aceitos uma vez e
+    devolvem o hash novo para ser gravado no lugar. Resultado: (senha_ok, hash_para_gravar ou None).
+    """
+    if usuario is None:
+        verificar_hash_senha(senha, hash_senha_ficticio())
+        return False, None
+    if usuario.get("password_hash"):
+        return verificar_hash_senha(senha, usuario["password_hash"]), None
+    texto_puro = usuario.get("password")
+    if texto_puro is not None and hmac.compare_digest(str(texto_puro).encode("utf-8"), senha.encode("utf-8")):
+        return True, hash_senha(senha)
+    verificar_hash_senha(senha, hash_senha_ficticio())
+    return False, None
+
+@st.cache_resource
+def get_pool_senhas():
+    return ThreadPoolExecutor(max_workers=SENHA_WORKERS, thread_name_prefix="ww-senha")
+
+def verificar_credenciais(email, senha):
+    """
+    Confere email/senha com o KDF executado no pool de SENHA_WORKERS threads: picos de login ficam
+    na fila do pool em vez de ocupar todos os núcleos. Senhas em texto puro são migradas para hash.
+    """
+    diretorio = get_diretorio_usuarios()
+    ok, novo_hash = get_pool_senhas().submit(_verificar_usuario, diretorio.usuario(email), senha).result()
+    if ok and novo_hash:
+        diretorio.atualizar(email, password_hash=novo_hash, password=None)
+    return ok
+
+def gerar_hash_senha(senha):
+    """hash_senha executado no pool de verificação (cadastro)."""
+    return get_pool_senhas().submit(hash_senha, senha).result()
+
+# -----------------------------
+# Exportação em PDF (pool de workers)
+# -----------------------------
+def renderizar_pdf_pdfkit(conteudo_html, destino):
+    pdfkit.from_string(conteudo_html.decode("utf-8"), destino, options={"encoding": "UTF-8", "quiet": ""})
+
+def renderizar_pdf_stub(conteudo_html, destino):
+    """PDF de uma página só com o tamanho do HTML; substitui o wkhtmltopdf em testes."""
+    texto = f"Relatorio ({len(conteudo_html)} bytes de HTML)".encode("latin-1")
+    fluxo = b"BT /F1 12 Tf 72 720 Td (" + texto + b") Tj ET"
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(fluxo)).encode() + b" >>\nstream\n" + fluxo + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    saida = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objetos, 1):
+        offsets.append(len(saida))
+        saida += f"{i} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(saida)
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    saida += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    saida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(destino, "wb") as f:
+        f.write(saida)
+
+def renderizador_pdf():
+    """Função de renderização configurada em PDF_RENDERER, ou None se o pdfkit/wkhtmltopdf não estiver disponível."""
+    if PDF_RENDERER == "stub":
+        return renderizar_pdf_stub
+    if pdfkit is None or shutil.which("wkhtmltopdf") is None:
+        return None
+    return renderizar_pdf_pdfkit
+
+class ExportadorPDF:
+    """
+    Renderiza PDFs fora da thread do script, num ThreadPoolExecutor limitado a PDF_WORKERS.
+    Cada pedido vira um job (id, status: "pendente" | "processando" | "pronto" | "erro"), consultado
+    pela página a cada rerun. Jobs prontos ficam em cache pela chave do relatório (usuário, período, opções
+    e, por último, a versão dos dados do usuário em disco); ao pedir uma versão nova, o PDF das versões
+    antigas do mesmo relatório é apagado. Relatórios de outros períodos continuam em cache até expirarem
+    (ttl) ou até passarem de max_jobs terminados; o arquivo sai junto com o job. A pasta é esvaziada na
+    criação, já que os jobs de execuções anteriores do processo se perderam.
+    """
+    def __init__(self, renderizar, pasta=PDF_DIR, max_workers=PDF_WORKERS, max_jobs=PDF_MAX_JOBS, ttl=PDF_TTL_SECONDS):
+        self.renderizar = renderizar
+        self.pasta = pasta
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ww-pdf")
+        self.lock = threading.Lock()
+        self.jobs = {}       # job_id -> {"status", "chave", "caminho", "erro", "fim"}
+        self.por_chave = {}  # chave do relatório -> job_id
+        os.makedirs(pasta, exist_ok=True)
+        for nome in os.listdir(pasta):
+            if nome.endswith((".pdf", ".pdf.tmp")):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(pasta, nome))
+
+    def job_da_chave(self, chave):
+        with self.lock:
+            return self.por_chave.get(chave)
+
+    def solicitar(self, chave, gerar_conteudo):
+        """Enfileira a geração (HTML + PDF) para a chave e devolve o id do job; reaproveita job existente sem erro."""
+        with self.lock:
+            job_id = self.por_chave.get(chave)
+            if job_id and self.jobs[job_id]["status"] != "erro":
+                return job_id
+            self._descartar_antigos(chave)
+            self._expirar()
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {"status": "pendente", "chave": chave, "caminho": None, "erro": None, "fim": None}
+            self.por_chave[chave] = job_id
+        self.executor.submit(self._executar, job_id, gerar_conteudo)
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _descartar(self, job_id):
+        job = self.jobs.pop(job_id)
+        del self.por_chave[job["chave"]]
+        if job["caminho"]:
+            with contextlib.suppress(OSError):
+                os.remove(job["caminho"])
+
+    def _descartar_antigos(self, chave):
+        # chave = (usuário, período, opções, versão): remove o mesmo relatório em outras versões
+        for outra, job_id in list(self.por_chave.items()):
+            if outra[:-1] == chave[:-1] and outra[-1] != chave[-1]:
+                self._descartar(job_id)
+
+    def _expirar(self):
+        # Só jobs terminados saem (pendentes e em processamento ainda têm uma sessão esperando),
+        # primeiro os vencidos e depois, do mais antigo ao mais novo, os que passam de max_jobs
+        terminados = sorted((job["fim"], job_id) for job_id, job in self.jobs.items() if job["fim"] is not None)
+        limite = time.monotonic() - self.ttl
+        excedentes = len(terminados) - self.max_jobs
+        for i, (fim, job_id) in enumerate(terminados):
+            if fim >= limite and i >= excedentes:
+                break
+            self._descartar(job_id)
+
+    def _executar(self, job_id, gerar_conteudo):
+        with self.lock:
+            self.jobs[job_id]["status"] = "processando"
+        destino = os.path.join(self.pasta, f"{job_id}.pdf")
+        try:
+            self.renderizar(gerar_conteudo(), destino + ".tmp")
+            os.replace(destino + ".tmp", destino)
+            resultado = {"status": "pronto", "caminho": destino}
+        except Exception as e:
+            with contextlib.suppress(OSError):
+                os.remove(destino + ".tmp")
+            resultado = {"status": "erro", "erro": str(e)}
+        resultado["fim"] = time.monotonic()
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(resultado)
+                return
+        # Job descartado (versão nova pedida) durante a renderização: o arquivo não tem mais dono
+        if resultado.get("caminho"):
+            with contextlib.suppress(OSError):
+                os.remove(resultado["caminho"])
+
+@st.cache_resource
+def get_exportador_pdf():
+    renderizar = renderizador_pdf()
+    return ExportadorPDF(renderizar) if renderizar else None
+
+# -----------------------------
+# Exportação do histórico para análise (Parquet / CSV)
+# -----------------------------
+COLUNAS_EXPORTACAO = ("email", "data", "tipo", "nome", "quantidade", "pontos", "usou_extras", "ano_iso", "semana_iso")
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+def linhas_exportacao(email, store=None):
+    """
+    Linhas tipadas (email, data, tipo, nome, quantidade, pontos, usou_extras, ano ISO, semana ISO) do
+    histórico do usuário e das atividades no formato antigo (activities_{email}.json), lidas do store
+    sob demanda. Registros sem data válida são ignorados.
+    """
+    store = store or open_user_store(email)
+    for r in store.iterar_registros():
+        d = parse_date(r.get("data"))
+        if d:
+            yield (email, d, r.get("tipo"), r.get("nome"), _numero(r.get("quantidade")), _numero(r.get("pontos")),
+                   _numero(r.get("usou_extras")), *iso_year_week(d))
+    for chave, lista in store.ler_activities().items():
+        d = parse_date(chave)
+        if d:
+            for a in lista:
+                yield (email, d, "atividade", a.get("nome") or a.get("tipo"), _numero(a.get("quantidade", a.get("minutos"))),
+                       _numero(a.get("pontos")), 0.0, *iso_year_week(d))
+
+def _em_lotes(linhas, tamanho):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _esquema_parquet():
+    return pa.schema([
+        ("email", pa.string()), ("data", pa.date32()), ("tipo", pa.string()), ("nome", pa.string()),
+        ("quantidade", pa.float64()), ("pontos", pa.float64()), ("usou_extras", pa.float64()),
+        ("ano_iso", pa.int16()), ("semana_iso", pa.int8()),
+    ])
+
+def exportar_historico(emails, destino, formato=None, tamanho_lote=EXPORT_CHUNK_ROWS):
+    """
+    Exporta o histórico de um ou vários usuários para um único arquivo colunar em `destino`.
+    formato: "parquet" (requer pyarrow; padrão quando disponível) ou "csv". As linhas são gravadas
+    em lotes de `tamanho_lote` (um row group por lote no Parquet) à medida que o store as lê: no sqlite
+    a memória fica no lote, no journal no lote mais snapshot e journal (do tamanho da janela do login),
+    no particionado no lote mais um ano arquivado. No backend json, um documento único por usuário,
+    o histórico de cada usuário é carregado inteiro. Devolve o número de linhas exportadas.
+    """
+    if isinstance(emails, str):
+        emails = [emails]
+    formato = formato or ("parquet" if pa is not None else "csv")
+    if formato == "parquet" and pa is None:
+        raise RuntimeError("Exportação em Parquet requer o pacote pyarrow.")
+    linhas = (linha for email in emails for linha in linhas_exportacao(email))
+    total = 0
+    tmp = destino + ".tmp"
+    try:
+        if formato == "parquet":
+            esquema = _esquema_parquet()
+            with pq.ParquetWriter(tmp, esquema) as escritor:
+                for lote in _em_lotes(linhas, tamanho_lote):
+                    colunas = list(zip(*lote))
+                    escritor.write_table(pa.Table.from_arrays(
+                        [pa.array(col, type=campo.type) for col, campo in zip(colunas, esquema)], schema=esquema
+                    ))
+                    total += len(lote)
+        else:
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                escritor = csv.writer(f)
+                escritor.writerow(COLUNAS_EXPORTACAO)
+                for lote in _em_lotes(linhas, tamanho_lote):
+                    escritor.writerows((e, d.isoformat(), *resto) for e, d, *resto in lote)
+                    total += len(lote)
+        os.replace(tmp, destino)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    return total
+
+def descartar_exportacao():
+    """Apaga o arquivo temporário da exportação guardada na sessão (nova exportação, login ou logout)."""
+    cache = st.session_state.pop("exportacao_historico", None)
+    if cache:
+        with contextlib.suppress(OSError):
+            os.remove(cache["caminho"])
+
+def descartar_relatorio():
+    """Apaga o arquivo do relatório HTML guardado na sessão (novo relatório, login ou logout)."""
+    cache = st.session_state.pop("relatorio_html", None)
+    if cache:
+        with contextlib.suppress(OSError):
+            os.remove(cache["caminho"])
+
 
 # -----------------------------
 # LOGIN / USUÁRIOS
@@ -80,37 +2126,42 @@ if "logged_in" not in st.session_state:
 if "current_user" not in st.session_state:
     st.session_state.current_user = ""
 
-# Carrega usuários globais
-USERS_FILE = "ww_users.json"
-users_store = load_data(USERS_FILE)
-if not isinstance(users_store, dict):
-    users_store = {}
-
-def login_user(email, password):
-    global users_store
-    if email in users_store and users_store[email]["password"] == password:
-        st.session_state.logged_in = True
-        st.session_state.current_user = email
-
-        # Carregar dados privados do usuário
-        user_data_file = f"data_{email}.json"
-        activity_file = f"activities_{email}.json"
-        data_store = load_data(user_data_file) or {}
-        activities = load_data(activity_file) or {}
+def carregar_dados_usuario(email):
+    """Abre a sessão do usuário lendo os dados privados do disco."""
+    st.session_state.logged_in = True
+    st.session_state.current_user = email
 
-        # Inicializar histórico acumulado e atividades
-        st.session_state.historico_acumulado = data_store.get(
-            "historico_acumulado", st.session_state.get("historico_acumulado", [])
-        )
-        st.session_state.activities = activities or st.session_state.get("activities", {})
+    # Carregar dados privados do usuário (snapshot + replay do journal)
+    aguardar_gravacoes()  # gravações de outra sessão do mesmo usuário ainda na fila
+    st.session_state.user_store = open_user_store(email)
+    # Só a janela recente (HISTORY_LOGIN_WEEKS semanas) vai para a sessão; intervalos anteriores são
+    # lidos sob demanda pelo consultar_historico
+    data_store, activities = st.session_state.user_store.load(desde=inicio_janela_login())
 
-        # Inicializar perfil e outros dados
-        st.session_state.sexo = data_store.get("sexo", st.session_state.get("sexo", "Feminino"))
-        st.session_state.idade = data_store.get("idade", st.session_state.get("idade", 30))
-        st.session_state.altura = data_store.get("altura", st.session_state.get("altura", 1.70))
-        st.session_state.objetivo = data_store.get("objetivo", st.session_state.get("objetivo", "manutenção"))
-        st.session_state.nivel_atividade = data_store.get("nivel_atividade", st.session_state.get("nivel_atividade", "sedentário"))
+    # Inicializar histórico acumulado e atividades
+    st.session_state.historico_acumulado = data_store.get(
+        "historico_acumulado", st.session_state.get("historico_acumulado", [])
+    )
+    st.session_state.activities = activities or st.session_state.get("activities", {})
+    st.session_state.pop("ledger", None)  # reconstruídos a partir do histórico carregado
+    st.session_state.pop("historico_frame", None)
+    st.session_state.pop("agregados_dashboard", None)
+    st.session_state.pop("rollups", None)
+    st.session_state.pop("consulta_periodo", None)
+    descartar_relatorio()
+    descartar_exportacao()
+
+    # Inicializar perfil e outros dados
+    st.session_state.sexo = data_store.get("sexo", st.session_state.get("sexo", "Feminino"))
+    st.session_state.idade = data_store.get("idade", st.session_state.get("idade", 30))
+    st.session_state.altura = data_store.get("altura", st.session_state.get("altura", 1.70))
+    st.session_state.objetivo = data_store.get("objetivo", st.session_state.get("objetivo", "manutenção"))
+    st.session_state.nivel_atividade = data_store.get("nivel_atividade", st.session_state.get("nivel_atividade", "sedentário"))
 
+def login_user(email, password):
+    if verificar_credenciais(email, password):
+        carregar_dados_usuario(email)
+        iniciar_sessao_persistente(email)
         st.success(f"Bem-vindo(a), {email}!")
         return True
     else:
@@ -118,17 +2169,154 @@ def login_user(email, password):
         return False
 
 def register_user(email, password):
-    global users_store
-    if email in users_store:
+    # Cadastro sob lock no diretório de usuários do processo: uma linha no journal, sem regravar o arquivo
+    if not get_diretorio_usuarios().cadastrar(email, {"password_hash": gerar_hash_senha(password)}):
         st.error("Usuário já existe!")
         return False
-    users_store[email] = {"password": password}
-    save_data(users_store, USERS_FILE)
     st.session_state.logged_in = True
     st.session_state.current_user = email
+    iniciar_sessao_persistente(email)
     st.success(f"Cadastro realizado com sucesso! Bem-vindo(a), {email}!")
     return True
 
+# -----------------------------
+# SESSÃO PERSISTENTE (token assinado na URL)
+# -----------------------------
+# Estado do usuário guardado no cache do servidor e restaurado quando a aba é recarregada
+CHAVES_SESSAO_RETOMADA = (
+    "historico_acumulado", "activities", "user_store", "peso", "datas_peso", "consumo_historico", "pontos_semana",
+    "consumo_diario", "extras", "meta_diaria", "fator_ponderacao", "sexo", "idade", "altura", "objetivo",
+    "nivel_atividade", "ledger", "historico_frame", "historico_versao", "agregados_dashboard", "rollups",
+    "consulta_periodo", "relatorio_html", "estatisticas_flush",
+)
+
+@st.cache_resource
+def segredo_sessao():
+    """Segredo do HMAC dos tokens: WW_SESSION_SECRET ou um arquivo gerado no primeiro uso (permissão 600)."""
+    segredo = os.environ.get("WW_SESSION_SECRET")
+    if segredo:
+        return segredo.encode("utf-8")
+    with contextlib.suppress(FileExistsError):
+        fd = os.open(SESSION_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+    with open(SESSION_KEY_FILE, "rb") as f:
+        return f.read()
+
+def _assinar(payload):
+    return hmac.new(segredo_sessao(), payload.encode("ascii"), hashlib.sha256).hexdigest()
+
+def emitir_token(email):
+    """
+    Token "payload.hmac": payload em base64 url-safe com email, expiração, geração de sessões do usuário
+    (incrementada no logout, o que invalida os tokens já emitidos) e um nonce.
+    """
+    geracao = (get_diretorio_usuarios().usuario(email) or {}).get("sessao_geracao", 0)
+    dados = {"e": email, "x": int(time.time()) + SESSION_TOKEN_DAYS * 86400, "g": geracao, "n": uuid.uuid4().hex}
+    payload = base64.urlsafe_b64encode(json.dumps(dados).encode("utf-8")).decode("ascii").rstrip("=")
+    return f"{payload}.{_assinar(payload)}"
+
+def validar_token(token):
+    """Email do token se a assinatura confere, não expirou e a geração ainda é a do usuário; senão None."""
+    try:
+        payload, assinatura = token.rsplit(".", 1)
+        if not hmac.compare_digest(assinatura, _assinar(payload)):
+            return None
+        dados = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except Exception:
+        return None
+    usuario = get_diretorio_usuarios().usuario(dados.get("e"))
+    if dados.get("x", 0) < time.time() or usuario is None or dados.get("g") != usuario.get("sessao_geracao", 0):
+        return None
+    return dados["e"]
+
+def ler_token_url():
+    if hasattr(st, "query_params"):
+        return st.query_params.get("sessao")
+    return (st.experimental_get_query_params().get("sessao") or [None])[0]
+
+def gravar_token_url(token):
+    if hasattr(st, "query_params"):
+        if token:
+            st.query_params["sessao"] = token
+        elif "sessao" in st.query_params:
+            del st.query_params["sessao"]
+    else:
+        params = st.experimental_get_query_params()
+        params.pop("sessao", None)
+        if token:
+            params["sessao"] = token
+        st.experimental_set_query_params(**params)
+
+def iniciar_sessao_persistente(email):
+    token = emitir_token(email)
+    st.session_state.token_sessao = token
+    gravar_token_url(token)
+
+def encerrar_sessao_persistente():
+    """Logout: descarta a sessão em cache e invalida os tokens do usuário (nova geração)."""
+    token = st.session_state.pop("token_sessao", None)
+    if token:
+        get_cache_sessoes().remover(token)
+        email = validar_token(token)
+        if email:
+            diretorio = get_diretorio_usuarios()
+            diretorio.atualizar(email, sessao_geracao=diretorio.usuario(email).get("sessao_geracao", 0) + 1)
+    gravar_token_url(None)
+
+def versao_dados_usuario(store, email):
+    return store.assinatura(), versao_arquivo(RollupsUsuario.caminho(email))
+
+def guardar_sessao():
+    """
+    Guarda no cache do servidor uma cópia do estado do usuário e a versão atual dos dados em disco (que já
+    conta o que está na fila do write-behind, sem esperar por ela). A cópia só é refeita quando a marca
+    muda: outra aba, histórico alterado ou um novo flush.
+    """
+    token = st.session_state.get("token_sessao")
+    if not token or not st.session_state.get("logged_in") or "user_store" not in st.session_state:
+        return
+    email = st.session_state.current_user
+    marca = (
+        st.session_state.setdefault("id_aba", uuid.uuid4().hex),
+        st.session_state.get("historico_versao", 0),
+        st.session_state.get("estatisticas_flush", {}).get("flushes", 0),
+    )
+
+    def copiar_estado():
+        return copy.deepcopy({k: st.session_state[k] for k in CHAVES_SESSAO_RETOMADA if k in st.session_state})
+
+    get_cache_sessoes().guardar(token, email, marca, versao_dados_usuario(st.session_state.user_store, email),
+                                copiar_estado, st.session_state.get("menu"))
+
+def retomar_sessao():
+    """
+    Aba recarregada com ?sessao= válido: restaura uma cópia do estado do cache do servidor se os dados do
+    usuário não mudaram em disco desde então (só consulta versao_arquivo); senão recarrega do disco como no login.
+    """
+    token = ler_token_url()
+    if not token:
+        return
+    email = validar_token(token)
+    if email is None:
+        gravar_token_url(None)
+        return
+    entrada = get_cache_sessoes().obter(token)
+    if (entrada and entrada["email"] == email
+            and versao_dados_usuario(entrada["estado"]["user_store"], email) == entrada["versao"]):
+        for chave, valor in copy.deepcopy(entrada["estado"]).items():
+            st.session_state[chave] = valor
+        if entrada["menu"] is not None:
+            st.session_state.menu = entrada["menu"]
+        st.session_state.logged_in = True
+        st.session_state.current_user = email
+    else:
+        carregar_dados_usuario(email)
+    st.session_state.token_sessao = token
+
+if not st.session_state.logged_in:
+    retomar_sessao()
+
 # -----------------------------
 # INTERFACE DE LOGIN
 # -----------------------------
@@ -156,20 +2344,6 @@ if not st.session_state.logged_in:
 USER_DATA_FILE = f"data_{st.session_state.current_user}.json"
 ACTIVITY_FILE = f"activities_{st.session_state.current_user}.json"
 
-# Carrega alimentos globais (disponíveis a todos)
-if "alimentos" not in st.session_state:
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            global_data = json.load(f)
-            if isinstance(global_data, list):
-                st.session_state.alimentos = global_data
-            elif isinstance(global_data, dict) and "alimentos" in global_data:
-                st.session_state.alimentos = global_data["alimentos"]
-            else:
-                st.session_state.alimentos = []
-    except FileNotFoundError:
-        st.session_state.alimentos = []
-
 # Inicializar menu
 if "menu" not in st.session_state:
     st.session_state.menu = "🏠 Dashboard"
@@ -178,36 +2352,156 @@ if "menu" not in st.session_state:
 # -----------------------------
 # FUNÇÃO DE PERSISTÊNCIA
 # -----------------------------
-def persist_all():
-    """Salva todos os dados privados do usuário, incluindo o histórico acumulado"""
+def persist_all(secoes=SECOES_USUARIO):
+    """Salva os dados privados do usuário (por padrão todas as seções, incluindo o histórico acumulado)"""
     try:
-        ds = {
+        perfil = {
             # Perfil e dados essenciais
-            "peso": st.session_state.get("peso", []),
+            "peso": list(st.session_state.get("peso", [])),
             "datas_peso": [
                 d.isoformat() if isinstance(d, datetime.date) else str(d)
                 for d in st.session_state.get("datas_peso", [])
             ],
             "meta_diaria": st.session_state.get("meta_diaria", 29),
             "extras": float(st.session_state.get("extras", 36.0)),
-            # 🔹 Histórico acumulado como log unificado
-            "historico_acumulado": [
-                {
-                    **entry,
-                    "data": (
-                        entry["data"].isoformat()
-                        if isinstance(entry.get("data"), datetime.date)
-                        else str(entry.get("data"))
-                    )
-                }
-                for entry in st.session_state.get("historico_acumulado", [])
-            ],
         }
-        # Persistência dos dados privados do usuário
-        save_data(ds, USER_DATA_FILE)
-        save_data(st.session_state.get("activities", {}), ACTIVITY_FILE)
+        # Persistência dos dados privados do usuário. 🔹 No modo journal o histórico acumulado
+        # já foi gravado evento a evento e só é regravado por inteiro na compactação.
+        get_user_store().persist(
+            perfil,
+            st.session_state.get("historico_acumulado", []),
+            st.session_state.get("activities", {}),
+            secoes,
+        )
+        return True
     except Exception as e:
         st.error(f"Erro ao persistir dados: {e}")
+        return False
+
+
+# -----------------------------
+# UNIDADE DE TRABALHO (uma gravação por execução do script)
+# -----------------------------
+def marcar_alterado(*secoes):
+    """
+    Marca seções como alteradas ("perfil", "pesos", "historico", "activities", "rollups"); a gravação
+    acontece uma única vez, em flush_alteracoes(), no fim da execução ou antes de st.stop/rerun.
+    """
+    st.session_state.setdefault("secoes_alteradas", set()).update(secoes)
+
+def flush_alteracoes():
+    """Grava só as seções marcadas desde o último flush. Contadores em st.session_state.estatisticas_flush."""
+    secoes = st.session_state.get("secoes_alteradas")
+    if not secoes or not st.session_state.get("logged_in"):
+        return False
+    st.session_state.secoes_alteradas = set()
+    estatisticas = st.session_state.setdefault("estatisticas_flush", {"flushes": 0, "secoes": {}})
+    estatisticas["flushes"] += 1
+    for secao in secoes:
+        estatisticas["secoes"][secao] = estatisticas["secoes"].get(secao, 0) + 1
+    ok = True
+    if set(SECOES_USUARIO) & secoes:
+        ok = persist_all(tuple(set(SECOES_USUARIO) & secoes))
+    if "rollups" in secoes and "rollups" in st.session_state:
+        try:
+            st.session_state.rollups.salvar()
+        except Exception as e:
+            st.error(f"Erro ao salvar totais diários/semanais: {e}")
+            ok = False
+    if not ok:
+        # Falhou: as seções continuam marcadas para a próxima execução
+        st.session_state.secoes_alteradas |= secoes
+    return ok
+
+def finalizar_execucao():
+    """Fim de uma execução do script: grava as alterações e atualiza a sessão no cache do servidor."""
+    flush_alteracoes()
+    guardar_sessao()
+
+def parar_execucao():
+    """st.stop() precedido do flush, para não perder as alterações desta execução."""
+    finalizar_execucao()
+    st.stop()
+
+
+# -----------------------------
+# ALTERAÇÕES NO HISTÓRICO ACUMULADO
+# -----------------------------
+def get_historico_frame():
+    """HistoryFrame do histórico em sessão, montado uma vez e mantido pelas funções abaixo."""
+    if st.session_state.get("historico_frame") is None:
+        st.session_state.historico_frame = HistoryFrame(st.session_state.get("historico_acumulado", []))
+    return st.session_state.historico_frame
+
+def marcar_historico_alterado():
+    """Incrementa a versão do histórico em sessão (invalida os agregados memoizados do dashboard)."""
+    st.session_state.historico_versao = st.session_state.get("historico_versao", 0) + 1
+
+def add_registro_historico(registro):
+    """Inclui um registro no histórico e grava o evento correspondente no store."""
+    registro.setdefault("id", uuid.uuid4().hex)
+    marcar_historico_alterado()
+    marcar_alterado("historico")
+    st.session_state.historico_acumulado.append(registro)
+    get_historico_frame().add(registro)
+    get_user_store().append("add", registro)
+    atualizar_ledger("add", registro)
+    if registro.get("tipo") in ("consumo", "atividade"):
+        atualizar_rollups([parse_date(registro.get("data"))])
+
+def registro_em_memoria(registro):
+    """Registro do histórico em sessão com o mesmo id (consultas ao store devolvem cópias)."""
+    if registro.get("id") is None:
+        return registro
+    return next(
+        (r for r in st.session_state.historico_acumulado if r.get("id") == registro["id"]),
+        registro,
+    )
+
+def update_registro_historico(registro, **alteracoes):
+    marcar_historico_alterado()
+    marcar_alterado("historico")
+    registro.update(alteracoes)
+    atual = registro_em_memoria(registro)
+    atual.update(alteracoes)
+    get_historico_frame().update(atual)
+    get_user_store().append("update", atual)
+    atualizar_ledger("update", atual)
+    if atual.get("tipo") in ("consumo", "atividade"):
+        atualizar_rollups([parse_date(atual.get("data"))])
+
+def remove_registro_historico(registro):
+    marcar_historico_alterado()
+    marcar_alterado("historico")
+    atual = registro_em_memoria(registro)
+    if atual in st.session_state.historico_acumulado:
+        st.session_state.historico_acumulado.remove(atual)
+    get_historico_frame().delete(atual)
+    get_user_store().append("delete", atual)
+    atualizar_ledger("delete", atual)
+    if atual.get("tipo") in ("consumo", "atividade"):
+        atualizar_rollups([parse_date(atual.get("data"))])
+
+def consultar_periodo(inicio, fim):
+    """
+    Consumo, atividades e pesos de [inicio, fim] (uma consulta por tipo), memoizados por versão do
+    histórico: a página de históricos e o relatório usam o mesmo resultado.
+    """
+    chave = (st.session_state.get("current_user"), st.session_state.get("historico_versao", 0), inicio, fim)
+    cache = st.session_state.get("consulta_periodo")
+    if cache is None or cache["chave"] != chave:
+        cache = {"chave": chave, **{tipo: consultar_historico(tipo, inicio, fim) for tipo in ("consumo", "atividade", "peso")}}
+        st.session_state.consulta_periodo = cache
+    return cache
+
+def pesos_registrados():
+    """Lista simplificada de pesos, em ordem de data, para os gráficos."""
+    frame = get_historico_frame()
+    return frame.quantidade[frame.filtrar("peso")].tolist()
+
+def consultar_historico(tipo, inicio=None, fim=None):
+    """Registros de um tipo ('consumo', 'peso', 'atividade') entre inicio e fim, em ordem de data."""
+    return get_user_store().query(get_historico_frame(), tipo, inicio, fim)
 
 
 # -----------------------------
@@ -217,11 +2511,10 @@ def reset_historico():
     st.session_state.peso = []
     st.session_state.datas_peso = []
     # Remove apenas entradas do tipo 'peso' e 'consumo' do histórico acumulado
-    st.session_state.historico_acumulado = [
-        r for r in st.session_state.historico_acumulado if r.get("tipo") not in ["peso", "consumo"]
-    ]
+    for r in [r for r in st.session_state.historico_acumulado if r.get("tipo") in ["peso", "consumo"]]:
+        remove_registro_historico(r)
     st.session_state.extras = 36.0
-    persist_all()
+    marcar_alterado("pesos", "perfil")
     st.success("Histórico de peso e pontos zerado com sucesso!")
 
 # -----------------------------
@@ -240,74 +2533,188 @@ ensure_current_week_exists()
 # -----------------------------
 # RECONSTRUÇÃO E RECÁLCULO (EXTRAS / DIÁRIO) COM FATOR DE PONDERAÇÃO
 # -----------------------------
-def rebuild_pontos_semana_from_history():
-    meta = float(st.session_state.meta_diaria or 29.0)
+def parametros_ledger():
+    meta = float(st.session_state.get("meta_diaria") or 29.0)
     fator_ponderacao = st.session_state.get("fator_ponderacao", 1.0)  # padrão 1.0
-    weeks = {}
+    return meta, fator_ponderacao
+
+def sincronizar_ledger(ledger):
+    """Reflete o ledger nos valores de sessão usados pelas páginas e pelo persist_all."""
+    st.session_state.pontos_semana = ledger.lista()
+    st.session_state.consumo_diario = ledger.pontos_do_dia(datetime.date.today())
+    extras = ledger.extras_ultima_semana()
+    if extras != st.session_state.get("extras"):
+        st.session_state.extras = extras
+        marcar_alterado("perfil")
+
+def get_ledger():
+    """Ledger da sessão; reconstruído por inteiro só no primeiro uso ou quando meta/fator mudam."""
+    meta, fator_ponderacao = parametros_ledger()
+    ledger = st.session_state.get("ledger")
+    if ledger is None or not ledger.valido(meta, fator_ponderacao):
+        mudou_parametros = ledger is not None
+        ledger = LedgerSemanal(meta, fator_ponderacao)
+        alterados = ledger.reconstruir(st.session_state.historico_acumulado)
+        st.session_state.ledger = ledger
+        get_user_store().append_many("update", alterados)
+        sincronizar_ledger(ledger)
+        # Extras de todas as semanas mudam com a meta; no primeiro uso só as semanas corrigidas
+        if mudou_parametros:
+            atualizar_rollups([datetime.date.fromisocalendar(a, s, 1) for a, s in ledger.semanas])
+        elif alterados:
+            atualizar_rollups([parse_date(r["data"]) for r in alterados])
+    return ledger
+
+def recalcular_semana_anterior(data):
+    """Semana anterior à janela do login: recalculada a partir do store, sem entrar no ledger da sessão."""
+    inicio = data - datetime.timedelta(days=data.weekday())
+    registros = consultar_historico("consumo", inicio, inicio + datetime.timedelta(days=6))
+    get_user_store().append_many("update", LedgerSemanal(*parametros_ledger()).reconstruir(registros))
+
+def atualizar_ledger(op, registro):
+    """Aplica ao ledger uma alteração do histórico, recalculando só a semana afetada."""
+    data = parse_date(registro.get("data"))
+    desde = get_user_store().desde
+    if registro.get("tipo") == "consumo" and data and desde and data < desde:
+        recalcular_semana_anterior(data)
+        return
+    ledger = st.session_state.get("ledger")
+    if ledger is None or not ledger.valido(*parametros_ledger()):
+        get_ledger()  # reconstrução completa já inclui a alteração
+        return
+    alterados = ledger.aplicar(op, registro, st.session_state.historico_acumulado)
+    get_user_store().append_many("update", alterados)
+    sincronizar_ledger(ledger)
 
-    # Filtra apenas registros de consumo no histórico acumulado
-    for reg in [r for r in st.session_state.historico_acumulado if r.get("tipo") == "consumo"]:
-        if not isinstance(reg.get("data"), datetime.date):
-            try:
-                reg["data"] = datetime.date.fromisoformat(reg["data"])
-            except Exception:
-                continue
-        w = iso_week_number(reg["data"])
-        if w not in weeks:
-            weeks[w] = {"semana": w, "pontos": [], "extras": 36.0}
-        # aplicar fator de ponderação
-        reg["pontos"] = round_points(float(reg.get("pontos", 0.0)) * fator_ponderacao)
-        weeks[w]["pontos"].append(reg)
-
-    sorted_week_nums = sorted(weeks.keys())
-    new_weeks = []
-
-    for wnum in sorted_week_nums:
-        week = weeks[wnum]
-        extras_remaining = 36.0
-        dates_in_order = []
-        regs_by_date = {}
+def rebuild_pontos_semana_from_history():
+    """Reconstrução completa do ledger a partir do histórico (o caminho normal é incremental)."""
+    st.session_state.pop("ledger", None)
+    get_ledger()
+    marcar_alterado("perfil")
 
-        for reg in week["pontos"]:
-            d = reg["data"]
-            if d not in regs_by_date:
-                regs_by_date[d] = []
-                dates_in_order.append(d)
-            regs_by_date[d].append(reg)
 
-        for d in sorted(dates_in_order):
-            cumulative_day = 0.0
-            for reg in regs_by_date[d]:
-                p = float(reg.get("pontos", 0.0))
-                before = cumulative_day
-                after = cumulative_day + p
-                if after <= meta:
-                    used = 0.0
-                else:
-                    part_before_meta = max(0.0, meta - before)
-                    extra_from_reg = p - part_before_meta
-                    used = min(extra_from_reg, extras_remaining)
-                    extras_remaining -= used
-                    if extras_remaining < 0:
-                        extras_remaining = 0.0
-                reg["usou_extras"] = round_points(used)
-                cumulative_day = after
+# -----------------------------
+# ROLLUPS DIÁRIOS E SEMANAIS (materializados em disco)
+# -----------------------------
+def get_rollups():
+    """Rollups do usuário logado; gerados a partir do histórico completo se ainda não existirem."""
+    if "rollups" not in st.session_state:
+        st.session_state.rollups = RollupsUsuario(st.session_state.current_user)
+        if not st.session_state.rollups.existe:
+            reconstruir_rollups()
+    return st.session_state.rollups
+
+def _recalcular_rollup_semana(rollups, ano, semana, consumos, atividades):
+    # Extras restantes: do ledger quando a semana está na janela da sessão; fora dela, pelos extras
+    # já gravados nos registros (os derivados não são recalculados aqui)
+    ledger = st.session_state.get("ledger")
+    semana_ledger = ledger.semana((ano, semana)) if ledger else None
+    if semana_ledger:
+        extras_restantes = semana_ledger["extras"]
+    else:
+        extras_restantes = round_points(max(0.0, 36.0 - sum(float(r.get("usou_extras", 0.0) or 0.0) for r in consumos)))
+    rollups.atualizar_semana(ano, semana, consumos, atividades, extras_restantes)
+
+def atualizar_rollups(datas):
+    """Recalcula os rollups das semanas que contêm `datas`; o arquivo é gravado no flush da execução."""
+    rollups = get_rollups()
+    for ano, semana in {iso_year_week(d) for d in datas if d}:
+        segunda = datetime.date.fromisocalendar(ano, semana, 1)
+        domingo = segunda + datetime.timedelta(days=6)
+        _recalcular_rollup_semana(
+            rollups, ano, semana,
+            consultar_historico("consumo", segunda, domingo),
+            consultar_historico("atividade", segunda, domingo),
+        )
+    marcar_alterado("rollups")
+
+def reconstruir_rollups():
+    """Ferramenta de correção: refaz todos os rollups a partir do histórico completo (inclusive o que está só em disco)."""
+    get_ledger()
+    rollups = st.session_state.get("rollups") or RollupsUsuario(st.session_state.current_user)
+    por_semana = {}
+    for tipo in ("consumo", "atividade"):
+        for r in consultar_historico(tipo):
+            por_semana.setdefault(iso_year_week(parse_date(r["data"])), {"consumo": [], "atividade": []})[tipo].append(r)
+    rollups.limpar()
+    for (ano, semana), registros in por_semana.items():
+        _recalcular_rollup_semana(rollups, ano, semana, registros["consumo"], registros["atividade"])
+    rollups.salvar()
+    st.session_state.rollups = rollups
+    marcar_historico_alterado()
+    return rollups
 
-        week["extras"] = round_points(extras_remaining)
-        new_weeks.append(week)
 
-    # Atualiza session_state com resultados
-    st.session_state.pontos_semana = new_weeks
+# -----------------------------
+# AGREGADOS DO DASHBOARD (memoizados por versão do histórico)
+# -----------------------------
+def agregados_dashboard():
+    """
+    Valores derivados que o dashboard exibe, memoizados por (usuário, versão do histórico, hoje,
+    meta/fator): reruns causados por widgets reaproveitam o resultado sem consultar o histórico.
+    """
     hoje = datetime.date.today()
-    total_today = sum(
-        float(r.get("pontos", 0.0))
-        for r in st.session_state.historico_acumulado
-        if r.get("tipo") == "consumo" and r.get("data") == hoje
-    )
-    st.session_state.consumo_diario = total_today
-    st.session_state.extras = st.session_state.pontos_semana[-1]["extras"] if st.session_state.pontos_semana else 36.0
-
-    persist_all()
+    chave = (st.session_state.get("current_user"), st.session_state.get("historico_versao", 0), hoje, parametros_ledger())
+    cache = st.session_state.get("agregados_dashboard")
+    if cache and cache["chave"] == chave:
+        return cache
+
+    get_ledger()  # garante derivados (e rollups) atualizados com a meta atual
+    rollups = get_rollups()
+    semana_atual = iso_year_week(hoje)
+    inicio_semana = hoje - datetime.timedelta(days=hoje.weekday())
+    fim_semana = inicio_semana + datetime.timedelta(days=6)
+    semana_rollup = rollups.semana(*semana_atual)
+
+    # Pontos de atividades da semana: registros do histórico (rollup) + formato antigo em activities
+    pontos_atividade_semana = semana_rollup["atividade"] if semana_rollup else 0.0
+    for k, lst in st.session_state.get("activities", {}).items():
+        d = parse_date(k)
+        if d and iso_year_week(d) == semana_atual:
+            for a in lst:
+                pontos_atividade_semana += float(a.get("pontos", 0.0))
+
+    # Gauge de peso: lista simplificada de pesos da sessão
+    pesolist = st.session_state.get("peso", [0.0]) or [0.0]
+    if len(pesolist) <= 1 or pesolist[-1] == pesolist[-2]:
+        cor_gauge, tendencia = "blue", "➖"
+    elif pesolist[-1] < pesolist[-2]:
+        cor_gauge, tendencia = "green", "⬇️"
+    else:
+        cor_gauge, tendencia = "orange", "⬆️"
+
+    # Linha de tendência do peso (regressão linear sobre os dias)
+    frame = get_historico_frame()
+    linhas_peso = frame.filtrar("peso")  # já em ordem de data
+    datas_peso = frame.datas[linhas_peso]
+    pesos = frame.quantidade[linhas_peso]
+    if len(pesos) >= 2:
+        x_ord = datas_peso.astype("int64")  # dias desde 1970-01-01
+        m, b = np.polyfit(x_ord, pesos, 1)
+        y_trend, mode_plot = m * x_ord + b, "lines+markers"
+    else:
+        y_trend, mode_plot = pesos, "markers"
+
+    cache = {
+        "chave": chave,
+        "semana_atual": semana_atual,
+        "consumo_diario": rollups.dia(hoje)["pontos"],
+        "extras_disponiveis": float(semana_rollup["extras_restantes"]) if semana_rollup else 36.0,
+        "pontos_atividade_semana": pontos_atividade_semana,
+        "peso_atual": float(pesos[-1]) if len(pesos) else 0.0,
+        "peso_gauge": {
+            "atual": pesolist[-1], "min": min(pesolist) - 5, "max": max(pesolist) + 5,
+            "cor": cor_gauge, "tendencia": tendencia,
+        },
+        "tendencia_peso": {
+            "datas": pd.to_datetime(datas_peso).tolist(), "pesos": np.asarray(y_trend).tolist(), "modo": mode_plot,
+        },
+        "consumos_hoje": consultar_historico("consumo", hoje, hoje),
+        "atividades_semana": consultar_historico("atividade", inicio_semana, fim_semana),
+        "pesos_semana": consultar_historico("peso", inicio_semana, fim_semana),
+    }
+    st.session_state.agregados_dashboard = cache
+    return cache
 
 
 
@@ -339,39 +2746,32 @@ for label, key in menu_itens:
         # -----------------------------
         if key == "resetar_semana":
             hoje = datetime.date.today()
-            semana_atual = hoje.isocalendar()[1]
+            ano_atual, semana_atual = iso_year_week(hoje)
+            inicio_semana = hoje - datetime.timedelta(days=hoje.weekday())
 
-            # Remove apenas registros da semana atual
-            st.session_state.pontos_semana = [
-                w for w in st.session_state.pontos_semana if w.get("semana") != semana_atual
-            ] if "pontos_semana" in st.session_state else []
-
-            st.session_state.pontos_semana.append({
-                "semana": semana_atual,
-                "pontos": [],
-                "extras": 36.0
-            })
+            # Remove apenas os registros de consumo da semana atual (ano ISO + semana); o ledger
+            # recalcula só essa semana a cada exclusão
+            for r in consultar_historico("consumo", inicio_semana, inicio_semana + datetime.timedelta(days=6)):
+                remove_registro_historico(r)
 
             st.session_state.extras = 36.0
-            st.session_state.consumo_diario = 0.0
-
-            if "consumo_historico" in st.session_state:
-                st.session_state.consumo_historico = [
-                    r for r in st.session_state.consumo_historico
-                    if r.get("data").isocalendar()[1] != semana_atual
-                ]
-
-            persist_all()
-            st.sidebar.success(f"✅ Semana {semana_atual} resetada com sucesso!")
+            marcar_alterado("perfil")
+            st.sidebar.success(f"✅ Semana {semana_atual}/{ano_atual} resetada com sucesso!")
 
         # -----------------------------
         # AÇÃO SAIR (logout)
         # -----------------------------
         elif key == "sair":
+            flush_alteracoes()  # grava o que ficou pendente antes de descartar a sessão
+            aguardar_gravacoes()
+            encerrar_sessao_persistente()
+            descartar_exportacao()
+            descartar_relatorio()
             st.session_state.logged_in = False
 
             # Limpa dados voláteis do usuário, mas mantém histórico no JSON
-            for k in ["peso", "datas_peso", "consumo_historico", "pontos_semana", "consumo_diario", "extras", "activities"]:
+            for k in ["peso", "datas_peso", "consumo_historico", "pontos_semana", "consumo_diario", "extras", "activities", "user_store", "ledger", "historico_frame",
+                      "historico_versao", "agregados_dashboard", "rollups", "consulta_periodo", "relatorio_html", "secoes_alteradas"]:
                 if k in st.session_state:
                     del st.session_state[k]
 
@@ -381,6 +2781,15 @@ for label, key in menu_itens:
             except Exception:
                 st.stop()
 
+# Gravação em segundo plano: profundidade da fila e latência do worker
+if WRITE_BEHIND:
+    estatisticas_gravador = get_gravador().estatisticas()
+    st.sidebar.caption(
+        f"💾 Gravações na fila: {estatisticas_gravador['fila']} · "
+        f"latência média {estatisticas_gravador['latencia_media_ms']:.0f} ms"
+        + (f" · erros: {estatisticas_gravador['erros']}" if estatisticas_gravador["erros"] else "")
+    )
+
 
 # -----------------------------
 # CADASTRAR ALIMENTO AJUSTADO
@@ -430,15 +2839,17 @@ def cadastrar_alimento():
         # Calcula pontos dinamicamente
         alimento["Pontos"] = calcular_pontos(alimento)
 
-        # Inicializa lista global se necessário
-        if "alimentos" not in st.session_state:
-            st.session_state.alimentos = []
-
-        # Adiciona alimento e persiste
-        st.session_state.alimentos.append(alimento)
-        persist_all()  # salva globalmente no JSON do usuário
+        # Adiciona (ou atualiza, se já existe com mesmo nome e porção) e persiste no catálogo global
+        resumo = {}
+        if not update_alimentos(lambda alimentos: resumo.update(upsert_alimentos(alimentos, [alimento]))):
+            return
 
-        st.success(f"Alimento '{nome}' cadastrado com sucesso! Pontos: {alimento['Pontos']}")
+        if resumo.get("inseridos"):
+            st.success(f"Alimento '{nome}' cadastrado com sucesso! Pontos: {alimento['Pontos']}")
+        elif resumo.get("atualizados"):
+            st.success(f"Alimento '{nome}' ({porcao:g} g) já existia e foi atualizado. Pontos: {alimento['Pontos']}")
+        else:
+            st.info(f"Alimento '{nome}' ({porcao:g} g) já está cadastrado com os mesmos dados.")
 
         # Atualiza interface imediatamente
         try:
@@ -450,70 +2861,248 @@ def cadastrar_alimento():
 # -----------------------------
 # IMPORTAR PLANILHA DE ALIMENTOS AJUSTADO
 # -----------------------------
+# Apelidos aceitos para cada coluna do catálogo na planilha importada (primeiro encontrado vence)
+COLUNAS_IMPORTACAO = {
+    "Calorias": ["calorias", "Calorias"],
+    "Gordura": ["gordura", "Gordura"],
+    "Saturada": ["saturada", "Saturada"],
+    "Carbo": ["carbo", "Carbo", "carboidratos", "Carboidratos"],
+    "Fibra": ["fibra", "Fibra"],
+    "Açúcar": ["açúcar", "Acúcar", "Acucar", "acucar"],
+    "Proteina": ["proteina", "Proteína", "Proteínas"],
+    "Sodio_mg": ["sodio_mg", "Sodio_mg", "sódio_mg", "Sódio_mg"],
+}
+
+def mapear_colunas_importacao(df):
+    """
+    Converte a planilha para as colunas do catálogo de uma vez, coluna a coluna:
+    nome, porção (padrão 100 g), nutrientes numéricos arredondados em 2 casas e Zero Ponto ('sim').
+    """
+    def coluna(opcoes):
+        return next((df[c] for c in opcoes if c in df.columns), None)
+
+    novos = pd.DataFrame(index=df.index)
+    nomes = coluna(["nome", "Nome", "NAME"])
+    novos["Nome"] = "Alimento sem nome" if nomes is None else nomes.astype(str)
+
+    porcoes = coluna(["porcao", "Porcao", "Porção", "porção"])
+    if porcoes is None:
+        novos["Porcao"] = 100.0
+    else:
+        # Mesmo critério de safe_parse_porçao: mantém só dígitos e ponto; inválido -> 100 g
+        novos["Porcao"] = pd.to_numeric(
+            porcoes.astype(str).str.replace(r"[^0-9.]", "", regex=True), errors="coerce"
+        ).fillna(100.0)
+
+    for destino, opcoes in COLUNAS_IMPORTACAO.items():
+        valores = coluna(opcoes)
+        if valores is None:
+            novos[destino] = 0.0
+        else:
+            valores = pd.to_numeric(valores, errors="coerce").fillna(0.0).astype(float)
+            novos[destino] = [round(v, 2) for v in valores]  # round() do Python, como no cadastro manual
+
+    zero = coluna(["Zero Ponto", "ZeroPonto", "zeroponto"])
+    novos["ZeroPontos"] = False if zero is None else zero.astype(str).str.strip().str.lower().eq("sim")
+    return novos
+
+def recalcular_pontos_catalogo():
+    """Recalcula os pontos de todo o catálogo global em uma passada vetorizada."""
+    def recalcular(alimentos):
+        if alimentos:
+            pontos = calcular_pontos_batch(pd.DataFrame(alimentos))
+            for alimento, p in zip(alimentos, pontos.tolist()):
+                alimento["Pontos"] = p
+
+    return update_alimentos(recalcular)
+
+IMPORT_CHUNK_ROWS = 20000   # linhas lidas, pontuadas e gravadas por vez
+IMPORT_PREVIEW_ROWS = 20
+
+def ler_planilha_em_blocos(arquivo, nome_arquivo, tamanho=IMPORT_CHUNK_ROWS):
+    """
+    Lê a planilha em blocos de até `tamanho` linhas, sem carregá-la inteira: CSV com
+    read_csv(chunksize=...) e XLSX com openpyxl em modo read_only. Gera (DataFrame, progresso 0..1).
+    """
+    if nome_arquivo.lower().endswith(".csv"):
+        tamanho_total = max(getattr(arquivo, "size", 0) or 0, 1)
+        # Wrapper de texto próprio: o pandas fecharia o upload ao descartar o leitor
+        texto = io.TextIOWrapper(arquivo, encoding="utf-8", newline="")
+        try:
+            for bloco in pd.read_csv(texto, chunksize=tamanho):
+                yield bloco, min(1.0, arquivo.tell() / tamanho_total)
+        finally:
+            texto.detach()
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        total_linhas = max((ws.max_row or 1) - 1, 1)
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [str(c) if c is not None else f"Coluna{i}" for i, c in enumerate(cabecalho)]
+        bloco, lidas = [], 0
+        for linha in linhas:
+            if all(v is None for v in linha):
+                continue
+            bloco.append(linha[:len(colunas)])
+            lidas += 1
+            if len(bloco) >= tamanho:
+                yield pd.DataFrame(bloco, columns=colunas), min(1.0, lidas / total_linhas)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=colunas), 1.0
+    finally:
+        wb.close()
+
+def preparar_bloco_importacao(bloco):
+    """Colunas do catálogo + pontos (em lote) para um bloco da planilha."""
+    novos_df = mapear_colunas_importacao(bloco)
+    novos_df["Pontos"] = calcular_pontos_batch(novos_df)
+    return novos_df
+
+def hash_conteudo(arquivo):
+    """sha256 do upload, lido em blocos de 1 MB."""
+    h = hashlib.sha256()
+    arquivo.seek(0)
+    for parte in iter(lambda: arquivo.read(1 << 20), b""):
+        h.update(parte)
+    arquivo.seek(0)
+    return h.hexdigest()
+
+def hash_linha_importacao(alimento):
+    """Hash curto do alimento (sem 'Pontos', que é derivado) para comparar linhas entre importações."""
+    chave = {k: v for k, v in alimento.items() if k != "Pontos"}
+    texto = json.dumps(chave, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=8).hexdigest()
+
+def analisar_upload(uploaded_file):
+    """
+    Hash e prévia do upload, guardados na sessão por file_id: os reruns do Streamlit
+    (o file_uploader mantém o arquivo) não leem nem reprocessam a planilha de novo.
+    """
+    cache = st.session_state.get("importacao_cache")
+    file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    if cache is None or cache["file_id"] != file_id:
+        conteudo_hash = hash_conteudo(uploaded_file)
+        primeiro = next(ler_planilha_em_blocos(uploaded_file, uploaded_file.name, IMPORT_PREVIEW_ROWS), None)
+        cache = {
+            "file_id": file_id,
+            "hash": conteudo_hash,
+            "previa": None if primeiro is None else preparar_bloco_importacao(primeiro[0]),
+        }
+        st.session_state.importacao_cache = cache
+    uploaded_file.seek(0)
+    return cache
+
 def importar_planilha():
     st.header("📂 Importar Alimentos")
+
+    if st.button("🔄 Recalcular pontos de todo o catálogo", key="recalc_catalogo"):
+        if recalcular_pontos_catalogo():
+            st.success(f"Pontos recalculados para {len(st.session_state.alimentos)} alimentos.")
+
     uploaded_file = st.file_uploader("Escolha sua planilha (.xlsx ou .csv)", type=["xlsx", "csv"], key="uploader_import")
     
     if uploaded_file is not None:
         try:
-            if uploaded_file.name.lower().endswith(".csv"):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
-            
-            alimentos_novos = []
-
-            for _, row in df.iterrows():
-                def g(col_options, default=0):
-                    for c in col_options:
-                        if c in row.index:
-                            return row.get(c)
-                    return default
-
-                nome = g(["nome", "Nome", "NAME"], "Alimento sem nome")
-                porc_val = g(["porcao", "Porcao", "Porção", "porção"], 100)
-                calorias = float(g(["calorias", "Calorias"], 0) or 0)
-                carbo = float(g(["carbo", "Carbo", "carboidratos", "Carboidratos"], 0) or 0)
-                gordura = float(g(["gordura", "Gordura"], 0) or 0)
-                saturada = float(g(["saturada", "Saturada"], 0) or 0)
-                fibra = float(g(["fibra", "Fibra"], 0) or 0)
-                acucar = float(g(["açúcar", "Acúcar", "Acucar", "acucar"], 0) or 0)
-                proteina = float(g(["proteina", "Proteína", "Proteínas"], 0) or 0)
-                sodio_mg = float(g(["sodio_mg", "Sodio_mg", "sódio_mg", "Sódio_mg"], 0) or 0)
-
-                try:
-                    porcao = safe_parse_porçao(porc_val)
-                except Exception:
-                    porcao = 100.0
-
-                zero_ponto = str(g(["Zero Ponto", "ZeroPonto", "zeroponto"], "não")).strip().lower() == "sim"
-
-                alimento = {
-                    "Nome": str(nome),
-                    "Porcao": porcao,
-                    "Calorias": round(calorias, 2),
-                    "Gordura": round(gordura, 2),
-                    "Saturada": round(saturada, 2),
-                    "Carbo": round(carbo, 2),
-                    "Fibra": round(fibra, 2),
-                    "Açúcar": round(acucar, 2),
-                    "Proteina": round(proteina, 2),
-                    "Sodio_mg": round(sodio_mg, 2),
-                    "ZeroPontos": zero_ponto,
-                    "Pontos": 0
-                }
+            analise = analisar_upload(uploaded_file)
+            if analise["previa"] is None:
+                st.warning("A planilha está vazia.")
+                return
+
+            manifesto = load_data(IMPORTS_FILE) or {}
+            ja_importado = manifesto.get("conteudos", {}).get(analise["hash"])
+            if ja_importado:
+                st.info(
+                    f"✅ Este arquivo (mesmo conteúdo) já foi importado em {ja_importado.get('importado_em', '?')} "
+                    f"como '{ja_importado.get('arquivo', '')}'. Nada a importar."
+                )
+                return
+
+            # Prévia: só as primeiras linhas, já mapeadas e pontuadas
+            st.markdown(f"**Prévia das primeiras {IMPORT_PREVIEW_ROWS} linhas:**")
+            st.dataframe(analise["previa"], use_container_width=True)
+
+            anterior = manifesto.get("arquivos", {}).get(uploaded_file.name)
+            if anterior:
+                st.caption("Uma versão anterior deste arquivo já foi importada: só as linhas novas ou alteradas serão aplicadas.")
+            linhas_anteriores = set(anterior.get("linhas", [])) if anterior else set()
+
+            politica = st.radio(
+                "Quando o alimento já existir no catálogo (mesmo nome e porção):",
+                ["Planilha prevalece (atualiza o catálogo)", "Catálogo prevalece (mantém o existente)"],
+                key="import_politica"
+            )
+            novos_prevalecem = politica.startswith("Planilha")
+
+            if not st.button("📥 Importar planilha", key="btn_importar"):
+                return
+
+            # Importação completa em blocos: cada bloco é pontuado e só as linhas ainda não importadas são gravadas
+            barra = st.progress(0.0, text="Importando...")
+            resumo = {"inseridos": 0, "atualizados": 0, "inalterados": 0}
+            linhas_vistas = set()
+            chaves_vistas = set()
+            for bloco, progresso in ler_planilha_em_blocos(uploaded_file, uploaded_file.name):
+                alimentos_novos = []
+                for alimento in preparar_bloco_importacao(bloco).to_dict("records"):
+                    h = hash_linha_importacao(alimento)
+                    if h not in linhas_anteriores and h not in linhas_vistas:
+                        alimentos_novos.append(alimento)
+                    else:
+                        resumo["inalterados"] += 1
+                    linhas_vistas.add(h)
+                    chaves_vistas.add(chave_alimento(alimento))
+                if alimentos_novos:
+                    def aplicar_bloco(alimentos):
+                        for k, v in upsert_alimentos(alimentos, alimentos_novos, novos_prevalecem).items():
+                            resumo[k] += v
+
+                    if not update_alimentos(aplicar_bloco):
+                        return
+                barra.progress(progresso, text=f"{len(linhas_vistas)} linhas processadas...")
+
+            # Alimentos de linhas que saíram da nova versão do arquivo (e cuja chave não voltou) são removidos
+            removidas = linhas_anteriores - linhas_vistas
+            if removidas:
+                def remover_linhas(alimentos):
+                    pendentes = set(removidas)
+                    mantidos = []
+                    for a in alimentos:
+                        h = hash_linha_importacao(a)
+                        if h in pendentes and chave_alimento(a) not in chaves_vistas:
+                            pendentes.discard(h)
+                        else:
+                            mantidos.append(a)
+                    removidas.difference_update(pendentes)
+                    alimentos[:] = mantidos
 
-                # Calcula pontos conforme função principal
-                alimento["Pontos"] = calcular_pontos(alimento)
-                alimentos_novos.append(alimento)
+                update_alimentos(remover_linhas)
+            barra.progress(1.0, text=f"{len(linhas_vistas)} linhas processadas.")
 
-            if "alimentos" not in st.session_state:
-                st.session_state.alimentos = []
+            def registrar_importacao(dados):
+                dados.setdefault("arquivos", {})[uploaded_file.name] = {
+                    "hash": analise["hash"], "linhas": sorted(linhas_vistas)
+                }
+                dados.setdefault("conteudos", {})[analise["hash"]] = {
+                    "arquivo": uploaded_file.name,
+                    "importado_em": datetime.datetime.now().strftime("%d/%m/%Y %H:%M"),
+                }
 
-            st.session_state.alimentos.extend(alimentos_novos)
-            persist_all()
+            update_data(IMPORTS_FILE, registrar_importacao)
 
-            st.success(f"📂 Importadas {len(alimentos_novos)} linhas. Total agora: {len(st.session_state.alimentos)} alimentos.")
+            st.success(
+                f"📂 Importação concluída: {resumo['inseridos']} inseridos, {resumo['atualizados']} atualizados, "
+                f"{resumo['inalterados']} inalterados"
+                + (f", {len(removidas)} removidos" if removidas else "")
+                + f". Total agora: {len(st.session_state.alimentos)} alimentos."
+            )
             try:
                 rerun_streamlit()
             except Exception:
@@ -522,6 +3111,27 @@ def importar_planilha():
         except Exception as e:
             st.error(f"Erro ao importar planilha: {e}\n(Se for .xlsx, instale openpyxl: pip install openpyxl)")
 
+# -----------------------------
+# SELEÇÃO DE ALIMENTO (BUSCA POR PREFIXO)
+# -----------------------------
+def selecionar_alimento(key, limite=50):
+    """
+    Campo de busca + selectbox só com os primeiros `limite` resultados (não envia o catálogo inteiro).
+    Devolve a chave canônica (nome + porção) do alimento escolhido.
+    """
+    indice = get_catalogo().indice()
+    busca = st.text_input(
+        "Buscar alimento:", key=f"{key}_busca",
+        placeholder="Digite o início do nome (acentos e maiúsculas são ignorados)"
+    )
+    chaves = indice.buscar(busca, limite)
+    if not chaves:
+        st.info("Nenhum alimento encontrado para essa busca.")
+        return None
+    if len(chaves) == limite:
+        st.caption(f"Mostrando os primeiros {limite} de {len(indice.chaves_ordenadas)} alimentos — refine a busca.")
+    return st.selectbox("Escolha o alimento:", chaves, format_func=indice.rotulos.get, key=key)
+
 # -----------------------------
 # FUNÇÃO REGISTRAR CONSUMO (AJUSTADO)
 # -----------------------------
@@ -533,13 +3143,15 @@ def registrar_consumo():
         return
 
     # Seleção do alimento
-    nomes = sorted([a["Nome"] for a in st.session_state.alimentos])
-    escolha = st.selectbox("Escolha o alimento:", nomes, key="consumo_select")
-    alimento = next((a for a in st.session_state.alimentos if a["Nome"] == escolha), None)
+    escolha = selecionar_alimento("consumo_select")
+    if escolha is None:
+        return
+    alimento = get_catalogo().indice().alimento(escolha)
     if alimento is None:
         st.error("Alimento não encontrado.")
         return
 
+    nome = alimento.get("Nome", "")
     porcao_ref = float(alimento.get("Porcao", 100.0))
     pontos_por_porcao = round_points(alimento.get("Pontos", 0.0))
     st.markdown(f"**Porção referência:** {porcao_ref} g — Pontos (por porção): **{pontos_por_porcao}**")
@@ -571,24 +3183,23 @@ def registrar_consumo():
             registro = {
                 "tipo": "consumo",
                 "data": datetime.date.today().isoformat(),
-                "nome": escolha,
+                "nome": nome,
+                "porcao": porcao_ref,
                 "quantidade": float(quantidade),
                 "pontos": pontos_registrados,
                 "usou_extras": 0.0
             }
-            st.session_state.historico_acumulado.append(registro)
+            add_registro_historico(registro)
 
-            rebuild_pontos_semana_from_history()
-            persist_all()
             st.success(
-                f"🍴 Registrado {quantidade:.2f}g de {escolha}. "
+                f"🍴 Registrado {quantidade:.2f}g de {nome}. "
                 f"Pontos: {pontos_registrados:.2f}. Total hoje: {st.session_state.consumo_diario:.2f}"
             )
             st.session_state.mostrar_historico_consumo = True
-            st.stop()  # atualização imediata
+            parar_execucao()  # atualização imediata
 
     # Histórico com editar/excluir
-    historico_consumo = [r for r in st.session_state.historico_acumulado if r.get("tipo") == "consumo"]
+    historico_consumo = consultar_historico("consumo", get_user_store().desde)
     with st.expander("### Histórico de Consumo (últimos registros)", expanded=st.session_state.mostrar_historico_consumo):
         if not historico_consumo:
             st.info("Nenhum consumo registrado ainda.")
@@ -613,7 +3224,7 @@ def registrar_consumo():
                             "Quantidade (g):", min_value=0.0, step=1.0,
                             value=reg["quantidade"], key=edit_key_q
                         )
-                        alimento_ref = next((a for a in st.session_state.alimentos if a["Nome"] == reg["nome"]), None)
+                        alimento_ref = get_catalogo().indice().alimento_do_registro(reg)
                         if alimento_ref:
                             porc_ref = float(alimento_ref.get("Porcao", 100.0))
                             new_p_raw = float(alimento_ref.get("Pontos", 0.0)) * (new_q / porc_ref if porc_ref > 0 else 0.0)
@@ -622,20 +3233,15 @@ def registrar_consumo():
                             new_p = reg["pontos"]
 
                         if st.button("Salvar alterações", key=save_key):
-                            reg["quantidade"] = float(new_q)
-                            reg["pontos"] = new_p
-                            rebuild_pontos_semana_from_history()
-                            persist_all()
+                            update_registro_historico(reg, quantidade=float(new_q), pontos=new_p)
                             st.success("Registro atualizado!")
-                            st.stop()
+                            parar_execucao()
 
                 # Excluir
                 if cols[2].button("❌", key=f"del_cons_{idx}"):
-                    st.session_state.historico_acumulado.remove(reg)
-                    rebuild_pontos_semana_from_history()
-                    persist_all()
+                    remove_registro_historico(reg)
                     st.success("Registro excluído.")
-                    st.stop()
+                    parar_execucao()
 
 # -----------------------------
 # FUNÇÃO CALCULAR META DIÁRIA
@@ -693,15 +3299,6 @@ def calcular_meta_diaria(sexo, idade, peso, altura, objetivo, nivel_atividade):
 # -----------------------------
 import datetime
 
-def parse_date(d):
-    """Converte string ISO ou objeto para datetime.date."""
-    if isinstance(d, datetime.date):
-        return d
-    try:
-        return datetime.date.fromisoformat(str(d))
-    except Exception:
-        return None
-
 def registrar_peso():
     st.header("⚖️ Registrar Peso")
 
@@ -732,12 +3329,10 @@ def registrar_peso():
                 "pontos": 0,
                 "usou_extras": 0.0
             }
-            st.session_state.historico_acumulado.append(registro)
+            add_registro_historico(registro)
 
             # 🔹 Mantém lista simplificada de pesos para gráficos
-            st.session_state.peso = [
-                r["quantidade"] for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"
-            ]
+            st.session_state.peso = pesos_registrados()
 
             # Atualiza meta diária automaticamente
             st.session_state.meta_diaria = calcular_meta_diaria(
@@ -749,18 +3344,18 @@ def registrar_peso():
                 nivel_atividade=st.session_state.nivel_atividade
             )
 
-            persist_all()
+            marcar_alterado("pesos", "perfil")
             st.success(f"Peso {peso_novo:.2f} kg registrado com sucesso! Meta diária: {st.session_state.meta_diaria} pts")
             st.session_state.mostrar_historico_peso = True
             rerun_streamlit()  # atualização imediata
 
     # Histórico de pesos
     with st.expander("Histórico de Pesos", expanded=st.session_state.mostrar_historico_peso):
-        historico_peso = [r for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"]
+        historico_peso = consultar_historico("peso")
         if not historico_peso:
             st.info("Nenhum peso registrado ainda.")
         else:
-            historico_peso_sorted = sorted(historico_peso, key=lambda x: parse_date(x.get("data")), reverse=True)
+            historico_peso_sorted = historico_peso[::-1]
             for idx, reg in enumerate(historico_peso_sorted):
                 data_reg = parse_date(reg["data"])
                 peso_reg = reg["quantidade"]
@@ -793,12 +3388,10 @@ def registrar_peso():
                             key=edit_key
                         )
                         if st.button("Salvar alterações", key=save_key):
-                            reg["quantidade"] = float(new_peso)
+                            update_registro_historico(reg, quantidade=float(new_peso))
 
                             # 🔹 Atualiza lista simplificada de pesos
-                            st.session_state.peso = [
-                                r["quantidade"] for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"
-                            ]
+                            st.session_state.peso = pesos_registrados()
 
                             # Atualiza meta diária automaticamente
                             st.session_state.meta_diaria = calcular_meta_diaria(
@@ -809,20 +3402,18 @@ def registrar_peso():
                                 objetivo=st.session_state.objetivo,
                                 nivel_atividade=st.session_state.nivel_atividade
                             )
-                            persist_all()
+                            marcar_alterado("pesos", "perfil")
                             st.success(f"Registro atualizado para {new_peso:.2f} kg. Meta diária: {st.session_state.meta_diaria} pts")
                             rerun_streamlit()
 
                 # Excluir peso
                 if cols[2].button("❌", key=f"del_peso_{idx}"):
-                    st.session_state.historico_acumulado.remove(reg)
+                    remove_registro_historico(reg)
 
                     # 🔹 Atualiza lista simplificada de pesos
-                    st.session_state.peso = [
-                        r["quantidade"] for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"
-                    ]
+                    st.session_state.peso = pesos_registrados()
 
-                    persist_all()
+                    marcar_alterado("pesos")
                     st.success("Registro excluído.")
                     rerun_streamlit()
 
@@ -882,9 +3473,9 @@ def perfil_page():
             st.session_state.nivel_atividade = nivel_atividade
 
             # Verifica peso no histórico, se não houver adiciona inicial 0
-            historico_peso = [r for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"]
+            historico_peso = consultar_historico("peso")
             if not historico_peso:
-                st.session_state.historico_acumulado.append({
+                add_registro_historico({
                     "tipo": "peso",
                     "data": datetime.date.today().isoformat(),
                     "nome": "Peso inicial",
@@ -906,7 +3497,7 @@ def perfil_page():
                 nivel_atividade=st.session_state.nivel_atividade
             )
 
-            persist_all()
+            marcar_alterado("perfil")
             st.success("Perfil atualizado com sucesso!")
             rerun_streamlit()
 
@@ -934,49 +3525,42 @@ def safe_parse_porçao(porc):
     except Exception:
         return 100.0
 
-def persist_alimentos():
-    """Salva alimentos globais no JSON."""
-    if "alimentos" in st.session_state:
-        try:
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(st.session_state.alimentos, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            st.error(f"Erro ao salvar alimentos: {e}")
+def update_alimentos(alterar):
+    """
+    Altera o catálogo global: relê ww_data.json sob lock, aplica alterar(lista) e grava atomicamente,
+    preservando o que outras sessões/processos gravaram; a sessão passa a apontar para a lista nova.
+    """
+    try:
+        st.session_state.alimentos = get_catalogo().update(alterar)
+        return True
+    except Exception as e:
+        st.error(f"Erro ao salvar alimentos: {e}")
+        return False
+
+def remover_alimento(alimentos, alimento):
+    """Remove da lista o item igual a `alimento` (ou, na falta, o primeiro com o mesmo nome)."""
+    idx = next((i for i, a in enumerate(alimentos) if a == alimento), None)
+    if idx is None:
+        idx = next((i for i, a in enumerate(alimentos) if a.get("Nome") == alimento.get("Nome")), None)
+    if idx is not None:
+        alimentos.pop(idx)
+    return idx
 
 def load_alimentos():
-    """Carrega alimentos do JSON global para session_state."""
-    if "alimentos" not in st.session_state:
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data_store = json.load(f)
-                if isinstance(data_store, list):
-                    st.session_state.alimentos = data_store
-                elif isinstance(data_store, dict) and "alimentos" in data_store:
-                    st.session_state.alimentos = data_store["alimentos"]
-                else:
-                    st.session_state.alimentos = []
-        except FileNotFoundError:
-            st.session_state.alimentos = []
-        except Exception as e:
-            st.session_state.alimentos = []
-            st.error(f"Erro ao carregar alimentos: {e}")
+    """Aponta session_state.alimentos para o catálogo compartilhado (recarregado se o arquivo mudou)."""
+    try:
+        st.session_state.alimentos = get_catalogo().atual()
+    except Exception as e:
+        st.session_state.alimentos = []
+        st.error(f"Erro ao carregar alimentos: {e}")
 
 def add_alimento_session(alimento):
     """Adiciona alimento ao session_state e persiste no JSON, forçando atualização da UI."""
-    if "alimentos" not in st.session_state:
-        st.session_state.alimentos = []
-    st.session_state.alimentos.append(alimento)
-    persist_alimentos()
+    update_alimentos(lambda alimentos: upsert_alimentos(alimentos, [alimento]))
     # força atualização imediata para refletir o novo alimento
-    try:
-        if hasattr(st, "experimental_rerun") and callable(st.experimental_rerun):
-            st.experimental_rerun()
-        else:
-            st.stop()
-    except Exception:
-        st.stop()
+    rerun_streamlit()
 
-# Inicializa lista de alimentos
+# Inicializa lista de alimentos (referência ao catálogo compartilhado do processo)
 load_alimentos()
 
 # -----------------------------
@@ -1006,6 +3590,30 @@ def calcular_pontos(alimento):
     pontos = round_points(pontos_raw)
     return pontos
 
+def calcular_pontos_batch(df):
+    """
+    Versão vetorizada de calcular_pontos para um DataFrame com as colunas do catálogo.
+    Devolve uma Series de int com exatamente o mesmo resultado de calcular_pontos linha a linha
+    (mesma ordem das operações, máscara de ZeroPontos e arredondamento int(x + 0.5)).
+    """
+    def coluna(nome):
+        if nome not in df.columns:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[nome], errors="coerce").to_numpy(dtype=float)
+
+    pontos_raw = (
+        (coluna("Calorias") / 50.0) + (coluna("Carbo") / 10.0) + (coluna("Gordura") / 5.0)
+        + (coluna("Proteina") / 5.0) + (coluna("Sodio_mg") / 100.0)
+    )
+    # round_points: int() trunca em direção a zero; valores inválidos (NaN/inf) viram 0
+    pontos = np.trunc(pontos_raw + 0.5)
+    pontos[~np.isfinite(pontos)] = 0
+
+    if "ZeroPontos" in df.columns:
+        zero = df["ZeroPontos"].astype(str).str.strip().str.lower().isin(["sim", "true", "1"]).to_numpy()
+        pontos[zero] = 0
+    return pd.Series(pontos.astype(int), index=df.index, name="Pontos")
+
 
 # -----------------------------
 # CONSULTAR + EDITAR/EXCLUIR ALIMENTO (AJUSTADO)
@@ -1017,16 +3625,18 @@ def consultar_alimento():
         st.warning("Nenhum alimento cadastrado ainda.")
         return
 
-    # Lista de nomes em ordem alfabética e escolha
-    nomes = sorted([a["Nome"] for a in st.session_state.alimentos])
-    escolha = st.selectbox("Escolha o alimento:", nomes, key="consult_select")
+    # Busca por nome e escolha
+    escolha = selecionar_alimento("consult_select")
+    if escolha is None:
+        return
 
     # Localizar índice e objeto
-    idx = next((i for i, a in enumerate(st.session_state.alimentos) if a["Nome"] == escolha), None)
+    indice = get_catalogo().indice()
+    idx = indice.posicao_por_chave.get(escolha)
     if idx is None:
         st.error("Alimento não encontrado.")
         return
-    alimento = st.session_state.alimentos[idx]
+    alimento = indice.alimentos[idx]
 
     # ----- Exibição -----
     st.subheader(alimento["Nome"])
@@ -1073,9 +3683,8 @@ def consultar_alimento():
             rerun_streamlit()
     with col_delete:
         if st.button("🗑️ Excluir este alimento", key=f"del_btn_{idx}"):
-            st.session_state.alimentos.pop(idx)
-            persist_all()
-            st.success(f"Alimento '{escolha}' removido com sucesso!")
+            update_alimentos(lambda alimentos: remover_alimento(alimentos, alimento))
+            st.success(f"Alimento '{alimento['Nome']}' removido com sucesso!")
             rerun_streamlit()
 
     # ----- Painel de Edição -----
@@ -1112,6 +3721,9 @@ def consultar_alimento():
             salvar = st.form_submit_button("💾 Salvar alterações")
             if salvar:
                 porcao_val = safe_parse_porçao(porcao_novo)
+                # Novo dict: o item original pertence ao catálogo compartilhado e não é alterado no lugar
+                original = alimento
+                alimento = dict(alimento)
                 alimento.update({
                     "Nome": nome_novo.strip(),
                     "Porcao": porcao_val,
@@ -1128,7 +3740,12 @@ def consultar_alimento():
 
                 # Recalcula pontos
                 alimento["Pontos"] = round_points(calcular_pontos(alimento))
-                persist_all()
+
+                def substituir(alimentos):
+                    pos = remover_alimento(alimentos, original)
+                    alimentos.insert(len(alimentos) if pos is None else pos, alimento)
+
+                update_alimentos(substituir)
                 st.session_state[flag_key] = False
                 st.success(f"Alimento '{nome_novo}' atualizado com sucesso! Pontos: {alimento['Pontos']}")
                 rerun_streamlit()
@@ -1164,19 +3781,6 @@ if st.session_state.menu == "dashboard":
     st.session_state.extras = st.session_state.get("extras", 36.0)
     st.session_state.activities = st.session_state.get("activities", {})
 
-    # ---------- utilitário local para datas ----------
-    def parse_date(d):
-        """Converte string ISO ou objeto para datetime.date; retorna None se inválido."""
-        if isinstance(d, datetime.date):
-            return d
-        try:
-            return datetime.date.fromisoformat(str(d))
-        except Exception:
-            try:
-                return datetime.datetime.strptime(str(d), "%Y-%m-%d").date()
-            except Exception:
-                return None
-
     # ---------- Verifica perfil incompleto de forma segura ----------
     def perfil_incompleto_safe():
         return (
@@ -1204,30 +3808,17 @@ if st.session_state.menu == "dashboard":
 
     # ---------- Garantir semana atual e reconstruir pontos ----------
     ensure_current_week_exists()
-    rebuild_pontos_semana_from_history()
-
-    hoje = datetime.date.today()
-    semana_atual = iso_week_number(hoje)
+    agregados = agregados_dashboard()
 
     # ---------- Peso atual ----------
-    historico_peso = [r for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"]
-    peso_atual = historico_peso[-1]["quantidade"] if historico_peso else 0.0
+    peso_atual = agregados["peso_atual"]
 
     # ---------- Consumo diário ----------
-    consumo_diario = sum(
-        r.get("pontos", 0.0)
-        for r in st.session_state.historico_acumulado
-        if r.get("tipo") == "consumo" and parse_date(r.get("data")) == hoje
-    )
+    consumo_diario = agregados["consumo_diario"]
     st.session_state.consumo_diario = consumo_diario
 
     # ---------- Semana atual ----------
-    semana_obj = next((w for w in st.session_state.pontos_semana if w.get("semana") == semana_atual), None)
-    if semana_obj is None:
-        semana_obj = {"semana": semana_atual, "pontos": [], "extras": float(st.session_state.extras)}
-        st.session_state.pontos_semana.append(semana_obj)
-
-    extras_disponiveis = float(semana_obj.get("extras", 36.0))
+    extras_disponiveis = agregados["extras_disponiveis"]
 
     # ---------- Painel principal de resumo ----------
     st.markdown(
@@ -1264,14 +3855,7 @@ if st.session_state.menu == "dashboard":
 
     # Pontos Extras
     with col2:
-        pontos_atividade_semana = 0.0
-        for k, lst in st.session_state.get("activities", {}).items():
-            d = parse_date(k)
-            if d and iso_week_number(d) == semana_atual:
-                for a in lst:
-                    pontos_atividade_semana += float(a.get("pontos", 0.0))
-
-        extras_disponiveis = float(semana_obj.get("extras", 36.0))
+        pontos_atividade_semana = agregados["pontos_atividade_semana"]
         total_banco = max(0.0, extras_disponiveis + pontos_atividade_semana)
         excesso_diario = max(0.0, st.session_state.consumo_diario - float(st.session_state.meta_diaria or 0))
         max_range = total_banco if total_banco > 0 else 1.0
@@ -1294,24 +3878,12 @@ if st.session_state.menu == "dashboard":
 
     # Peso Atual
     with col3:
-        pesolist = st.session_state.get("peso", [0.0])
-        if len(pesolist) <= 1:
-            cor_gauge = "blue"
-            tendencia = "➖"
-        else:
-            if pesolist[-1] < pesolist[-2]:
-                cor_gauge = "green"
-                tendencia = "⬇️"
-            elif pesolist[-1] > pesolist[-2]:
-                cor_gauge = "orange"
-                tendencia = "⬆️"
-            else:
-                cor_gauge = "blue"
-                tendencia = "➖"
-
-        peso_atual = pesolist[-1]
-        min_axis = min(pesolist) - 5
-        max_axis = max(pesolist) + 5
+        peso_gauge = agregados["peso_gauge"]
+        cor_gauge = peso_gauge["cor"]
+        tendencia = peso_gauge["tendencia"]
+        peso_atual = peso_gauge["atual"]
+        min_axis = peso_gauge["min"]
+        max_axis = peso_gauge["max"]
 
         fig_gauge = go.Figure(go.Indicator(
             mode="gauge+number",
@@ -1329,27 +3901,13 @@ if st.session_state.menu == "dashboard":
     # -----------------------------
     def exibir_historicos_dashboard():
         col_hist1, col_hist2, col_hist3 = st.columns(3)
-        historico = st.session_state.get("historico_acumulado", [])
-
-        hoje = datetime.date.today()
-        semana_atual_local = hoje.isocalendar()[1]
-        ano_atual_local = hoje.isocalendar()[0]
-
-        def mesma_semana(dt):
-            if not dt:
-                return False
-            iso = dt.isocalendar()
-            return iso[0] == ano_atual_local and iso[1] == semana_atual_local
 
         # Pontos / Consumo Diário
         with col_hist1:
             st.markdown("### 📊 Pontos / Consumo Diário")
-            consumos_hoje = [
-                r for r in historico
-                if r.get("tipo") == "consumo" and parse_date(r.get("data")) == hoje
-            ]
+            consumos_hoje = agregados["consumos_hoje"]
             if consumos_hoje:
-                for reg in sorted(consumos_hoje, key=lambda x: parse_date(x["data"])):
+                for reg in consumos_hoje:
                     dia = parse_date(reg["data"])
                     dia_str = dia.strftime("%d/%m/%Y") if dia else str(reg["data"])
                     dia_sem = weekday_name_br(dia) if dia else ""
@@ -1368,12 +3926,9 @@ if st.session_state.menu == "dashboard":
         # Histórico de Atividades
         with col_hist2:
             st.markdown("### 🏃 Histórico de Atividades Físicas")
-            historico_atividades_semana = [
-                r for r in historico
-                if r.get("tipo") == "atividade" and mesma_semana(parse_date(r.get("data")))
-            ]
+            historico_atividades_semana = agregados["atividades_semana"]
             if historico_atividades_semana:
-                for reg in sorted(historico_atividades_semana, key=lambda x: parse_date(x["data"])):
+                for reg in historico_atividades_semana:
                     dia = parse_date(reg["data"])
                     dia_sem = weekday_name_br(dia) if dia else ""
                     st.markdown(
@@ -1389,12 +3944,9 @@ if st.session_state.menu == "dashboard":
         # Histórico de Peso
         with col_hist3:
             st.markdown("### ⚖️ Histórico de Peso")
-            historico_peso_semana = [
-                r for r in historico
-                if r.get("tipo") == "peso" and mesma_semana(parse_date(r.get("data")))
-            ]
+            historico_peso_semana = agregados["pesos_semana"]
             if historico_peso_semana:
-                historico_peso_semana_sorted = sorted(historico_peso_semana, key=lambda x: parse_date(x["data"]))
+                historico_peso_semana_sorted = historico_peso_semana  # consultar_historico já ordena por data
                 for idx, reg in enumerate(historico_peso_semana_sorted):
                     p = reg["quantidade"]
                     d = parse_date(reg["data"])
@@ -1427,30 +3979,12 @@ if st.session_state.menu == "dashboard":
 # Tendência de Peso (linha) - exclusivo do Dashboard
 # -----------------------------
 if st.session_state.menu == "dashboard":
-    historico_peso = [r for r in st.session_state.historico_acumulado if r.get("tipo") == "peso"]
-    if historico_peso:
-        # Ordena por data
-        historico_peso_sorted = sorted(historico_peso, key=lambda x: parse_date(x.get("data")))
-        datas = [parse_date(r.get("data")) for r in historico_peso_sorted]
-        pesos = [r.get("quantidade", 0.0) for r in historico_peso_sorted]
-
-        df_peso = pd.DataFrame({"Data": datas, "Peso": pesos})
-        df_peso["Data_dt"] = pd.to_datetime(df_peso["Data"])
-
-        if len(df_peso) >= 2:
-            x_ord = np.array([d.toordinal() for d in df_peso["Data_dt"]])
-            y = np.array(df_peso["Peso"])
-            m, b = np.polyfit(x_ord, y, 1)
-            y_trend = m*x_ord + b
-            mode_plot = "lines+markers"
-        else:
-            y_trend = np.array(df_peso["Peso"])
-            mode_plot = "markers"
-
+    tendencia_peso = agregados_dashboard()["tendencia_peso"]
+    if tendencia_peso["datas"]:
         fig_line = go.Figure(go.Scatter(
-            x=df_peso["Data_dt"].tolist(),
-            y=y_trend.tolist(),
-            mode=mode_plot,
+            x=tendencia_peso["datas"],
+            y=tendencia_peso["pesos"],
+            mode=tendencia_peso["modo"],
             line=dict(color="#8e44ad", width=3)
         ))
         fig_line.update_layout(
@@ -1493,7 +4027,7 @@ def registrar_atividade_fisica():
             pontos = round_points((minutos / minutos_base) * pontos_base.get(tipo, 1))
 
             # Salva data como string ISO
-            st.session_state.historico_acumulado.append({
+            add_registro_historico({
                 "tipo": "atividade",
                 "data": data_atividade.isoformat(),
                 "nome": tipo,
@@ -1502,22 +4036,17 @@ def registrar_atividade_fisica():
                 "usou_extras": 0.0
             })
 
-            rebuild_pontos_semana_from_history()
-            persist_all()
             st.success(f"✅ Atividade '{tipo}' registrada! Pontos extras atualizados: {st.session_state.extras:.2f}")
             st.session_state.mostrar_historico_atividade = True
-            st.stop()
+            parar_execucao()
 
     # Histórico de atividades
-    historico_atividades = [
-        r for r in st.session_state.historico_acumulado
-        if r.get("tipo") == "atividade"
-    ]
+    historico_atividades = consultar_historico("atividade", get_user_store().desde)
     with st.expander("Histórico de Atividades", expanded=st.session_state.mostrar_historico_atividade):
         if not historico_atividades:
             st.info("Nenhuma atividade registrada ainda.")
         else:
-            for idx, ato in enumerate(sorted(historico_atividades, key=lambda x: parse_date(x["data"]), reverse=True)):
+            for idx, ato in enumerate(historico_atividades[::-1]):
                 col1, col2, col3, col4 = st.columns([4, 2, 1, 1])
                 dia = parse_date(ato["data"])
                 col1.write(f"{dia.strftime('%d/%m/%Y')} - {ato['nome']} - {ato['quantidade']} min")
@@ -1539,23 +4068,20 @@ def registrar_atividade_fisica():
                         )
                         if st.button("Salvar alterações", key=f"save_atividade_{idx}"):
                             novo_pts = round_points((novo_min / minutos_base) * pontos_base.get(novo_tipo, 1))
-                            ato.update({
-                                "nome": novo_tipo,
-                                "quantidade": novo_min,
-                                "pontos": novo_pts
-                            })
-                            rebuild_pontos_semana_from_history()
-                            persist_all()
+                            update_registro_historico(
+                                ato,
+                                nome=novo_tipo,
+                                quantidade=novo_min,
+                                pontos=novo_pts
+                            )
                             st.success("Atividade atualizada!")
-                            st.stop()
+                            parar_execucao()
 
                 # Excluir
                 if col4.button("❌", key=f"del_atividade_{idx}"):
-                    st.session_state.historico_acumulado.remove(ato)
-                    rebuild_pontos_semana_from_history()
-                    persist_all()
+                    remove_registro_historico(ato)
                     st.success("Atividade removida!")
-                    st.stop()
+                    parar_execucao()
 
 
 # -----------------------------
@@ -1563,24 +4089,13 @@ def registrar_atividade_fisica():
 # -----------------------------
 import streamlit as st
 import datetime
-import base64
-
-# -----------------------------
-# Função utilitária: parse de datas
-# -----------------------------
-def parse_date(d):
-    if isinstance(d, datetime.date):
-        return d
-    try:
-        return datetime.date.fromisoformat(str(d))
-    except:
-        return None
 
 # -----------------------------
-# Função para gerar HTML do relatório (para download)
+# Relatório HTML (para download)
 # -----------------------------
-def gerar_html_relatorio(consumo_filtrado, atividades_filtrado, peso_filtrado, pontos_semana, data_inicio, data_fim, incluir_consumo=True, incluir_atividades=True):
-    css = """
+def linhas_relatorio_html(consumo_filtrado, atividades_filtrado, peso_filtrado, pontos_semana, data_inicio, data_fim, incluir_consumo=True, incluir_atividades=True):
+    """Gera o relatório em pedaços (cabeçalho, uma linha de tabela por registro, rodapé)."""
+    yield """<html><head>
     <style>
         table {border-collapse: collapse; width: 100%;}
         th {background-color: #2ecc71; color: white; padding: 8px; text-align: left;}
@@ -1588,56 +4103,159 @@ def gerar_html_relatorio(consumo_filtrado, atividades_filtrado, peso_filtrado, p
         tr:nth-child(even){background-color: #f2f2f2;}
         h1, h2 {color: #2c3e50;}
     </style>
-    """
-    html = f"<html><head>{css}</head><body>"
-    html += f"<h1>Histórico Acumulado - Vigilantes do Peso</h1>"
-    html += f"<p>Período: {data_inicio.strftime('%d/%m/%Y')} → {data_fim.strftime('%d/%m/%Y')}</p>"
+    </head><body>"""
+    yield "<h1>Histórico Acumulado - Vigilantes do Peso</h1>"
+    yield f"<p>Período: {data_inicio.strftime('%d/%m/%Y')} → {data_fim.strftime('%d/%m/%Y')}</p>"
 
     # Pontos Semanais
-    html += "<h2>Pontos Semanais</h2><table><tr><th>Semana</th><th>Data</th><th>Nome</th><th>Quantidade</th><th>Pontos</th><th>Extras usados</th></tr>"
+    yield "<h2>Pontos Semanais</h2><table><tr><th>Semana</th><th>Pontos</th><th>Extras usados</th><th>Extras restantes</th><th>Atividades</th></tr>"
     for w in pontos_semana:
-        for r in w.get("pontos", []):
-            r_data = parse_date(r["data"])
-            if r_data and data_inicio <= r_data <= data_fim:
-                html += f"<tr><td>{w['semana']}</td><td>{r_data.strftime('%d/%m/%Y')}</td><td>{r['nome']}</td><td>{r['quantidade']}</td><td>{r['pontos']}</td><td>{r.get('usou_extras',0)}</td></tr>"
-    html += "</table>"
+        yield f"<tr><td>{w['ano']}-S{w['semana']:02d}</td><td>{w['pontos']}</td><td>{w['extras_usados']}</td><td>{w['extras_restantes']}</td><td>{w['atividade']}</td></tr>"
+    yield "</table>"
 
     # Consumo Diário
     if incluir_consumo:
-        html += "<h2>Consumo Diário</h2><table><tr><th>Data</th><th>Alimento</th><th>Quantidade (g)</th><th>Pontos</th><th>Extras usados</th></tr>"
+        yield "<h2>Consumo Diário</h2><table><tr><th>Data</th><th>Alimento</th><th>Quantidade (g)</th><th>Pontos</th><th>Extras usados</th></tr>"
         for r in consumo_filtrado:
             r_data = parse_date(r["data"])
-            html += f"<tr><td>{r_data.strftime('%d/%m/%Y')}</td><td>{r['nome']}</td><td>{r['quantidade']}</td><td>{r['pontos']}</td><td>{r.get('usou_extras',0)}</td></tr>"
-        html += "</table>"
+            yield f"<tr><td>{r_data.strftime('%d/%m/%Y')}</td><td>{r['nome']}</td><td>{r['quantidade']}</td><td>{r['pontos']}</td><td>{r.get('usou_extras',0)}</td></tr>"
+        yield "</table>"
 
     # Atividades Físicas
     if incluir_atividades:
-        html += "<h2>Atividades Físicas</h2><table><tr><th>Data</th><th>Tipo de Atividade</th><th>Duração (min)</th><th>Pontos</th></tr>"
+        yield "<h2>Atividades Físicas</h2><table><tr><th>Data</th><th>Tipo de Atividade</th><th>Duração (min)</th><th>Pontos</th></tr>"
         for d, lst in sorted(atividades_filtrado.items()):
             for a in lst:
-                html += f"<tr><td>{d.strftime('%d/%m/%Y')}</td><td>{a['nome']}</td><td>{a['quantidade']}</td><td>{a['pontos']}</td></tr>"
-        html += "</table>"
+                yield f"<tr><td>{d.strftime('%d/%m/%Y')}</td><td>{a['nome']}</td><td>{a['quantidade']}</td><td>{a['pontos']}</td></tr>"
+        yield "</table>"
 
     # Peso
-    html += "<h2>Peso</h2><table><tr><th>Data</th><th>Peso (kg)</th></tr>"
+    yield "<h2>Peso</h2><table><tr><th>Data</th><th>Peso (kg)</th></tr>"
     for p,d in peso_filtrado:
-        html += f"<tr><td>{d.strftime('%d/%m/%Y')}</td><td>{p:.2f}</td></tr>"
-    html += "</table>"
+        yield f"<tr><td>{d.strftime('%d/%m/%Y')}</td><td>{p:.2f}</td></tr>"
+    yield "</table>"
+
+    yield "</body></html>"
+
+def gerar_html_relatorio(*args, **kwargs):
+    """Documento completo em bytes (entrada do ExportadorPDF), juntando os pedaços de linhas_relatorio_html."""
+    return "".join(linhas_relatorio_html(*args, **kwargs)).encode("utf-8")
+
+def gravar_html_relatorio(destino, *args, **kwargs):
+    """Escreve os pedaços de linhas_relatorio_html direto no arquivo, sem montar o documento em memória."""
+    with open(destino, "w", encoding="utf-8") as f:
+        f.writelines(linhas_relatorio_html(*args, **kwargs))
 
-    html += "</body></html>"
-    return html
+def chave_relatorio(data_inicio, data_fim, incluir_consumo, incluir_atividades):
+    """
+    Chave do relatório em sessão e no ExportadorPDF do processo. A versão é a dos dados do usuário em disco
+    (versao_dados_usuario), igual em qualquer sessão: sessões com os mesmos dados compartilham o PDF e
+    uma gravação de qualquer uma delas muda a chave de todas.
+    """
+    email = st.session_state.get("current_user")
+    return (email, data_inicio, data_fim, incluir_consumo, incluir_atividades,
+            versao_dados_usuario(get_user_store(), email))
+
+def relatorio_em_cache(data_inicio, data_fim, incluir_consumo, incluir_atividades):
+    """Caminho do relatório já gerado para (usuário, período, opções, versão dos dados), ou None."""
+    chave = chave_relatorio(data_inicio, data_fim, incluir_consumo, incluir_atividades)
+    cache = st.session_state.get("relatorio_html")
+    valido = cache and cache["chave"] == chave and os.path.exists(cache["caminho"])
+    return (cache["caminho"] if valido else None), chave
 
 # -----------------------------
-# Função para criar botão de download
+# Botão de download do relatório
 # -----------------------------
-def botao_download_html(html_content):
-    b64 = base64.b64encode(html_content.encode()).decode()
-    st.markdown(
-        f'<a href="data:text/html;base64,{b64}" download="historico_acumulado.html">'
-        f'<button style="padding:10px 20px; font-size:16px; background-color:#2ecc71; color:white; border:none; border-radius:5px; cursor:pointer;">Gerar Relatório</button>'
-        f'</a>',
-        unsafe_allow_html=True
-    )
+def botao_download_relatorio(data_inicio, data_fim, incluir_consumo, incluir_atividades, gravar_conteudo):
+    """
+    O relatório só é escrito quando o usuário pede ("Gerar Relatório"), num arquivo temporário; a sessão
+    guarda só o caminho (em cache pela chave do relatório) e o st.download_button lê do arquivo.
+    """
+    caminho, chave = relatorio_em_cache(data_inicio, data_fim, incluir_consumo, incluir_atividades)
+    if caminho is None:
+        if not st.button("📄 Gerar Relatório", key="gerar_relatorio"):
+            return
+        descartar_relatorio()
+        fd, caminho = tempfile.mkstemp(prefix="ww_relatorio_", suffix=".html")
+        os.close(fd)
+        try:
+            gravar_conteudo(caminho)
+        except Exception:
+            os.remove(caminho)
+            raise
+        st.session_state.relatorio_html = {"chave": chave, "caminho": caminho}
+    try:
+        with open(caminho, "rb") as f:
+            st.download_button(
+                "⬇️ Baixar Relatório (HTML)", data=f,
+                file_name="historico_acumulado.html", mime="text/html", key="baixar_relatorio"
+            )
+    except FileNotFoundError:
+        st.session_state.pop("relatorio_html", None)
+
+def botao_exportar_pdf(data_inicio, data_fim, incluir_consumo, incluir_atividades, gerar_conteudo):
+    """Pede o PDF ao pool de workers e acompanha o job; a página não espera a renderização."""
+    exportador = get_exportador_pdf()
+    if exportador is None:
+        st.caption("Exportação em PDF indisponível: instale o pdfkit e o wkhtmltopdf.")
+        return
+    chave = chave_relatorio(data_inicio, data_fim, incluir_consumo, incluir_atividades)
+    job_id = exportador.job_da_chave(chave)
+    job = exportador.status(job_id) if job_id else None
+    if job is None or job["status"] == "erro":
+        if job is not None:
+            st.error(f"Erro ao gerar o PDF: {job['erro']}")
+        if st.button("🖨️ Gerar PDF", key="gerar_pdf"):
+            exportador.solicitar(chave, gerar_conteudo)
+            st.info("PDF em geração. Use \"Atualizar status\" para acompanhar.")
+        return
+    if job["status"] != "pronto":
+        st.info("PDF em geração...")
+        st.button("🔄 Atualizar status", key="status_pdf")
+        return
+    try:
+        with open(job["caminho"], "rb") as f:
+            st.download_button(
+                "⬇️ Baixar Relatório (PDF)", data=f.read(),
+                file_name="historico_acumulado.pdf", mime="application/pdf", key="baixar_pdf"
+            )
+    except FileNotFoundError:
+        # Descartado por outra sessão que pediu uma versão mais nova dos mesmos dados
+        st.button("🔄 Atualizar status", key="status_pdf")
+
+def exportacao_historico_usuario():
+    """
+    Histórico completo do usuário em Parquet ou CSV, gerado sob demanda num arquivo temporário. A sessão
+    guarda só o caminho (em cache pela versão dos dados em disco) e o download é lido do arquivo.
+    """
+    formatos = (["Parquet"] if pa is not None else []) + ["CSV"]
+    formato = st.radio("Formato da exportação", formatos, horizontal=True, key="exportacao_formato").lower()
+    email = st.session_state.get("current_user")
+    chave = (email, formato, versao_dados_usuario(get_user_store(), email))
+    cache = st.session_state.get("exportacao_historico")
+    if not cache or cache["chave"] != chave or not os.path.exists(cache["caminho"]):
+        if not st.button("📦 Exportar histórico completo", key="exportar_historico"):
+            return
+        descartar_exportacao()
+        fd, caminho = tempfile.mkstemp(prefix="ww_export_", suffix=f".{formato}")
+        os.close(fd)
+        try:
+            exportar_historico(email, caminho, formato)
+        except Exception:
+            os.remove(caminho)
+            raise
+        cache = {"chave": chave, "caminho": caminho}
+        st.session_state.exportacao_historico = cache
+    try:
+        with open(cache["caminho"], "rb") as f:
+            st.download_button(
+                f"⬇️ Baixar histórico ({formato.upper()})", data=f,
+                file_name=f"historico_{email}.{formato}",
+                mime="application/vnd.apache.parquet" if formato == "parquet" else "text/csv",
+                key="baixar_exportacao"
+            )
+    except FileNotFoundError:
+        st.session_state.pop("exportacao_historico", None)
 
 # -----------------------------
 # Página Históricos Acumulados (AJUSTADA COM FORMATAÇÃO BR)
@@ -1655,28 +4273,21 @@ def historico_acumulado_page():
     incluir_atividades = st.checkbox("Incluir atividades físicas", value=True)
     incluir_consumo = st.checkbox("Incluir consumo diário", value=True)
 
-    historico = st.session_state.get("historico_acumulado", [])
-
-    # Filtrar registros
-    consumo_filtrado = [
-        r for r in historico
-        if r.get("tipo") == "consumo" and data_inicio <= parse_date(r["data"]) <= data_fim
-    ]
+    # Registros do período: uma consulta (índice por tipo e data) compartilhada com o relatório
+    periodo = consultar_periodo(data_inicio, data_fim)
+    consumo_filtrado = periodo["consumo"]
     atividades_filtrado = {}
-    for r in historico:
-        if r.get("tipo") == "atividade":
-            d = parse_date(r["data"])
-            if data_inicio <= d <= data_fim:
-                atividades_filtrado.setdefault(d, []).append(r)
+    for r in periodo["atividade"]:
+        atividades_filtrado.setdefault(parse_date(r["data"]), []).append(r)
     peso_filtrado = [
         (r.get("quantidade",0.0), parse_date(r["data"]))
-        for r in historico
-        if r.get("tipo") == "peso" and data_inicio <= parse_date(r["data"]) <= data_fim
+        for r in periodo["peso"]
     ]
 
-    # Reconstruir pontos semanais
-    rebuild_pontos_semana_from_history()
-    pontos_semana = st.session_state.get("pontos_semana", [])
+    # Pontos semanais e totais do período, lidos dos rollups materializados
+    rollups = get_rollups()
+    pontos_semana = rollups.semanas_entre(data_inicio, data_fim)
+    totais_periodo = rollups.totais(data_inicio, data_fim)
 
     # Exibir relatório
     st.subheader("📊 Relatório")
@@ -1719,29 +4330,41 @@ def historico_acumulado_page():
 
     if pontos_semana:
         st.markdown("### Pontos Semanais")
-        all_points = []
-        for w in pontos_semana:
-            for r in w.get("pontos", []):
-                r_data = parse_date(r["data"])
-                if r_data and data_inicio <= r_data <= data_fim:
-                    all_points.append({
-                        "Semana": w["semana"],
-                        "Data": r_data.strftime("%d/%m/%Y"),
-                        "Nome": r["nome"],
-                        "Quantidade": f"{r['quantidade']:.2f}".replace(".", ","),
-                        "Pontos": f"{r['pontos']:.2f}".replace(".", ","),
-                        "Extras usados": f"{r.get('usou_extras',0):.2f}".replace(".", ",")
-                    })
-        if all_points:
-            st.table(all_points)
-
-    # Botão para baixar HTML (também ajusta formatação internamente se necessário)
-    html_relatorio = gerar_html_relatorio(
+        st.table([
+            {
+                "Semana": f"{w['ano']}-S{w['semana']:02d}",
+                "Pontos": f"{w['pontos']:.2f}".replace(".", ","),
+                "Extras usados": f"{w['extras_usados']:.2f}".replace(".", ","),
+                "Extras restantes": f"{w['extras_restantes']:.2f}".replace(".", ","),
+                "Atividades": f"{w['atividade']:.2f}".replace(".", ",")
+            }
+            for w in pontos_semana
+        ])
+        st.markdown(
+            f"**Totais do período:** {totais_periodo['pontos']:.2f} pontos consumidos, "
+            f"{totais_periodo['extras_usados']:.2f} extras usados, {totais_periodo['atividade']:.2f} pontos de atividades"
+            .replace(".", ",")
+        )
+
+    if st.button("🔧 Recalcular totais a partir do histórico", key="reconstruir_rollups"):
+        reconstruir_rollups()
+        st.success("Totais diários e semanais reconstruídos a partir do histórico.")
+
+    # Relatório para download: gerado sob demanda e reaproveitado enquanto nada mudar
+    argumentos_relatorio = (
         consumo_filtrado, atividades_filtrado, peso_filtrado,
         pontos_semana, data_inicio, data_fim,
         incluir_consumo, incluir_atividades
     )
-    botao_download_html(html_relatorio)
+    def gravar_conteudo(destino):
+        gravar_html_relatorio(destino, *argumentos_relatorio)
+    def gerar_conteudo():
+        return gerar_html_relatorio(*argumentos_relatorio)
+    botao_download_relatorio(data_inicio, data_fim, incluir_consumo, incluir_atividades, gravar_conteudo)
+    botao_exportar_pdf(data_inicio, data_fim, incluir_consumo, incluir_atividades, gerar_conteudo)
+
+    st.markdown("### 📦 Exportar para análise")
+    exportacao_historico_usuario()
 
 
 # -----------------------------
@@ -1824,3 +4447,8 @@ elif st.session_state.menu == "historicos":
 elif st.session_state.menu == "sair":
     # logout já tratado no menu lateral
     pass
+
+# -----------------------------
+# FIM DA EXECUÇÃO: grava de uma vez o que foi alterado e guarda a sessão
+# -----------------------------
+finalizar_execucao()